@@ -2,18 +2,25 @@ from tensorflow import keras
 from keras import layers
 
 
-def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
+def get_model(model=None, pretrained=True, input_shape=(128, 128, 3), uint8_input=False):
     
     if pretrained:
         weights = "imagenet"
     else:
         weights = None
+
+    # uint8 images are only converted to float in [0, 1] by the first layer
+    if uint8_input:
+        inputs = layers.Input(input_shape, dtype="uint8")
+        input_tensor = layers.Rescaling(1. / 255)(inputs)
+    else:
+        input_tensor = layers.Input(input_shape)
     
     if model.lower() == "xception":
         base_model = keras.applications.Xception(
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
@@ -21,7 +28,7 @@ def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
         base_model = keras.applications.VGG16(  
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
@@ -29,7 +36,7 @@ def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
         base_model = keras.applications.VGG19(
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
@@ -37,7 +44,7 @@ def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
         base_model = keras.applications.ResNet50V2(
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
@@ -45,7 +52,7 @@ def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
         base_model = keras.applications.ResNet101V2(
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
@@ -53,7 +60,7 @@ def get_model(model=None, pretrained=True, input_shape=(128, 128, 3)):
         base_model = keras.applications.ResNet152V2(
             include_top=False,
             weights=weights,
-            input_tensor=layers.Input(input_shape),
+            input_tensor=input_tensor,
             pooling="avg",
         )
         return base_model
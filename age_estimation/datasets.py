@@ -1,52 +1,261 @@
 import tensorflow as tf
 import os
+import json
+import glob
+import hashlib
+import numpy as np
 from experiment.dataset import Dataset
 
 
 class ImageDataset(Dataset):
     """A dataset of images loaded from files.
+
+    Subclasses build a table of (path, label) pairs once when the data is loaded,
+    so that each epoch only needs to read the image files.
+
+    If cache_dir contains a cache built with build_cache, the images are read from
+    sharded TFRecord files holding the decoded and resized uint8 images and their
+    labels instead of decoding the original files every epoch. The records of each
+    split are copied once to their own shards in cache_dir, so an epoch only reads the
+    records of its split.
+
+    Images are decoded in parallel. JPEGs that are at least twice as large as the
+    target size are decoded at a reduced resolution using DCT scaling before resizing.
     
     Params:
         size - the width (and height) of the image after resizing
         channels - 1 or 3; the number of color channels
+        cache_dir - the directory containing the decoded image cache; None to always read the image files
+        deterministic - True if the parallel decoding must preserve the order of the samples
+        uint8 - True if the images are produced as uint8 tensors in [0, 255] instead of
+            float32 tensors in [0, 1]; the model must then rescale its inputs
+            (see age_estimation.base_models.get_model)
+        cache_buffer - the size of the shuffle buffer of cached records if buffer_size is None
         **kwargs - arguments for the dataset class; includes buffer_size, batch_size, prefetch 
     """
 
-    def __init__(self, size=128, channels=3, **kwargs) -> None:
+    def __init__(self, size=128, channels=3, cache_dir=None, deterministic=False, uint8=False, cache_buffer=1024, **kwargs) -> None:
         self.size = size
         self.channels = channels
+        self.cache_dir = cache_dir
+        self.deterministic = deterministic
+        self.uint8 = uint8
+        self.cache_buffer = cache_buffer
         super().__init__(**kwargs)
 
     def preprocess(self, x):
-        """Process the image data from a file.
+        """Process the image data from a file or cached record.
         
         Params:
-            x - the filename
+            x - the dataset of (path, label) pairs or cached records
 
         Returns: a tuple of the image tensor and label
         """
-        return x.map(lambda x: self.parse_image(x))
+        if self.is_cached():
+            parse = self.parse_record
+        else:
+            parse = self.parse_image
+        return x.map(parse, num_parallel_calls=tf.data.AUTOTUNE, deterministic=self.deterministic)
 
-    def parse_image(self, filename):
-        """Read the image from a file and convert to a tensor and determine the label.
+    def parse_image(self, filename, label):
+        """Read the image from a file and convert to a tensor.
 
         Params:
             filename - the path to the image file
+            label - the label of the image
         
         Returns image, label - the (size, size, channels) tensor for the image and its label
         """
-        label = self.parse_label(filename)
-
-        image = tf.io.read_file(filename)
-        image = tf.io.decode_jpeg(image, channels=self.channels)
-        image = tf.image.convert_image_dtype(image, tf.float32)
-        image = tf.image.resize(image, [self.size, self.size])
+        image = self.decode_image(filename)
+        if self.uint8:
+            image = self.to_uint8(image)
+        else:
+            image = image / 255.
         return image, label
 
-    def parse_label(self, filename):
-        """Parse the label from a filename."""
+    def get_label(self, filename):
+        """Return the label of an image given its path."""
+        pass
+
+    def list_files(self, pattern):
+        """Return a tf.data.Dataset of (path, label) pairs for the files matching a pattern.
+        The files are sorted and their labels are resolved once.
+
+        Params:
+            pattern - the glob pattern of the image files
+        """
+        files = sorted(glob.glob(pattern))
+        labels = [float(self.get_label(x)) for x in files]
+        return tf.data.Dataset.from_tensor_slices((files, tf.constant(labels, tf.float32)))
+
+    def get_files(self):
+        """Return a tf.data.Dataset of the (path, label) pairs of the images."""
         pass
 
+    def get_data(self):
+        """Return the cached records if the cache has been built, otherwise the image filenames."""
+        if self.is_cached():
+            return self.read_cache()
+        return self.get_files()
+
+    def select(self, data, indices):
+        """Return a dataset with the elements of data at the given indices.
+        Cached records can only be read in order, so the records of the split are
+        read from their own shards in a random order each epoch and shuffled with a
+        bounded buffer instead of gathering the images into memory.
+        
+        Params:
+            data - the tf.data.Dataset to select from
+            indices - an array of sample indices
+        """
+        if not self.is_cached():
+            return super().select(data, indices)
+        files = self.split_cache(data, indices)
+        ds = tf.data.Dataset.from_tensor_slices(files).shuffle(len(files), seed=self.seed, reshuffle_each_iteration=True)
+        ds = ds.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=len(files),
+            block_length=1,
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=self.deterministic
+        )
+        ds = ds.apply(tf.data.experimental.assert_cardinality(len(indices)))
+        buf = self.buf if self.buf is not None else min(self.cache_buffer, max(len(indices), 1))
+        return ds.shuffle(buf, seed=self.seed, reshuffle_each_iteration=True)
+
+    def split_cache(self, data, indices, num_shards=16):
+        """Return the shards holding the cached records at the given indices.
+        The records are copied from the full cache the first time a split is used.
+        
+        Params:
+            data - the tf.data.Dataset of all cached records
+            indices - an array of sample indices
+            num_shards - the number of TFRecord files to write
+        """
+        key = hashlib.sha1(np.sort(np.asarray(indices, np.int64)).tobytes()).hexdigest()[:16]
+        split_dir = os.path.join(self.cache_dir, "splits", key)
+        meta_file = os.path.join(split_dir, "split.json")
+        if os.path.exists(meta_file):
+            with open(meta_file, "r") as in_file:
+                meta = json.load(in_file)
+            return [os.path.join(split_dir, x) for x in meta["shards"]]
+
+        os.makedirs(split_dir, exist_ok=True)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[indices] = True
+        mask = tf.constant(mask)
+        ds = data.enumerate().filter(lambda i, x: mask[i]).map(lambda i, x: x)
+
+        num_shards = max(min(num_shards, len(indices)), 1)
+        shards = [f"split-{i:05d}-of-{num_shards:05d}.tfrecord" for i in range(num_shards)]
+        writers = [tf.io.TFRecordWriter(os.path.join(split_dir, x)) for x in shards]
+        for n, record in enumerate(ds.as_numpy_iterator()):
+            writers[n % num_shards].write(record)
+        for writer in writers:
+            writer.close()
+
+        # Written last, so an interrupted copy is redone on the next run
+        with open(meta_file, "w") as out_file:
+            json.dump({"count": len(indices), "shards": shards}, out_file, indent=4)
+        return [os.path.join(split_dir, x) for x in shards]
+
+    def is_cached(self):
+        """Return True if the decoded image cache has been built."""
+        return self.cache_dir is not None and os.path.exists(os.path.join(self.cache_dir, "cache.json"))
+
+    def decode_image(self, filename):
+        """Read the image from a file and resize it.
+        Large JPEGs are decoded at 1/2, 1/4, or 1/8 of their resolution as long
+        as both sides stay at least as large as the target size.
+        
+        Params:
+            filename - the path to the image file
+        
+        Returns: the (size, size, channels) float32 tensor for the image with values in [0, 255]
+        """
+        contents = tf.io.read_file(filename)
+        shape = tf.io.extract_jpeg_shape(contents)
+        short_side = tf.minimum(shape[0], shape[1])
+
+        # Index of the largest DCT scaling ratio (1, 2, 4, 8) that keeps the short side >= size
+        ratios = [1, 2, 4, 8]
+        index = tf.reduce_sum(tf.cast(short_side // tf.constant(ratios[1:]) >= self.size, tf.int32))
+        branches = [lambda r=r: tf.io.decode_jpeg(contents, channels=self.channels, ratio=r) for r in ratios]
+        image = tf.switch_case(index, branches)
+        return tf.image.resize(image, [self.size, self.size])
+
+    def to_uint8(self, image):
+        """Round an image with values in [0, 255] to a uint8 tensor."""
+        return tf.cast(tf.clip_by_value(tf.round(image), 0., 255.), tf.uint8)
+
+    def build_cache(self, num_shards=16):
+        """Decode and resize every image once and write them with their labels to cache_dir.
+        Sample i is written to shard i % num_shards, so reading the shards in turn
+        restores the order of the image files.
+        
+        Params:
+            num_shards - the number of TFRecord files to write
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = self.get_files()
+        ds = files.map(
+            lambda f, y: (self.to_uint8(self.decode_image(f)), y),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=True
+        )
+
+        shards = [f"images-{i:05d}-of-{num_shards:05d}.tfrecord" for i in range(num_shards)]
+        writers = [tf.io.TFRecordWriter(os.path.join(self.cache_dir, x)) for x in shards]
+        n = 0
+        for image, label in ds.as_numpy_iterator():
+            example = tf.train.Example(features=tf.train.Features(feature={
+                "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                "label": tf.train.Feature(float_list=tf.train.FloatList(value=[float(label)]))
+            }))
+            writers[n % num_shards].write(example.SerializeToString())
+            n += 1
+        for writer in writers:
+            writer.close()
+
+        meta = {"size": self.size, "channels": self.channels, "count": n, "shards": shards}
+        with open(os.path.join(self.cache_dir, "cache.json"), "w") as out_file:
+            json.dump(meta, out_file, indent=4)
+
+    def read_cache(self):
+        """Return a tf.data.Dataset of the cached records in the original file order."""
+        with open(os.path.join(self.cache_dir, "cache.json"), "r") as in_file:
+            meta = json.load(in_file)
+        if meta["size"] != self.size or meta["channels"] != self.channels:
+            raise ValueError(f"Cache in {self.cache_dir} has images of size {meta['size']} with {meta['channels']} channels")
+
+        files = [os.path.join(self.cache_dir, x) for x in meta["shards"]]
+        ds = tf.data.Dataset.from_tensor_slices(files).interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=len(files),
+            block_length=1,
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=True
+        )
+        return ds.apply(tf.data.experimental.assert_cardinality(meta["count"]))
+
+    def parse_record(self, record):
+        """Return the float image and label stored in a cached record.
+        
+        Params:
+            record - a serialized tf.train.Example written by build_cache
+
+        Returns image, label - the (size, size, channels) tensor for the image and its label
+        """
+        features = tf.io.parse_single_example(record, {
+            "image": tf.io.FixedLenFeature([], tf.string),
+            "label": tf.io.FixedLenFeature([], tf.float32)
+        })
+        image = tf.io.decode_raw(features["image"], tf.uint8)
+        image = tf.reshape(image, (self.size, self.size, self.channels))
+        if not self.uint8:
+            image = tf.image.convert_image_dtype(image, tf.float32)
+        return image, features["label"]
+
 
 class MegaAgeDataset(ImageDataset):
     """MegaAge Asian age estimation dataset.
@@ -66,69 +275,56 @@ class MegaAgeDataset(ImageDataset):
         super().__init__(**kwargs)
 
     def load(self):
-        """Load the images."""
+        """Load the image paths and their labels."""
         if self.aligned:
             dirs = "train_aligned", "test_aligned"
         else:
             dirs = "train", "test"
-            
-        train_glob = os.path.join(self.path, dirs[0], "*")
-        test_glob = os.path.join(self.path, dirs[1], "*")
-
-        train_ds = tf.data.Dataset.list_files(train_glob, shuffle=False)
-        test_ds = tf.data.Dataset.list_files(test_glob, shuffle=False)
 
-        y_train, y_test = self.load_labels(len(train_ds), len(test_ds))
-        self.n_train = y_train.shape[0]
-        self.labels = tf.concat((y_train, y_test), axis=0)
+        y_train, y_test = self.load_labels()
+        self.n_train = len(y_train)
+        self.labels = {dirs[0]: y_train, dirs[1]: y_test}
         self.test_dir = dirs[1]
-        self.train = train_ds
-        self.test = test_ds
+        self.train = self.list_files(os.path.join(self.path, dirs[0], "*"))
+        self.test = self.list_files(os.path.join(self.path, dirs[1], "*"))
+        self.length = int(self.train.cardinality()) + int(self.test.cardinality())
 
     def split(self, data, val_ratio, test_ratio):
         """Return a default train-test split if val_ratio is None."""
         if val_ratio is None:
-            return self.train, self.test
+            train = self.select(data, np.arange(self.n_train))
+            test = self.select(data, np.arange(self.n_train, len(self)))
+            return train, test
         else:
             return super().split(data, val_ratio, test_ratio)
         
-    def get_data(self):
-        """Return the combined train and test data."""
-        return self.train.concatenate(self.test)
+    def get_files(self):
+        """Return the combined train and test files."""
+        ds = self.train.concatenate(self.test)
+        return ds.apply(tf.data.experimental.assert_cardinality(self.length))
 
-    def parse_label(self, filename):
-        """Parse the image label from its filename.
+    def get_label(self, filename):
+        """Return the image label given by its directory and the number in its filename.
         
         Params:
             filename - the path to the image file
 
         Returns: the age of the person in the image
         """
-        path = tf.strings.split(filename, os.sep)
-        
-        img_dir = path[-2]
-        file = path[-1]
-        index = tf.strings.to_number(tf.strings.split(file, ".")[0], out_type=tf.int32)
-        index = tf.where(tf.equal(img_dir, "test"), index + self.n_train, index)
-        return self.labels[index - 1]
+        img_dir = os.path.basename(os.path.dirname(filename))
+        index = int(os.path.basename(filename).split(".")[0])
+        return self.labels[img_dir][index - 1]
 
-    def load_labels(self, len_train, len_test):
+    def load_labels(self):
         """Load the train and test labels from text files.
-        
-        Params:
-            len_train - the number of train samples
-            len_test - the number of test samples
 
-        Returns: train, test - tensors containing train and test labels indexed by image number
+        Returns: train, test - lists containing train and test labels indexed by image number
         """
-        path = os.path.join(self.path, "list", "train_age.txt")
-        train_ds = tf.data.TextLineDataset(path).batch(len_train)
-        train = tf.strings.to_number(train_ds.get_single_element())
-
-        path = os.path.join(self.path, "list", "test_age.txt")
-        test_ds = tf.data.TextLineDataset(path).batch(len_test)
-        test = tf.strings.to_number(test_ds.get_single_element())
-        return train, test
+        labels = []
+        for name in ["train_age.txt", "test_age.txt"]:
+            with open(os.path.join(self.path, "list", name), "r") as in_file:
+                labels.append([float(x) for x in in_file.read().split()])
+        return labels[0], labels[1]
 
 
 class FGNetDataset(ImageDataset):
@@ -145,26 +341,23 @@ class FGNetDataset(ImageDataset):
         self.path = path
         super().__init__(**kwargs)
         
-    def parse_label(self, filename):
-        """Parse the age label from the 4-6th characters in the filename.
+    def get_label(self, filename):
+        """Return the age label from the 4-6th characters in the filename.
         
         Params:
             filename - the path to the image file
         
         Returns: label - the integer age of the person in the image
         """
-        parts = tf.strings.split(filename, os.sep)
-        label = tf.strings.to_number(tf.strings.substr(parts[-1], 4, 2))
-        return label
+        return int(os.path.basename(filename)[4:6])
     
     def load(self):
-        """Load the files as a tf.data.Dataset"""
-        glob = os.path.join(self.path, "*")
-        list_ds = tf.data.Dataset.list_files(glob, shuffle=False)
-        self.data = list_ds
+        """Load the files and labels as a tf.data.Dataset"""
+        self.data = self.list_files(os.path.join(self.path, "*"))
+        self.length = int(self.data.cardinality())
     
-    def get_data(self):
-        """Return the loaded data."""
+    def get_files(self):
+        """Return the loaded image files."""
         return self.data
     
 
@@ -178,7 +371,7 @@ class UTKFaceDataset(ImageDataset):
         self.path = path
         super().__init__(**kwargs)
         
-    def parse_label(self, filename):
+    def get_label(self, filename):
         """Return the age of the person in the image from the filename.
         
         Params:
@@ -186,16 +379,13 @@ class UTKFaceDataset(ImageDataset):
 
         Returns: the age of the person in the image
         """
-        parts = tf.strings.split(filename, os.sep)
-        label = tf.strings.to_number(tf.strings.split(parts[-1], "_")[0])
-        return label
+        return int(os.path.basename(filename).split("_")[0])
     
     def load(self):
-        """Load the data from files."""
-        glob = os.path.join(self.path, "*")
-        list_ds = tf.data.Dataset.list_files(glob, shuffle=False)
-        self.data = list_ds
+        """Load the files and labels."""
+        self.data = self.list_files(os.path.join(self.path, "*"))
+        self.length = int(self.data.cardinality())
 
-    def get_data(self):
-        """Return the loaded dataset"""
+    def get_files(self):
+        """Return the loaded image files"""
         return self.data
@@ -0,0 +1,123 @@
+"""Module for tuning histogram loss heads on cached backbone features.
+
+Runs a pretrained, frozen backbone over the train and test splits once and saves the
+pooled features to disk. Regression and HL-Gaussian heads can then be tuned on the
+cached features in seconds per trial, and the best head can be fine-tuned together
+with the backbone on the images afterwards.
+"""
+
+import os
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from experiment.models import Regression, HLGaussian
+from experiment.hypermodels import HyperBase, HyperHL
+
+
+def extract_features(backbone, data):
+    """Return the backbone features and labels for every sample of a split.
+
+    Params:
+        backbone - the frozen Keras model producing the pooled features
+        data - a batched tf.data.Dataset of (image, label) tuples
+
+    Returns: x, y - arrays with the features and labels
+    """
+    predict = tf.function(lambda x: backbone(x, training=False))
+    features, labels = [], []
+    for x, y in data:
+        features.append(predict(x).numpy())
+        labels.append(y.numpy())
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def cache_features(backbone, splits, path):
+    """Return the features of each split, computing and saving them to path on the first call.
+
+    Params:
+        backbone - the frozen Keras model producing the pooled features
+        splits - a list of batched tf.data.Datasets of (image, label) tuples
+        path - the .npz file in which the features are cached
+
+    Returns: a list of (x, y) array tuples, one for each split
+    """
+    if not os.path.exists(path):
+        arrays = {}
+        for i, split in enumerate(splits):
+            arrays[f"x{i}"], arrays[f"y{i}"] = extract_features(backbone, split)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, **arrays)
+    cached = np.load(path)
+    return [(cached[f"x{i}"], cached[f"y{i}"]) for i in range(len(splits))]
+
+
+def to_dataset(x, y, batch_size=32, shuffle=True):
+    """Return a batched tf.data.Dataset of cached features and labels.
+
+    Params:
+        x - the array of features
+        y - the array of labels
+        batch_size - the number of samples per mini-batch
+        shuffle - True if the samples are reshuffled each epoch
+    """
+    ds = tf.data.Dataset.from_tensor_slices((x, y))
+    if shuffle:
+        ds = ds.shuffle(len(x))
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+class HyperRegressionHead(HyperBase):
+    """Hypermodel for a regression head trained on cached features.
+
+    Params:
+        loss - the loss to compile the model with
+        metrics - the metrics to compile the model with
+    """
+
+    def __init__(self, loss="mse", metrics=None):
+        super().__init__("RegressionHead", loss, metrics)
+
+    def get_model(self, hp):
+        """Return a regression model on the identity of the features."""
+        return Regression(keras.layers.Identity())
+
+
+class HyperHLGaussianHead(HyperHL):
+    """Hypermodel for an HL-Gaussian head trained on cached features.
+
+    Params:
+        min_y - the minimum target value
+        max_y - the maximum target value
+        metrics - the metrics to compile the model with
+    """
+
+    def __init__(self, min_y, max_y, metrics=None):
+        super().__init__(min_y, max_y, "HL-GaussianHead", metrics)
+
+    def get_model(self, hp):
+        """Return an HL-Gaussian model on the identity of the features."""
+        sig_ratio = hp.Float("sig_ratio", default=1., min_value=0.5, max_value=2., step=2, sampling="log")
+        bins = self.get_bins(hp)
+        sigma = sig_ratio * (bins[1] - bins[0])
+        return HLGaussian(keras.layers.Identity(), bins, sigma)
+
+
+def fine_tune(head, backbone, train, test, learning_rate=1e-5, loss=None, metrics=None, **fit_args):
+    """Fine-tune a trained head together with its backbone on the images.
+
+    Params:
+        head - a Regression or HistModel trained on the cached features
+        backbone - the backbone used to compute the features
+        train - a batched tf.data.Dataset of (image, label) tuples for training
+        test - a batched tf.data.Dataset of (image, label) tuples for validation
+        learning_rate - the learning rate used for fine-tuning
+        loss - the loss to compile the model with; None for histogram loss models
+        metrics - the metrics to compile the model with
+        **fit_args - arguments for model.fit
+
+    Returns: the training history
+    """
+    backbone.trainable = True
+    head.base = keras.models.Sequential([backbone, head.base])
+    head.compile(optimizer=keras.optimizers.Adam(learning_rate), loss=loss, metrics=metrics)
+    return head.fit(train, validation_data=test, **fit_args)
@@ -0,0 +1,77 @@
+from tensorflow import keras
+import keras_tuner as kt
+import os
+import sys
+import json
+from age_estimation.datasets import UTKFaceDataset
+from age_estimation.base_models import get_model
+from age_estimation.features import cache_features, to_dataset, HyperRegressionHead, HyperHLGaussianHead, fine_tune
+from experiment.logging import LogGridSearch
+
+
+def main(base_dir, fine_tune_epochs=0):
+    keras.utils.set_random_seed(1)
+    n_epochs = 100
+    test_ratio = 0.1
+    image_size = 128
+    channels = 3
+    batch_size = 32
+    y_min = 0
+    y_max = 116
+    backbone_name = "vgg16"
+    directory = os.path.join(base_dir, "hypers")
+    metrics = ["mse", "mae"]
+
+    path = os.path.join(base_dir, "data", "UTKFace")
+    ds = UTKFaceDataset(path, size=image_size, channels=channels, batch_size=batch_size)
+    train, test = ds.get_split(test_ratio, shuffle=True)
+
+    # run the frozen backbone once and cache the pooled features
+    backbone = get_model(model=backbone_name, input_shape=(image_size, image_size, channels))
+    backbone.trainable = False
+    # the key hashes the split parameters and sample order, so other splits get their own cache
+    feature_file = os.path.join(base_dir, "features", f"utk_{backbone_name}_{image_size}_{ds.snapshot_key(0)}.npz")
+    (x_train, y_train), (x_test, y_test) = cache_features(backbone, [train, test], feature_file)
+    feature_train = to_dataset(x_train, y_train, batch_size)
+    feature_test = to_dataset(x_test, y_test, batch_size, shuffle=False)
+
+    # tune the heads on the cached features
+    hp = kt.HyperParameters()
+    hp.Choice("learning_rate", [1e-2, 1e-3, 1e-4])
+    hp.Choice("n_bins", [50, 100, 200])
+    hp.Choice("sig_ratio", [0.5, 1., 2.])
+    hp.Choice("padding", [0.025, 0.05, 0.1])
+
+    callbacks = [keras.callbacks.EarlyStopping(patience=10)]
+    results = {}
+    tuners = {}
+    for name, hypermodel in [("HL-Gaussian", HyperHLGaussianHead(y_min, y_max)), ("Regression", HyperRegressionHead())]:
+        tuner = LogGridSearch(
+            json_file=f"{name}_features_utk.json",
+            metrics=metrics,
+            hyperparameters=hp,
+            hypermodel=hypermodel,
+            objective="val_mse",
+            directory=directory,
+            project_name=f"utk_{backbone_name}_{name}_head",
+            overwrite=False,
+            tune_new_entries=False,
+        )
+        tuner.search(x=feature_train, epochs=n_epochs, validation_data=feature_test, verbose=2, callbacks=callbacks)
+        results[name] = tuner.get_results()
+        tuners[name] = tuner
+
+    with open("features_utk.json", "w") as out_file:
+        json.dump(results, out_file, indent=4)
+
+    # optionally fine-tune the backbone starting from the best HL-Gaussian head
+    if fine_tune_epochs > 0:
+        head = tuners["HL-Gaussian"].get_best_models(1)[0]
+        hist = fine_tune(head, backbone, train, test, metrics=metrics, epochs=fine_tune_epochs, verbose=2, callbacks=callbacks)
+        with open("fine_tune_utk.json", "w") as out_file:
+            json.dump(hist.history, out_file, indent=4)
+
+
+if __name__ == "__main__":
+    data_file = sys.argv[1]
+    main(data_file, *[int(x) for x in sys.argv[2:]])
@@ -24,7 +24,10 @@ def main(base_dir):
     directory = os.path.join(base_dir, "hypers")
     
     path = os.path.join(base_dir, "data", "FGNET", "aligned")
-    ds = FGNetDataset(path, size=image_size, channels=channels, batch_size=batch_size)
+    cache_dir = os.path.join(base_dir, "cache", "FGNET", f"{image_size}_{channels}")
+    ds = FGNetDataset(path, size=image_size, channels=channels, cache_dir=cache_dir, batch_size=batch_size)
+    if not ds.is_cached():
+        ds.build_cache()
     train, test = ds.get_split(test_ratio, shuffle=True)
     sc = Scaler(y_min, y_max)
     train = sc.transform(train)
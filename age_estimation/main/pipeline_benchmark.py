@@ -0,0 +1,45 @@
+import tensorflow as tf
+import os
+import sys
+import time
+from age_estimation.datasets import UTKFaceDataset
+
+
+def images_per_second(ds, threads, batch_size=32):
+    """Return the number of images per second produced by one pass over the image pipeline.
+
+    Params:
+        ds - the ImageDataset to read
+        threads - the number of threads used by the tf.data pipeline
+        batch_size - the number of images per batch
+    """
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = threads
+    data = ds.preprocess(ds.get_data()).batch(batch_size).with_options(options)
+
+    n = 0
+    start = time.perf_counter()
+    for image, label in data:
+        n += image.shape[0]
+    return n / (time.perf_counter() - start)
+
+
+def main(base_dir):
+    image_size = 128
+    channels = 3
+    path = os.path.join(base_dir, "data", "UTKFace")
+    cores = os.cpu_count() or 1
+    thread_counts = [2**i for i in range(cores.bit_length()) if 2**i <= cores]
+
+    print(f"{'threads':>8} {'deterministic':>14} {'uint8':>6} {'images/s':>10}")
+    for deterministic in [True, False]:
+        for uint8 in [False, True]:
+            ds = UTKFaceDataset(path, size=image_size, channels=channels, deterministic=deterministic, uint8=uint8)
+            for threads in thread_counts:
+                rate = images_per_second(ds, threads)
+                print(f"{threads:>8} {str(deterministic):>14} {str(uint8):>6} {rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    data_file = sys.argv[1]
+    main(data_file)
@@ -11,6 +11,24 @@ import os
 import gym
 
 
+def get_episodes(action_file):
+    """Return the episode index of each observation in an actions file.
+    Episodes are numbered from 0 at each reset ('R'); observations before the
+    first reset have index -1, as in the dataset generators.
+    
+    Params:
+        action_file - path to file containing the agent's actions
+
+    Returns: episodes, n
+        episodes - an integer array with one entry per observation
+        n - the number of episodes (resets) in the file
+    """
+    with open(action_file, "rb") as in_file:
+        actions = np.frombuffer(in_file.read(), dtype=np.uint8)
+    resets = actions == ord("R")
+    return (np.cumsum(resets) - 1)[~resets], int(np.sum(resets))
+
+
 class RLDataset(Dataset):
     """A dataset containing observations and returns for an RL agent from an atari game.
     
@@ -27,6 +45,8 @@ class RLDataset(Dataset):
     def __init__(self, action_file, returns_file, game=None, **kwargs) -> None:
         super().__init__(**kwargs)
         self.returns = self.get_returns(returns_file)
+        self.episodes, self.n_episodes = get_episodes(action_file)
+        self.length = len(self.episodes)
         self.file = open(action_file, "rb")
         if game is None:
             game = action_file.split(os.sep)[-1].split(".")[0]
@@ -144,7 +164,7 @@ class RLDataset(Dataset):
                 NOTE: Always alternate between training and validation when using this dataset!
         """
         self.train = True
-        n = self.file.read().count(b'R')
+        n = self.n_episodes
         self.train_n = int(n * (1 - val_ratio))
         spec = (tf.TensorSpec(shape=(4, 84, 84), dtype=tf.uint8), tf.TensorSpec(shape=(), dtype=tf.float32))
         ds = tf.data.Dataset.from_generator(self.gen, output_signature=spec)
@@ -166,6 +186,8 @@ class RLAdvanced(Dataset):
     def __init__(self, action_file, returns_file, game=None, **kwargs) -> None:
         super().__init__(**kwargs)
         self.returns = self.get_returns(returns_file)
+        self.episodes, self.n_episodes = get_episodes(action_file)
+        self.length = len(self.episodes)
         self.file = action_file
         if game is None:
             self.game = action_file.split(os.sep)[-1].split(".")[0]
@@ -280,13 +302,14 @@ class RLAdvanced(Dataset):
             train - the shuffled and batched train dataset
             val - the unshuffled validation dataset with val_steps batches
         """
-        with open(self.file, "rb") as in_file:
-            n = in_file.read().count(b'R')
+        n = self.n_episodes
         test_n = n - int(n * (1 - test_ratio))
         spec = (tf.TensorSpec(shape=(4, 84, 84), dtype=tf.uint8), tf.TensorSpec(shape=(), dtype=tf.float32))
         train = tf.data.Dataset.from_generator(lambda : self.train_gen(test_n), output_signature=spec)
+        train = train.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes >= test_n))))
         train = train.shuffle(self.buf).batch(self.batch_size).prefetch(self.prefetch)
         val = tf.data.Dataset.from_generator(lambda : self.test_gen(test_n), output_signature=spec)
+        val = val.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes < test_n))))
         val = val.take(val_steps).batch(self.batch_size).prefetch(self.prefetch)
         return train, val
     
@@ -300,11 +323,11 @@ class RLAdvanced(Dataset):
             train - the shuffled and batched train dataset
             test - the unshuffled test dataset from the beginning of the actions
         """
-        with open(self.file, "rb") as in_file:
-            n = in_file.read().count(b'R')
+        n = self.n_episodes
         test_n = n - int(n * (1 - test_ratio))
         spec = (tf.TensorSpec(shape=(4, 84, 84), dtype=tf.uint8), tf.TensorSpec(shape=(), dtype=tf.float32))
         test = tf.data.Dataset.from_generator(lambda : self.test_gen(test_n), output_signature=spec)
+        test = test.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes < test_n))))
         test = test.batch(self.batch_size).prefetch(self.prefetch)
         return test
 
@@ -323,6 +346,8 @@ class RLAlternating(Dataset):
     def __init__(self, action_file, returns_file, game=None, **kwargs) -> None:
         super().__init__(**kwargs)
         self.returns = self.get_returns(returns_file)
+        self.episodes, self.n_episodes = get_episodes(action_file)
+        self.length = len(self.episodes)
         self.file = action_file
         if game is None:
             self.game = action_file.split(os.sep)[-1].split(".")[0]
@@ -433,8 +458,10 @@ class RLAlternating(Dataset):
         cycle = int(1 / val_ratio)
         spec = (tf.TensorSpec(shape=(4, 84, 84), dtype=tf.uint8), tf.TensorSpec(shape=(), dtype=tf.float32))
         train = tf.data.Dataset.from_generator(lambda : self.train_gen(cycle), output_signature=spec)
+        train = train.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes % cycle != 0))))
         train = train.repeat().shuffle(self.buf).batch(self.batch_size).prefetch(self.prefetch)
         test = tf.data.Dataset.from_generator(lambda : self.test_gen(cycle), output_signature=spec)
+        test = test.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes % cycle == 0))))
         test = test.repeat().batch(self.batch_size).prefetch(self.prefetch)
         return train, test
     
@@ -450,5 +477,6 @@ class RLAlternating(Dataset):
         cycle = int(1 / val_ratio)
         spec = (tf.TensorSpec(shape=(4, 84, 84), dtype=tf.uint8), tf.TensorSpec(shape=(), dtype=tf.float32))
         train = tf.data.Dataset.from_generator(lambda : self.train_gen(cycle), output_signature=spec)
+        train = train.apply(tf.data.experimental.assert_cardinality(int(np.sum(self.episodes % cycle != 0))))
         train = train.repeat().batch(self.batch_size).prefetch(self.prefetch)
         return train
\ No newline at end of file
@@ -0,0 +1,250 @@
+"""Module for computing the histogram transformation bias analytically.
+
+For uniform bins of width w from b0 to bn with centers c_j, the HL-Gaussian mean of
+an input y is sum_j c_j (F(b_{j+1}) - F(b_j)) / (F(bn) - F(b0)), where F is the cdf of
+a Gaussian with mean y and scale sigma. Summation by parts turns it into
+    (c_{n-1} F(bn) - c_0 F(b0) - w sum_{j=1}^{n-1} F(b_j)) / (F(bn) - F(b0)),
+and the second moment into the same form with 2 w b_j F(b_j) in the sum. F is 0 or 1
+up to rounding for borders more than a cutoff of sigmas from y, so only a window of
+borders around y is evaluated, and the borders above it are summed in closed form.
+
+The bias splits into
+ - the mean of the truncated Gaussian (truncation bias), which has a closed form in the
+   Gaussian pdf and cdf at b0 and bn, and
+ - the expectation of the sawtooth s(Y) = c(Y) - Y (discretization bias), which for an
+   untruncated Gaussian is the Fourier series
+   sum_k w / (pi k) exp(-2 (pi k sigma / w)^2) sin(2 pi k (y - b0) / w).
+These components are kept for analysis; the sawtooth series ignores the truncation,
+which changes the sawtooth mean by about w^2 / (12 sigma^2) of the truncation bias, so
+hl_moments uses the exact sum instead.
+
+All functions broadcast over their array arguments, so biases over grids of
+y x sigma x padding are computed without building the histograms.
+"""
+
+import numpy as np
+from scipy.special import erf
+from scipy.stats import norm
+
+
+def truncated_moments(y, low, high, sigma):
+    """Compute the mean and variance of a Gaussian truncated to [low, high].
+    
+    Params:
+        y - the mean of the Gaussian
+        low - the lower bound of the support
+        high - the upper bound of the support
+        sigma - the scale of the Gaussian
+    
+    Returns: mean, var - the mean and variance of the truncated Gaussian
+    """
+    alpha = (low - y) / sigma
+    beta = (high - y) / sigma
+    z = norm.cdf(beta) - norm.cdf(alpha)
+    pdf_a, pdf_b = norm.pdf(alpha), norm.pdf(beta)
+    ratio = (pdf_a - pdf_b) / z
+    mean = y + sigma * ratio
+    var = sigma ** 2 * (1 + (alpha * pdf_a - beta * pdf_b) / z - ratio ** 2)
+    return mean, var
+
+
+def sawtooth_moments(y, b0, width, sigma, n_terms=None):
+    """Compute the moments of the sawtooth s(Y) = c(Y) - Y for an untruncated Gaussian Y.
+    
+    Params:
+        y - the mean of the Gaussian
+        b0 - any bin border
+        width - the bin width
+        sigma - the scale of the Gaussian
+        n_terms - the number of Fourier terms; None for enough terms that the
+            remaining ones are below 1e-8 of the bin width (at most 1000)
+    
+    Returns: mean, second, slope
+        mean - E[s(Y)], the discretization bias
+        second - E[s(Y)^2]
+        slope - E[s'(Y)], so that Cov(Y, s(Y)) = sigma^2 * slope
+    """
+    y, b0, width, sigma = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (y, b0, width, sigma)])
+    if n_terms is None:
+        # exp(-2 (pi k sigma / w)^2) < 1e-8 for k > 3.1 w / (pi sigma)
+        n_terms = int(np.clip(np.ceil(np.max(3.1 * width / (np.pi * sigma))), 1, 1000))
+    phase = 2 * np.pi * (y - b0) / width
+    mean, second, slope = np.zeros(y.shape), np.full(y.shape, 1 / 12), np.zeros(y.shape)
+    for k in range(1, n_terms + 1):
+        decay = np.exp(-2 * (np.pi * k * sigma / width) ** 2)
+        mean += np.sin(k * phase) * decay / (np.pi * k)
+        second += np.cos(k * phase) * decay / (np.pi * k) ** 2
+        slope += 2 * np.cos(k * phase) * decay
+    return width * mean, width ** 2 * second, slope
+
+
+def hl_moments(y, b0, width, n_bins, sigma, cutoff=8.5):
+    """Compute the mean and variance of the HL-Gaussian histogram of y over uniform bins.
+    
+    Params:
+        y - the input value
+        b0 - the first bin border
+        width - the bin width
+        n_bins - the number of bins
+        sigma - the scale of the truncated Gaussian
+        cutoff - the number of sigmas around y within which the cdf is evaluated
+    
+    Returns: mean, var - the mean and variance of the histogram
+    """
+    y, b0, width, n_bins, sigma = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (y, b0, width, n_bins, sigma)])
+    bn = b0 + n_bins * width
+    cdf = lambda b: norm.cdf((b - y) / sigma)
+
+    # Interior borders b_j, j in [1, n_bins - 1]; those below lo have F = 0
+    lo = np.clip(np.floor((y - cutoff * sigma - b0) / width), 1, n_bins)
+    window = int(np.ceil(np.max(2 * cutoff * sigma / width))) + 2
+    f_sum, bf_sum = np.zeros(y.shape), np.zeros(y.shape)
+    for i in range(window):
+        j = lo + i
+        b = b0 + j * width
+        f = np.where(j <= n_bins - 1, cdf(b), 0.)
+        f_sum += f
+        bf_sum += f * b
+    # Borders above the window have F = 1
+    hi = lo + window
+    count = np.maximum(n_bins - hi, 0)
+    f_sum += count
+    bf_sum += count * (b0 + width * (hi + n_bins - 1) / 2)
+
+    f0, fn = cdf(b0), cdf(bn)
+    c0, cn = b0 + width / 2, bn - width / 2
+    z = fn - f0
+    mean = (cn * fn - c0 * f0 - width * f_sum) / z
+    second = (cn ** 2 * fn - c0 ** 2 * f0 - 2 * width * bf_sum) / z
+    return mean, second - mean ** 2
+
+
+def hl_bias(y, b0, width, n_bins, sigma, cutoff=8.5):
+    """Compute the bias of the HL-Gaussian mean of y over uniform bins."""
+    return hl_moments(y, b0, width, n_bins, sigma, cutoff)[0] - y
+
+
+def exact_moments(y, borders, sigma):
+    """Compute the mean and variance of the HL-Gaussian histogram of y from the
+    Gaussian cdf differences at the borders (any, possibly non-uniform, borders).
+    
+    Params:
+        y - the input values; shape broadcastable with sigma
+        borders - array of increasing histogram bin borders; shape (n_bins + 1)
+        sigma - scale parameter for truncated Gaussian distribution
+    
+    Returns: mean, var - the mean and variance of the histogram
+    """
+    y = np.expand_dims(y, -1)
+    sigma = np.expand_dims(sigma, -1)
+    centers = (borders[1:] + borders[:-1]) / 2
+    cdf = erf((borders - y) / (np.sqrt(2.0) * sigma))
+    probs = (cdf[..., 1:] - cdf[..., :-1]) / (cdf[..., -1:] - cdf[..., :1])
+    mean = np.sum(probs * centers, axis=-1)
+    var = np.sum(probs * centers ** 2, axis=-1) - mean ** 2
+    return mean, var
+
+
+def padded_bins(y_min, y_max, padding, bin_width, eps=1e-9):
+    """Return the first border and the number of uniform bins covering [y_min - padding, y_max + padding].
+    The last bin ends at or just past y_max + padding. The count is rounded with a tolerance,
+    so a range spanning a whole number of bins up to rounding error gets no extra bin, which
+    np.arange can add or drop for a fractional bin_width.
+    
+    Params:
+        y_min - the minimum value of the data range
+        y_max - the maximum value of the data range
+        padding - the padding added on each side of the range
+        bin_width - the bin width
+        eps - the tolerance, in bins, of the rounding
+    
+    Returns: b0, n_bins - the first border and the number of bins
+    """
+    b0 = y_min - padding
+    n_bins = np.ceil((y_max - y_min + 2 * padding) / bin_width - eps)
+    return b0, n_bins
+
+
+def discretization_bias(y, sigs, padding_r=100):
+    """Compute the bias for each combination of sigma and y with the bins of discretization.py.
+    
+    Params:
+        y - the input samples in [0, 1]; shape (steps)
+        sigs - the sigma values (in bin widths); shape (d)
+        padding_r - the number of bins added on each side of [0, 1]
+    
+    Returns: the bias for each combination of y and sigma; shape (d, steps)
+    """
+    sigs = np.expand_dims(sigs, -1)
+    return hl_bias(y, -padding_r, 1., 2 * padding_r + 1, sigs)
+
+
+def truncation_bias(y, pads, sigma, y_min=0., y_max=1., bin_width=1.):
+    """Compute the bias for each combination of padding and y with the bins of truncation.py.
+    
+    Params:
+        y - the input samples; shape (steps)
+        pads - the padding ratios (in sigmas); shape (d)
+        sigma - the scale of the truncated Gaussian
+        y_min - the minimum value of the data range
+        y_max - the maximum value of the data range
+        bin_width - the bin width
+    
+    Returns: the bias for each combination of y and padding; shape (d, steps)
+    """
+    pads = np.expand_dims(pads, -1)
+    b0, n_bins = padded_bins(y_min, y_max, pads * sigma, bin_width)
+    return hl_bias(y, b0, bin_width, n_bins, sigma)
+
+
+def discretization_mae(sigs, steps=10001):
+    """Return the mean absolute discretization bias for each sigma (as saved by discretization.py)."""
+    y = np.linspace(0., 1., steps)
+    return np.mean(np.abs(discretization_bias(y, sigs)), axis=-1)
+
+
+def truncation_mae(pads, sigma=2., steps=100001):
+    """Return the mean absolute truncation bias for each padding ratio (as saved by truncation.py)."""
+    y = np.linspace(0., 1., steps)
+    return np.mean(np.abs(truncation_bias(y, pads, sigma)), axis=-1)
+
+
+def main(tol=1e-6):
+    """Cross-check the analytic biases against the simulation."""
+    from simulation import bias
+    from truncation import pad_difs
+
+    y = np.linspace(0., 1., 1001)
+    sigs = np.exp(np.linspace(-4, 2, 13))
+    borders = np.linspace(-100, 101, 202)
+    analytic = discretization_bias(y, sigs)
+    simulated = np.stack([bias(y, borders, sig) for sig in sigs])
+    dif = np.max(np.abs(analytic - simulated))
+    print("Discretization max abs difference:", dif)
+    assert dif < tol, dif
+
+    sigma = 2.
+    pads = np.arange(1, 21, 0.5, np.float64)
+    analytic = truncation_bias(y, pads, sigma)
+    simulated = np.stack([pad_difs(pad, y, sigma, 0., 1., 1.) for pad in pads])
+    dif = np.max(np.abs(analytic - simulated))
+    print("Truncation max abs difference:", dif)
+    assert dif < tol, dif
+
+    # Fractional bin widths, where the border count is prone to rounding
+    for pad, sig in [(3.5, 2.7), (7., 0.3)]:
+        analytic = truncation_bias(y, np.array([pad]), sig, bin_width=0.1)[0]
+        simulated = pad_difs(pad, y, sig, 0., 1., 0.1)
+        dif = np.max(np.abs(analytic - simulated))
+        print(f"Truncation (pad {pad}, sigma {sig}, width 0.1) max abs difference:", dif)
+        assert dif < tol, dif
+
+    mean, var = exact_moments(y, borders, 0.5)
+    a_mean, a_var = hl_moments(y, -100., 1., 201, 0.5)
+    dif = np.max(np.abs(a_var - var))
+    print("Variance max abs difference:", dif)
+    assert dif < tol, dif
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
 from scipy.optimize import curve_fit
+from grid import bias_grid, mae_grid
 
 
 def log_f(x, a, b):
@@ -53,22 +55,33 @@ def make_plot(x, y, approx, label):
     plt.show()
 
 
-def main():
-    """Fit curves and show the approximation for the discretization and truncation biases."""
-    disc_path = os.path.join("data", "discretization.npy")
+def main(analytic=False):
+    """Fit curves and show the approximation for the discretization and truncation biases.
+    
+    Params:
+        analytic - True to fit slices of the analytic bias grid instead of
+            loading the simulated biases saved by discretization.py and truncation.py
+    """
     sigs = np.exp(np.linspace(-4, 2, 101))[:72]
-    maes = np.load(disc_path)[:72]
-
-    curve = fit_curve(sigs, maes, (0.2, -20))
-    make_plot(sigs, maes, curve, "Discretization Error")
-
-    trunc_path = os.path.join("data", "truncation.npy")
-    trunc = np.load(trunc_path)[:16]
     pads = np.arange(1, 21, 0.5, np.float64)[:16]
+    if analytic:
+        # Grid over sigma (with the sigma = 2 used by truncation.py last) and padding
+        # (with a padding large enough to remove the truncation bias last)
+        grid_sigs = np.append(sigs, 2.)
+        grid_pads = np.append(pads, 100.)
+        maes = mae_grid(bias_grid(grid_sigs, grid_pads, np.linspace(0., 1., 10001)))
+        disc = maes[:-1, -1]
+        trunc = maes[-1, :-1]
+    else:
+        disc = np.load(os.path.join("data", "discretization.npy"))[:72]
+        trunc = np.load(os.path.join("data", "truncation.npy"))[:16]
+
+    curve = fit_curve(sigs, disc, (0.2, -20))
+    make_plot(sigs, disc, curve, "Discretization Error")
     
     curve = fit_curve(pads, trunc, (0.25, -0.5))
     make_plot(pads, trunc, curve, "Truncation Error")
 
 
 if __name__ == "__main__":
-    main()
+    main("--analytic" in sys.argv[1:])
@@ -4,7 +4,8 @@ import numpy as np
 from scipy.special import erf
 import matplotlib.pyplot as plt
 from matplotlib import cm
-from simulation import transform
+from functools import partial
+from simulation import bias, parallel_map
 
 
 def plot_difs(y, sigs, difs):
@@ -40,26 +41,20 @@ def plot_maes(sigs, maes):
     plt.show()
 
 
-def compute_difs(y, borders, sigs):
+def compute_difs(y, borders, sigs, n_workers=None):
     """Compute the bias for each combination of y and sigma.
+    The sigmas are computed in parallel processes.
     
     Params:
         y - the input samples; shape (steps)
         borders - the histogram bin borders; shape (n_bins + 1)
         sigs - the sigma values tested; shape (d)
+        n_workers - the number of processes; None for the number of CPUs
     
     Returns: 
         difs - the bias for each combination of y and sigma; shape (d, steps)
     """
-    difs = []
-    centers = (borders[1:] + borders[:-1]) / 2
-    for sigma in sigs:
-        y_trans = transform(y, borders, sigma)
-        y_new = np.dot(y_trans, centers)
-
-        dif = y_new - y
-        difs.append(dif)
-
+    difs = parallel_map(partial(bias, y, borders), sigs, n_workers)
     return np.stack(difs)
 
 
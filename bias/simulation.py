@@ -1,7 +1,14 @@
-"""Module for approximating the histogram transformation bias using simulated data."""
+"""Module for approximating the histogram transformation bias using simulated data.
+
+The simulation engine (hist_mean, bias, mean_abs_bias) processes the inputs in chunks
+and only evaluates the bins within a cutoff of each input, where the Gaussian has
+non-negligible mass, so memory stays flat no matter the number of steps or bins.
+Sweeps over sigma or padding run in a process pool with parallel_map.
+"""
 
 import numpy as np
 from scipy.special import erf
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib import cm
 
@@ -28,6 +35,96 @@ def adjust_and_erf(a, mu, sig):
     return erf((a - mu) / (np.sqrt(2.0) * sig))
 
 
+def hist_mean(inputs, borders, sigma, cutoff=8.):
+    """Compute the mean of the binned probability vectors of the inputs,
+    i.e. np.dot(transform(inputs, borders, sigma), centers), using only the bins
+    within cutoff * sigma of each input.
+    
+    Params:
+        inputs - array of input samples; shape (steps)
+        borders - array of increasing histogram bin borders; shape (n_bins + 1)
+        sigma - scale parameter for truncated Gaussian distribution
+        cutoff - the number of sigmas around each input within which the bins are evaluated
+    
+    Returns: the means of the transformed inputs; shape (steps)
+    """
+    n_bins = len(borders) - 1
+    centers = (borders[1:] + borders[:-1]) / 2
+
+    # Number of bins that can overlap [y - cutoff * sigma, y + cutoff * sigma]
+    window = int(np.ceil(2 * cutoff * sigma / np.min(np.diff(borders)))) + 2
+    window = min(window, n_bins)
+    start = np.searchsorted(borders, inputs - cutoff * sigma) - 1
+    start = np.clip(start, 0, n_bins - window)
+
+    mu = np.expand_dims(inputs, -1)
+    index = np.expand_dims(start, -1) + np.arange(window + 1)
+    border_targets = adjust_and_erf(borders[index], mu, sigma)
+    probs = border_targets[:, 1:] - border_targets[:, :-1]
+    two_z = adjust_and_erf(borders[-1], inputs, sigma) - adjust_and_erf(borders[0], inputs, sigma)
+    return np.sum(probs * centers[index[:, :-1]], axis=-1) / two_z
+
+
+def chunks(y_min, y_max, steps, chunk_size):
+    """Yield consecutive chunks of np.linspace(y_min, y_max, steps) without building the full array."""
+    step = (y_max - y_min) / (steps - 1) if steps > 1 else 0.
+    for start in range(0, steps, chunk_size):
+        yield y_min + step * np.arange(start, min(start + chunk_size, steps))
+
+
+def bias(inputs, borders, sigma, chunk_size=2**16, cutoff=8.):
+    """Compute the bias of the histogram mean for each input, one chunk at a time.
+    
+    Params:
+        inputs - array of input samples; shape (steps)
+        borders - array of increasing histogram bin borders; shape (n_bins + 1)
+        sigma - scale parameter for truncated Gaussian distribution
+        chunk_size - the number of inputs processed at a time
+        cutoff - the number of sigmas around each input within which the bins are evaluated
+    
+    Returns: the difference between the histogram mean and each input; shape (steps)
+    """
+    difs = np.empty(len(inputs))
+    for start in range(0, len(inputs), chunk_size):
+        y = inputs[start:start + chunk_size]
+        difs[start:start + chunk_size] = hist_mean(y, borders, sigma, cutoff) - y
+    return difs
+
+
+def mean_abs_bias(y_min, y_max, steps, borders, sigma, chunk_size=2**16, cutoff=8.):
+    """Compute the mean absolute bias over evenly spaced inputs, accumulated one chunk at a time.
+    
+    Params:
+        y_min - the first input
+        y_max - the last input
+        steps - the number of inputs
+        borders - array of increasing histogram bin borders; shape (n_bins + 1)
+        sigma - scale parameter for truncated Gaussian distribution
+        chunk_size - the number of inputs processed at a time
+        cutoff - the number of sigmas around each input within which the bins are evaluated
+    
+    Returns: the mean absolute bias
+    """
+    total = 0.
+    for y in chunks(y_min, y_max, steps, chunk_size):
+        total += np.sum(np.abs(hist_mean(y, borders, sigma, cutoff) - y))
+    return total / steps
+
+
+def parallel_map(func, items, n_workers=None):
+    """Apply a picklable function to each item in a process pool.
+    
+    Params:
+        func - a module-level function (or functools.partial of one)
+        items - the arguments to apply the function to
+        n_workers - the number of processes; None for the number of CPUs
+    
+    Returns: a list of the results in the order of items
+    """
+    with ProcessPoolExecutor(n_workers) as pool:
+        return list(pool.map(func, items))
+
+
 def main():
     """Run the simulation and print the borders and MAE."""
     n_bins = 100
@@ -43,17 +140,11 @@ def main():
     pad_min = y_min - padding * bin_size * sig
     pad_max = y_max + padding * bin_size * sig
 
-    y = np.linspace(y_min, y_max, steps)
     borders = np.linspace(pad_min, pad_max, n_bins + 1)
-    centers = (borders[1:] + borders[:-1]) / 2
 
     print(bin_size, borders)
 
-    y_trans = transform(y, borders, sig * bin_size)
-    y_new = np.dot(y_trans, centers)
-
-    dif = y_new - y
-    mae = np.mean(np.abs(dif))
+    mae = mean_abs_bias(y_min, y_max, steps, borders, sig * bin_size)
     print(mae)
 
 
@@ -5,11 +5,28 @@ from scipy.special import erf
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from scipy.stats import norm
-from simulation import transform
+from functools import partial
+from simulation import bias, parallel_map
+from analytic import padded_bins
 
 
-def compute_difs(y, pads, sigma, y_min, y_max, bin_width):
+def pad_difs(pad, y, sigma, y_min, y_max, bin_width):
+    """Compute the bias of each y for one padding ratio.
+    
+    Params:
+        pad - the padding ratio
+        (other params as in compute_difs)
+    
+    Returns: difs - the bias for each y; shape (steps)
+    """
+    b0, n_bins = padded_bins(y_min, y_max, pad * sigma, bin_width)
+    borders = b0 + bin_width * np.arange(int(n_bins) + 1)
+    return bias(y, borders, sigma)
+
+
+def compute_difs(y, pads, sigma, y_min, y_max, bin_width, n_workers=None):
     """Compute the bias for each combination of y and padding.
+    The paddings are computed in parallel processes.
     
     Params:
         y - the input samples; shape (steps)
@@ -18,25 +35,13 @@ def compute_difs(y, pads, sigma, y_min, y_max, bin_width):
         y_min - the minimum value of the data range
         y_max - the maximum value of the data range
         bin_width - the desired bin width for the histogram
+        n_workers - the number of processes; None for the number of CPUs
     
     Returns: 
         difs - the bias for each combination of y and padding; shape (d, steps)
     """
-    difs = []
-    for pad in pads:
-
-        bins_min = y_min - pad * sigma
-        bins_max = y_max + pad * sigma
-
-        borders = np.arange(bins_min, bins_max + bin_width, bin_width)
-        centers = (borders[1:] + borders[:-1]) / 2
-
-        y_trans = transform(y, borders, sigma)
-        y_new = np.dot(y_trans, centers)
-
-        dif = y_new - y
-        difs.append(dif)
-
+    func = partial(pad_difs, y=y, sigma=sigma, y_min=y_min, y_max=y_max, bin_width=bin_width)
+    difs = parallel_map(func, pads, n_workers)
     return np.stack(difs)
 
 
@@ -1,40 +1,155 @@
 """Dataset classes that produce Tensorflow datasets ready to use in Keras models."""
 
 import tensorflow as tf
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
 
 
 class Dataset:
     """Base dataset class. Provides an interface to get pre-batched and shuffled
     train-(val)-test splits of data to be passed into keras model training API methods.
+
+    Splits are made from a (seeded) permutation of the sample indices. Each split
+    gathers its own samples by index, and shuffling a split only shuffles its indices,
+    so no buffer of samples is needed.
+
+    Subclasses record the number of samples in self.length when the data is loaded
+    (and attach it to the data with assert_cardinality), so the length is never
+    computed by iterating over the data.
     
     Params:
-        buffer_size - the size of the shuffle buffer; None for size of dataset
+        buffer_size - the size of the shuffle buffer; None for the size of the data being shuffled
         batch_size - the number of samples per mini-batch
         prefetch - the number of mini-batches to preload
+        seed - the seed of the permutation used to shuffle the samples before splitting;
+            None to use the global NumPy random state
+        snapshot_dir - directory in which the preprocessed splits are saved and reused;
+            None to preprocess the splits on every run
+        snapshot_size - the maximum size in bytes of the snapshot directory;
+            the least recently used snapshots are removed beyond it; None for no limit
+        snapshot_shards - the number of files each snapshot is written to
+        snapshot_buffer - the size of the shuffle buffer of snapshotted elements if buffer_size is None
     """
 
-    def __init__(self, buffer_size=None, batch_size=32, prefetch=tf.data.AUTOTUNE) -> None:
+    def __init__(self, buffer_size=None, batch_size=32, prefetch=tf.data.AUTOTUNE, seed=None,
+                 snapshot_dir=None, snapshot_size=None, snapshot_shards=16, snapshot_buffer=1024) -> None:
         self.batch_size = batch_size
         self.prefetch = prefetch
         self.buf = buffer_size
+        self.seed = seed
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_size = snapshot_size
+        self.snapshot_shards = snapshot_shards
+        self.snapshot_buffer = snapshot_buffer
+        self.order = None
+        self.materialized = None
+        self.split_params = {}
+        self.length = None
         self.load()
 
-    def prepare(self, splits):
+    def prepare(self, splits, shuffle=True):
         """Prepare the data for use. Shuffle, preprocess, batch, and prefetch.
         
         Params:
             splits - list of datasets to prepare
+            shuffle - True if the splits should be shuffled with a buffer of samples
         
         Returns: data - a list of the prepared datasets
         """
         data = []
-        for x in splits:
-            x = self.shuffle(x)
+        keys = []
+        for i, x in enumerate(splits):
+            if shuffle:
+                x = self.shuffle(x)
             x = self.preprocess(x)
+            if self.snapshot_dir is not None:
+                keys.append(self.snapshot_key(i))
+                x = self.snapshot(x, keys[-1])
             x = x.batch(self.batch_size).prefetch(self.prefetch)
             data.append(x)
+        if self.snapshot_dir is not None:
+            self.evict_snapshots(keys)
         return data
 
+    def get_config(self):
+        """Return the attributes that determine the preprocessed elements of the dataset."""
+        ignored = {"prefetch", "snapshot_dir", "snapshot_size", "snapshot_shards", "snapshot_buffer", "order", "materialized", "split_params", "length"}
+        config = {"class": type(self).__name__}
+        for name, value in vars(self).items():
+            if name not in ignored and isinstance(value, (str, int, float, bool, list, tuple, dict, type(None))):
+                config[name] = value
+        return config
+
+    def snapshot_key(self, index):
+        """Return the hash identifying the preprocessed elements of a split.
+        
+        Params:
+            index - the position of the split in the list of prepared splits
+        """
+        key = {
+            "config": self.get_config(),
+            "split": self.split_params,
+            "index": index,
+            "order": None if self.order is None else hashlib.sha1(np.asarray(self.order).tobytes()).hexdigest()
+        }
+        text = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def snapshot(self, data, key):
+        """Return the elements of data saved to (on the first call) or read from a snapshot on disk.
+        The snapshot is streamed from its shards, which are read in a random order and
+        interleaved each epoch, and the elements are shuffled with a bounded buffer.
+        
+        Params:
+            data - the preprocessed tf.data.Dataset of a split
+            key - the hash of the split returned by snapshot_key
+        
+        Returns: a tf.data.Dataset with the elements of the snapshot, reshuffled each epoch
+        """
+        path = os.path.join(self.snapshot_dir, key)
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+        n = self.snapshot_shards
+
+        def reader(shards):
+            shards = shards.shuffle(n, seed=self.seed, reshuffle_each_iteration=True)
+            return shards.interleave(lambda x: x, cycle_length=n, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+
+        count = int(data.cardinality())
+        data = data.enumerate().snapshot(path, shard_func=lambda i, x: i % n, reader_func=reader)
+        data = data.map(lambda i, x: x, num_parallel_calls=tf.data.AUTOTUNE)
+        if count >= 0:
+            data = data.apply(tf.data.experimental.assert_cardinality(count))
+        buf = self.buf
+        if buf is None:
+            buf = min(self.snapshot_buffer, count) if count > 0 else self.snapshot_buffer
+        return data.shuffle(buf, seed=self.seed, reshuffle_each_iteration=True)
+
+    def evict_snapshots(self, keep=()):
+        """Remove the least recently used snapshots until the directory is within snapshot_size.
+        
+        Params:
+            keep - the keys of the snapshots that are never removed
+        """
+        if self.snapshot_size is None or not os.path.isdir(self.snapshot_dir):
+            return
+        snapshots = []
+        for key in os.listdir(self.snapshot_dir):
+            path = os.path.join(self.snapshot_dir, key)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+                snapshots.append((os.path.getmtime(path), key, path, size))
+        total = sum(s[3] for s in snapshots)
+        for mtime, key, path, size in sorted(snapshots):
+            if total <= self.snapshot_size:
+                break
+            if key not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
     def load(self):
         """Read the data from input files/directories."""
         pass
@@ -49,7 +164,9 @@ class Dataset:
         Returns: a tf.data.Dataset with the shuffled data
         """
         if self.buf is None:
-            buf = len(self)
+            buf = int(data.cardinality())
+            if buf < 0:
+                buf = len(self)
         else:
             buf = self.buf
         return data.shuffle(buf, reshuffle_each_iteration=reshuffle)
@@ -67,8 +184,12 @@ class Dataset:
         pass
 
     def __len__(self):
-        """Return the number of samples in the dataset."""
-        return len(self.get_data())
+        """Return the number of samples in the dataset.
+        Uses the length recorded at load time, or else the known cardinality of the data.
+        """
+        if self.length is None:
+            self.length = len(self.get_data())
+        return self.length
 
     def get_split(self, val_ratio, test_ratio=None, shuffle=False):
         """Create a train-val-(test) split from the data.
@@ -83,13 +204,62 @@ class Dataset:
         Returns: a list of tf.data.Datasets containing the splits ready for use in a model
         """
         data = self.get_data()
-        
-        if shuffle:
-            data = self.shuffle(data, False)
+        self.order = self.get_order(shuffle)
+        self.split_params = {"val_ratio": val_ratio, "test_ratio": test_ratio, "shuffle": shuffle}
 
         splits = self.split(data, val_ratio, test_ratio)        
 
-        return self.prepare(splits)
+        return self.prepare(splits, shuffle=False)
+
+    def get_order(self, shuffle=False):
+        """Return the order in which the sample indices are split.
+        
+        Params:
+            shuffle - True for a (seeded) random permutation, False for the original order
+        """
+        if not shuffle:
+            return np.arange(len(self))
+        if self.seed is None:
+            return np.random.permutation(len(self))
+        return np.random.default_rng(self.seed).permutation(len(self))
+
+    def get_range(self, start, end):
+        """Return the sample indices between two positions of the split order."""
+        if self.order is None:
+            self.order = self.get_order()
+        return self.order[start:end]
+
+    def materialize(self, data):
+        """Return all elements of data stacked into tensors. Computed once for each dataset.
+        
+        Params:
+            data - the unbatched tf.data.Dataset to materialize
+        """
+        if self.materialized is None or self.materialized[0] is not data:
+            self.materialized = (data, data.batch(len(self)).get_single_element())
+        return self.materialized[1]
+
+    def index_dataset(self, indices):
+        """Return a dataset of the given sample indices that is reshuffled each epoch.
+        
+        Params:
+            indices - an array of sample indices
+        """
+        ds = tf.data.Dataset.from_tensor_slices(tf.constant(indices, tf.int64))
+        return ds.shuffle(max(len(indices), 1), seed=self.seed, reshuffle_each_iteration=True)
+
+    def select(self, data, indices):
+        """Return a dataset with the elements of data at the given indices.
+        
+        Params:
+            data - the tf.data.Dataset to select from
+            indices - an array of sample indices
+        
+        Returns: a tf.data.Dataset with the selected samples, reshuffled each epoch
+        """
+        tensors = self.materialize(data)
+        gather = lambda i: tf.nest.map_structure(lambda t: tf.gather(t, i), tensors)
+        return self.index_dataset(indices).map(gather, num_parallel_calls=tf.data.AUTOTUNE)
     
     def split(self, data, val_ratio, test_ratio):
         """Split the dataset into train-val-(test).
@@ -121,8 +291,8 @@ class Dataset:
         test_len = self.get_num(test_ratio)
         train_len = len(self) - test_len
 
-        train = data.take(train_len)
-        test = data.skip(train_len).take(test_len)
+        train = self.select(data, self.get_range(0, train_len))
+        test = self.select(data, self.get_range(train_len, train_len + test_len))
         return train, test
 
     def get_num(self, size):
@@ -152,9 +322,9 @@ class Dataset:
         """
         test_len = self.get_num(test_ratio)
         val_len = self.get_num(val_ratio)
-        train_len = len(data) - val_len - test_len
+        train_len = len(self) - val_len - test_len
 
-        train = data.take(train_len)
-        val = data.skip(train_len).take(val_len)
-        test = data.skip(train_len + val_len)
+        train = self.select(data, self.get_range(0, train_len))
+        val = self.select(data, self.get_range(train_len, train_len + val_len))
+        test = self.select(data, self.get_range(train_len + val_len, len(self)))
         return train, val, test
@@ -3,11 +3,17 @@ Utility module to convert experiment results.
 
 Run configuration:
     python3 jsontocsv.py in_file1.json ... in_fileN.json out_file.csv
+
+Input files can also be JSONL trial logs written by LogGridSearch; the
+model name of a trial log is the name of the file without its extension,
+or the name of its project directory for the default trials.jsonl.
 """
 
 import pandas as pd
 import json
+import os
 import sys
+from experiment.trial_log import read_trial_log
 
 
 class JSONCSVConverter:
@@ -45,13 +51,18 @@ class JSONCSVConverter:
         self.write(out_file, df)
 
     def read(self, in_file):
-        """Read that data from a JSON file.
+        """Read that data from a JSON file or a JSONL trial log.
         
         Params:
-            in_file - the path to the JSON 
+            in_file - the path to the JSON or JSONL file
 
         Returns: the dict containing the data
         """
+        if in_file.endswith(".jsonl"):
+            name = os.path.splitext(os.path.basename(in_file))[0]
+            if name == "trials":
+                name = os.path.basename(os.path.dirname(os.path.abspath(in_file)))
+            return {name: read_trial_log(in_file)}
         with open(in_file, "r") as json_file:
             data = json.load(json_file)
         return data
@@ -5,46 +5,85 @@ LogGridSearch class.
 
 import keras_tuner as kt
 import json
+import os
+from experiment.trial_log import open_trial_log, read_trial_log
 
 
 class LogGridSearch(kt.GridSearch):
     """Tuner class that stores trial results in a dict.
-    
+
+    Each epoch is appended as one line to a JSONL trial log, which is
+    synced to disk every sync_every lines and at the end of each trial.
+    The log is closed when the search ends. A partial last line left by a
+    crash is removed when the log is reopened. The results dict is rebuilt
+    from the log when it is requested.
+
     Params:
+        json_file - the JSON file written by save_results
+        log_file - the JSONL trial log; defaults to trials.jsonl in the project directory
+        sync_every - the number of lines written between syncs of the trial log
         kwargs - arguments for GridSearch class
             ***Should contain metrics!
     """
 
-    def __init__(self, json_file="temp_results.json", **kwargs):
+    def __init__(self, json_file="temp_results.json", log_file=None, sync_every=50, **kwargs):
         super().__init__(**kwargs)
-        self.logs = {}
+        self.logs = None
         self.metric_list = ["loss", "val_loss"]
         for key in self.metrics:
             self.metric_list.append(key)
             self.metric_list.append("val_" + key)
         self.out_file = json_file
+        # each project gets its own log, so tuners sharing a json_file do not mix their trials
+        if log_file is None:
+            os.makedirs(os.path.join(self.directory, self.project_name), exist_ok=True)
+            log_file = os.path.join(self.directory, self.project_name, "trials.jsonl")
+        self.log_file = log_file
+        self.sync_every = sync_every
+        self.pending = 0
+        # trials of earlier searches are kept unless the tuner starts over
+        mode = "w" if kwargs.get("overwrite", False) else "a"
+        self.log = open_trial_log(self.log_file, mode)
+
+    def write_row(self, row):
+        """Append a row to the trial log and sync it every sync_every rows."""
+        self.log.write(json.dumps(row) + "\n")
+        self.logs = None
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Flush the trial log to disk."""
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.pending = 0
+
+    def on_search_begin(self):
+        """Reopen the trial log if an earlier search closed it."""
+        super().on_search_begin()
+        if self.log.closed:
+            self.log = open_trial_log(self.log_file, "a")
+
+    def on_search_end(self):
+        """Sync and close the trial log when the search ends."""
+        super().on_search_end()
+        self.sync()
+        self.log.close()
 
     def on_trial_begin(self, trial):
-        """Initialize the dict entry when the trial begins.
-        
+        """Log the hyperparameters when the trial begins.
+
         Params:
             trial - the Trial instance; contains hyperparameters
         """
         super().on_trial_begin(trial)
-        self.logs[trial.trial_id] = {}
-        self.logs[trial.trial_id]["hypers"] = trial.hyperparameters.values
-        self.logs[trial.trial_id]["results"] = []
+        self.write_row({"trial": trial.trial_id, "hypers": trial.hyperparameters.values})
         self.ex_num = -1
 
-    def init_run(self):
-        empty = {}
-        for key in self.metric_list:
-            empty[key] = []
-        return empty
-
     def on_epoch_end(self, trial, model, epoch, logs=None):
-        """Update the logs when a batch completes.
-        
+        """Append the results of an epoch to the trial log.
+
         Params:
             trial - the Trial instance
             logs - the results dict from model.fit()
@@ -52,20 +91,23 @@ class LogGridSearch(kt.GridSearch):
         super().on_batch_end(trial, model, epoch, logs)
         if epoch == 0:
             self.ex_num += 1
-            self.logs[trial.trial_id]["results"].append(self.init_run())
-        for key in self.metric_list:
-            self.logs[trial.trial_id]["results"][self.ex_num][key].append(logs.get(key, None))
+        values = {key: logs.get(key, None) for key in self.metric_list}
+        self.write_row({"trial": trial.trial_id, "run": self.ex_num, "epoch": epoch, "logs": values})
 
     def on_trial_end(self, trial):
-        """Save intermediate results at the end of each trial."""
+        """Sync the trial log at the end of each trial."""
         super().on_trial_end(trial)
-        self.save_results()
+        self.sync()
 
     def save_results(self):
         """Save results to a json file."""
         with open(self.out_file, "w") as out_file:
-            json.dump(self.logs, out_file, indent=4)
+            json.dump(self.get_results(), out_file, indent=4)
 
     def get_results(self):
         """Return the results as a dictionary."""
+        if self.logs is None:
+            if not self.log.closed:
+                self.sync()
+            self.logs = read_trial_log(self.log_file)
         return self.logs
@@ -8,7 +8,7 @@ HL-Gaussian and Regression models accept multidimensional input and output.
 from tensorflow import keras
 import tensorflow as tf
 from experiment.transforms import *
-from experiment.multidense import MultiDense
+from experiment.multidense import MultiDense, LowRankDense
 
 
 class Regression(keras.Model):
@@ -21,12 +21,14 @@ class Regression(keras.Model):
     Params:
         base - the backbone model to learn features
         out_shape - the dimensions added to the base features
+        individual - True if each of the (x1, ..., x(n-1)) positions has its own
+            regression weights (e.g. the members of an ensemble); False to share them
     """
 
-    def __init__(self, base, out_shape=()):
+    def __init__(self, base, out_shape=(), individual=False):
         super().__init__()
         self.base = base
-        self.reg = MultiDense(out_shape, individual=False)
+        self.reg = MultiDense(out_shape, individual=individual)
 
     def call(self, inputs, training=None):
         """Perform regression on the features outputted by the base model.
@@ -58,13 +60,18 @@ class HistModel(keras.Model):
         transform - the histogram transform to apply to the targets
             to facilitate learning
         name - the name of the model
+        rank - the size of the projection shared across the output channels;
+            None to give each channel its own dense kernel
     """
 
-    def __init__(self, base, centers, transform, name="HistModel", out_shape=()):
+    def __init__(self, base, centers, transform, name="HistModel", out_shape=(), rank=None):
         super().__init__(name=name)
         self.base = base
         shape = out_shape + centers.shape[:1]
-        self.dense = MultiDense(shape, individual=True)
+        if rank is None:
+            self.dense = MultiDense(shape, individual=True)
+        else:
+            self.dense = LowRankDense(shape, rank)
         self.softmax = keras.layers.Softmax()
         self.transform = transform
         self.mean = HistMean(centers)
@@ -90,3 +90,72 @@ class MultiDense(keras.layers.Layer):
         inputs = tf.transpose(inputs, self.input_perm)
         outputs = self.f(inputs, self.w)
         return tf.transpose(outputs, self.output_perm) + self.b
+
+
+class LowRankDense(keras.layers.Layer):
+    """Multidimensional dense layer with a low-rank kernel shared across input dimensions.
+
+    For an input shape (n, x1, ..., xd) with shape (y1, ..., yk), this layer outputs
+    (n, x1, ..., x(d-1), y1, ..., yk) like an individual MultiDense layer. Instead of a
+    separate (xd, y1, ..., yk) tensor for each of the (x1, ..., x(d-1)) positions, it
+    applies a shared (xd, rank) projection and a shared (rank, y1 * ... * yk) expansion.
+    Each position only keeps its own rank-sized scale and output bias.
+
+    Params:
+        shape - the shape added to the output layer; replaces the last dimension of the input
+        rank - the size of the shared projection
+    """
+
+    def __init__(self, shape, rank=16):
+        super().__init__()
+        self.shape = tuple(int(x) for x in shape)
+        self.rank = rank
+        self.out_size = 1
+        for x in self.shape:
+            self.out_size *= x
+
+    def build(self, input_shape):
+        """Create the kernels for a specified input shape.
+        
+        Params:
+            input_shape - the shape of the batches passed to the layer (includes batchsize)
+        """
+        positions = tuple(input_shape[1:-1])
+        self.u = self.add_weight(
+            name="u",
+            shape=(input_shape[-1], self.rank),
+            initializer="lecun_normal",
+            trainable=True
+        )
+        self.v = self.add_weight(
+            name="v",
+            shape=(self.rank, self.out_size),
+            initializer="lecun_normal",
+            trainable=True
+        )
+        self.scale = self.add_weight(
+            name="scale",
+            shape=positions + (self.rank,),
+            initializer="ones",
+            trainable=True
+        )
+        self.b = self.add_weight(
+            name="b",
+            shape=positions + self.shape,
+            initializer="lecun_normal",
+            trainable=True
+        )
+
+    def call(self, inputs):
+        """Apply the low-rank dense layer to the inputs.
+        
+        Params:
+            inputs - the batched inputs to transform with shape (n, x1, ..., xd)
+
+        Returns:
+            the output tensor of shape (n, x1, ..., x(d-1), y1, ..., yk)
+        """
+        x = tf.tensordot(inputs, self.u, 1) * self.scale
+        x = tf.tensordot(x, self.v, 1)
+        out_shape = tf.concat([tf.shape(x)[:-1], tf.constant(self.shape, tf.int32)], 0)
+        return tf.reshape(x, out_shape) + self.b
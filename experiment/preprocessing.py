@@ -1,5 +1,29 @@
 import tensorflow as tf
-from sklearn.preprocessing import StandardScaler
+import numpy as np
+import json
+import os
+import tempfile
+from tensorflow import keras
+
+
+def save_json(obj, path, **kwargs):
+    """Atomically write an object to a JSON file.
+    The object is written to a unique temporary file in the same directory
+    first, so concurrent writers never replace each other's partial files.
+    
+    Params:
+        obj - the JSON serializable object to save
+        path - the file to save the object to
+        **kwargs - arguments for json.dump
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as out_file:
+            json.dump(obj, out_file, **kwargs)
+        os.replace(temp_file, path)
+    except BaseException:
+        os.remove(temp_file)
+        raise
 
 
 class Scaler:
@@ -14,16 +38,34 @@ class Scaler:
         self.y_min = y_min
         self.y_max = y_max
 
-    def fit(self, data):
+    def fit(self, data=None, y=None):
         """Update the minimum and maximum values according to the data.
+        The batches are reduced inside the tf.data pipeline, so no samples
+        are pulled to the host.
         
         Params:
             data - a tf.data.Dataset of (x, y) tuples of sample batches
+            y - an array of targets to use instead of data, e.g. the cached targets
+                of the training split; has shape (samples, y1, ..., yn)
         """
-        for x, y_batch in data:
-            for y in y_batch:
-                self.y_min = tf.where(y < self.y_min, y, self.y_min)
-                self.y_max = tf.where(y > self.y_max, y, self.y_max)
+        if y is not None:
+            y = tf.convert_to_tensor(y, dtype=tf.float32)
+            self.y_min = tf.minimum(tf.cast(self.y_min, tf.float32), tf.reduce_min(y, axis=0))
+            self.y_max = tf.maximum(tf.cast(self.y_max, tf.float32), tf.reduce_max(y, axis=0))
+            return
+
+        spec = data.element_spec[1]
+        y_min = tf.broadcast_to(tf.cast(self.y_min, spec.dtype), spec.shape[1:])
+        y_max = tf.broadcast_to(tf.cast(self.y_max, spec.dtype), spec.shape[1:])
+
+        def reduce_fn(state, batch):
+            y_batch = batch[1]
+            return (
+                tf.minimum(state[0], tf.reduce_min(y_batch, axis=0)),
+                tf.maximum(state[1], tf.reduce_max(y_batch, axis=0))
+            )
+
+        self.y_min, self.y_max = data.reduce((y_min, y_max), reduce_fn)
 
     def transform(self, data):
         """Transform the data using min-max scaling on the target of each sample.
@@ -39,19 +81,84 @@ class Scaler:
     
 
 class Normalizer:
-    """Apply normalization to the input data of each sample."""
+    """Apply normalization to the input data of each sample.
+    
+    The mean and variance of each column are computed with a mergeable
+    (count, mean, M2) Welford accumulator, so that the statistics of separate
+    shards of the data can be combined exactly.
+    """
 
     def __init__(self) -> None:
-        self.sc = StandardScaler()
+        self.count = tf.constant(0., tf.float64)
+        self.mean_ = None
+        self.m2 = None
+
+    @staticmethod
+    def update(state, batch):
+        """Merge the statistics of one batch of (x, y) samples into the state."""
+        x = tf.cast(batch[0], tf.float64)
+        n = tf.cast(tf.shape(x)[0], tf.float64)
+        mean = tf.reduce_mean(x, axis=0)
+        m2 = tf.reduce_sum(tf.square(x - mean), axis=0)
+        return Normalizer.merge(state, (n, mean, m2))
+
+    @staticmethod
+    def merge(a, b):
+        """Return the combined (count, mean, M2) statistics of two accumulators."""
+        n_a, mean_a, m2_a = a
+        n_b, mean_b, m2_b = b
+        n = n_a + n_b
+        frac = tf.math.divide_no_nan(n_b, n)
+        delta = mean_b - mean_a
+        mean = mean_a + delta * frac
+        m2 = m2_a + m2_b + tf.square(delta) * n_a * frac
+        return n, mean, m2
+
+    def get_state(self, data):
+        """Return the current statistics; zeros shaped like the inputs if not fitted yet."""
+        if self.mean_ is None:
+            zeros = tf.zeros(data.element_spec[0].shape[1:], tf.float64)
+            return self.count, zeros, zeros
+        return self.count, self.mean_, self.m2
 
     def fit(self, data):
         """Determine the mean and standard deviation by column from the data.
+        The data is reduced inside the tf.data pipeline. Calling fit again
+        adds the new data to the existing statistics; to fit separate sources
+        in parallel, fit one Normalizer on each and merge them with combine.
         
         Params:
             data - a tf.data.Dataset of (x, y) tuples of sample batches
         """
-        for x_batch, y in data:
-            self.sc.partial_fit(x_batch.numpy())
+        state = self.get_state(data)
+        zeros = tf.zeros_like(state[1])
+        init = (tf.constant(0., tf.float64), zeros, zeros)
+        new_state = data.reduce(init, self.update)
+        self.count, self.mean_, self.m2 = self.merge(state, new_state)
+
+    def combine(self, other):
+        """Merge the statistics of another Normalizer, e.g. one fit on a separate shard.
+        
+        Params:
+            other - a fitted Normalizer
+        """
+        if self.mean_ is None:
+            self.count, self.mean_, self.m2 = other.count, other.mean_, other.m2
+        else:
+            state = self.merge((self.count, self.mean_, self.m2), (other.count, other.mean_, other.m2))
+            self.count, self.mean_, self.m2 = state
+
+    @property
+    def var_(self):
+        """The (population) variance of each column."""
+        return tf.math.divide_no_nan(self.m2, self.count)
+
+    def get_scale(self):
+        """Return the mean and standard deviation as float32, replacing a zero deviation by one."""
+        mu = tf.cast(self.mean_, tf.float32)
+        std = tf.cast(tf.math.sqrt(self.var_), tf.float32)
+        scale = tf.where(std == 0., tf.ones_like(std), std)
+        return mu, scale
 
     def transform(self, data):
         """Transform the data by normalizing the input for each sample.
@@ -61,7 +168,40 @@ class Normalizer:
 
         Returns: a tf.data.Dataset where the inputs have been normalized
         """
-        mu = tf.cast(self.sc.mean_, tf.float32)
-        std = tf.cast(tf.math.sqrt(self.sc.var_), tf.float32)
-        scale = tf.where(std == 0., tf.ones_like(std), std)
-        return data.map(lambda x, y: ((x - mu) / scale, y))
+        mu, scale = self.get_scale()
+        return data.map(lambda x, y: ((x - mu) / scale, y), num_parallel_calls=tf.data.AUTOTUNE)
+
+    def layer(self):
+        """Return a Keras Normalization layer with the fitted statistics.
+        Use it as the first layer of a model instead of transforming the data.
+        """
+        mu, scale = self.get_scale()
+        return keras.layers.Normalization(mean=mu, variance=tf.square(scale))
+
+    def save(self, path):
+        """Save the statistics to a JSON file.
+        
+        Params:
+            path - the file to save the statistics to
+        """
+        stats = {
+            "count": float(self.count),
+            "mean": np.asarray(self.mean_).tolist(),
+            "m2": np.asarray(self.m2).tolist()
+        }
+        save_json(stats, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return a Normalizer with the statistics saved in a JSON file.
+        
+        Params:
+            path - the file created by Normalizer.save
+        """
+        with open(path, "r") as in_file:
+            stats = json.load(in_file)
+        norm = cls()
+        norm.count = tf.constant(stats["count"], tf.float64)
+        norm.mean_ = tf.constant(stats["mean"], tf.float64)
+        norm.m2 = tf.constant(stats["m2"], tf.float64)
+        return norm
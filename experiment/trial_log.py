@@ -0,0 +1,72 @@
+"""
+Reading and appending JSONL trial logs written by LogGridSearch.
+
+Kept free of Keras and pandas so the logs can be read by any script.
+"""
+
+import json
+import os
+
+
+def open_trial_log(path, mode="a", chunk_size=4096):
+    """Open a trial log for writing.
+
+    In append mode, a partial last line left by a process that was killed
+    mid-write is removed first, so the next row starts on its own line.
+
+    Params:
+        path - the path to the JSONL file
+        mode - "a" to keep the earlier rows, "w" to start over
+        chunk_size - the number of bytes read at a time when searching for the last newline
+
+    Returns: the open file
+    """
+    if mode == "a" and os.path.exists(path):
+        with open(path, "rb+") as log_file:
+            end = log_file.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(pos - chunk_size, 0)
+                log_file.seek(start)
+                newline = log_file.read(pos - start).rfind(b"\n")
+                if newline >= 0:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos < end:
+                log_file.truncate(pos)
+    return open(path, mode)
+
+
+def read_trial_log(path):
+    """Rebuild the trial results dict from a JSONL trial log.
+
+    A trial that was started again replaces its earlier rows. Lines that are
+    not valid JSON, epochs of trials without a hypers row, and epochs that do
+    not continue the last run of their trial or start its next run are skipped.
+
+    Params:
+        path - the path to the JSONL file written by LogGridSearch
+
+    Returns: a dict mapping trial ids to dicts with hypers and results
+    """
+    trials = {}
+    with open(path, "r") as log_file:
+        for line in log_file:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "hypers" in row:
+                trials[row["trial"]] = {"hypers": row["hypers"], "results": []}
+                continue
+            if row["trial"] not in trials:
+                continue
+            results = trials[row["trial"]]["results"]
+            if row["run"] == len(results) and row["epoch"] == 0:
+                results.append({key: [] for key in row["logs"]})
+            elif row["run"] != len(results) - 1 or row["epoch"] != len(next(iter(results[-1].values()), [])):
+                continue
+            for key, value in row["logs"].items():
+                results[row["run"]][key].append(value)
+    return trials
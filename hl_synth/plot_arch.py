@@ -6,12 +6,13 @@ import torch.nn.functional as F
 import torch.optim as optim
 import torch.special
 import fire
-import h5py
 import matplotlib.pyplot as plt
 from matplotlib.colors import hsv_to_rgb
 from itertools import product
 from scipy.stats import sem
 
+from summarize import summarize, seed_values
+
 
 def task_name_str(task_name):
     split = task_name.split('_')
@@ -29,7 +30,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
         archs = list(product([2], widths))
         x = widths
 
-    f = h5py.File('results/sin_functions.hdf5', 'a')
+    table, curve_epochs = summarize('results/sin_functions.hdf5')
     lrs_float = [2**x for x in range(-12, 5)]
     lrs = [str(lr) for lr in lrs_float]
     seeds = range(5)
@@ -50,15 +51,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -77,15 +70,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss-Balanced_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss-Balanced', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -104,15 +89,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"l2_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='l2', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -139,15 +116,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_21.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=21.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -166,15 +135,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss-Balanced_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_21.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss-Balanced', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=21.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -193,15 +154,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
                 best_lr_y = np.inf
                 best_lr_std = 0.
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"l2_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='l2', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     if np.array(errs).mean() < best_lr_y:
                         best_lr_y = np.array(errs).mean()
                         best_lr_std = sem(np.array(errs))
@@ -222,8 +175,6 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset', arch_over='depth'):
     plt.tight_layout()
     plt.savefig(f'results/{arch_over}_{plot_over}.png', dpi=200)
 
-    f.close()
-
 
 if __name__ == '__main__':
     fire.Fire(main)
\ No newline at end of file
@@ -6,13 +6,14 @@ import torch.nn.functional as F
 import torch.optim as optim
 import torch.special
 import fire
-import h5py
 import matplotlib.pyplot as plt
 from matplotlib.colors import hsv_to_rgb
 from matplotlib.legend_handler import HandlerTuple
 from matplotlib import patches
 import matplotlib
 
+from summarize import summarize, select
+
 
 def task_name_str(task_name):
     split = task_name.split('_')
@@ -23,7 +24,7 @@ def main(Y_freq=10, Y_offset=0, plot_over='Y_freq'):
     depth=3
     width=1024
     
-    f = h5py.File('results/sin_functions.hdf5', 'a')
+    table, curve_epochs = summarize('results/sin_functions.hdf5')
     lrs = ['1e-05', '0.0001', '0.001', '0.01', '0.1']
     seeds = range(5)
     linewidth = 2
@@ -41,27 +42,27 @@ def main(Y_freq=10, Y_offset=0, plot_over='Y_freq'):
         # l2_pallette = [hsv_to_rgb((.03, 1., ind/(len(items)+1))) for ind in range(len(items)+2)][2:]
         for ind, Y_freq in enumerate(items):
             best_curve = None
+            best_mse = np.inf
             for lr in lrs:  # ['0.001']:
-                curves = []
-                for seed in seeds:
-                    task_name = f"HL-Gauss_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                    curve = f[f"{task_name}/train_mse"][...]
-                    curves.append(curve)
-                curve = np.array(curves).mean(axis=0)
-                if best_curve is None or curve.mean() < best_curve.mean():
-                    best_curve = curve
-            plt.plot(best_curve, linestyle='solid', linewidth=linewidth, color=pallette[ind], label=f'Freq: {Y_freq}')
+                rows = select(table, model='HL-Gauss', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5, seed=seeds)
+                if len(rows['task_name']) == 0:
+                    continue
+                mse = np.mean(rows['mean_train_mse'])
+                if best_curve is None or mse < best_mse or np.isnan(best_mse):
+                    best_curve = rows['train_curve'].mean(axis=0)
+                    best_mse = mse
+            plt.plot(curve_epochs, best_curve, linestyle='solid', linewidth=linewidth, color=pallette[ind], label=f'Freq: {Y_freq}')
             best_curve = None
+            best_mse = np.inf
             for lr in lrs:  # ['0.0001']:
-                curves = []
-                for seed in seeds:
-                    task_name = f"l2_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                    curve = f[f"{task_name}/train_mse"][...]
-                    curves.append(curve)
-                curve = np.array(curves).mean(axis=0)
-                if best_curve is None or curve.mean() < best_curve.mean():
-                    best_curve = curve
-            plt.plot(best_curve, linestyle='solid', linewidth=linewidth, color=l2_pallette[ind])
+                rows = select(table, model='l2', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5, seed=seeds)
+                if len(rows['task_name']) == 0:
+                    continue
+                mse = np.mean(rows['mean_train_mse'])
+                if best_curve is None or mse < best_mse or np.isnan(best_mse):
+                    best_curve = rows['train_curve'].mean(axis=0)
+                    best_mse = mse
+            plt.plot(curve_epochs, best_curve, linestyle='solid', linewidth=linewidth, color=l2_pallette[ind])
             hl_patch = patches.Patch(color=pallette[ind])
             l2_patch = patches.Patch(color=l2_pallette[ind])
             plot_handles.append((hl_patch, l2_patch))
@@ -74,27 +75,27 @@ def main(Y_freq=10, Y_offset=0, plot_over='Y_freq'):
         # l2_pallette = [hsv_to_rgb((.03, 1., ind/(len(items)+1))) for ind in range(len(items)+2)][2:]
         for ind, Y_offset in enumerate(items):
             best_curve = None
+            best_mse = np.inf
             for lr in lrs:  # ['0.001']:
-                curves = []
-                for seed in seeds:
-                    task_name = f"HL-Gauss_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_11.5_{seed}"
-                    curve = f[f"{task_name}/train_mse"][...]
-                    curves.append(curve)
-                curve = np.array(curves).mean(axis=0)
-                if best_curve is None or curve.mean() < best_curve.mean():
-                    best_curve = curve
-            hl_line,  = plt.plot(best_curve, linestyle='solid', linewidth=linewidth, color=pallette[ind], label=f'Offset: {Y_offset}')
+                rows = select(table, model='HL-Gauss', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=11.5, seed=seeds)
+                if len(rows['task_name']) == 0:
+                    continue
+                mse = np.mean(rows['mean_train_mse'])
+                if best_curve is None or mse < best_mse or np.isnan(best_mse):
+                    best_curve = rows['train_curve'].mean(axis=0)
+                    best_mse = mse
+            hl_line,  = plt.plot(curve_epochs, best_curve, linestyle='solid', linewidth=linewidth, color=pallette[ind], label=f'Offset: {Y_offset}')
             best_curve = None
+            best_mse = np.inf
             for lr in lrs:  # ['0.0001']:
-                curves = []
-                for seed in seeds:
-                    task_name = f"l2_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                    curve = f[f"{task_name}/train_mse"][...]
-                    curves.append(curve)
-                curve = np.array(curves).mean(axis=0)
-                if best_curve is None or curve.mean() < best_curve.mean():
-                    best_curve = curve
-            l2_line,  = plt.plot(best_curve, linestyle='solid', linewidth=linewidth, color=l2_pallette[ind])
+                rows = select(table, model='l2', depth=depth, width=width, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5, seed=seeds)
+                if len(rows['task_name']) == 0:
+                    continue
+                mse = np.mean(rows['mean_train_mse'])
+                if best_curve is None or mse < best_mse or np.isnan(best_mse):
+                    best_curve = rows['train_curve'].mean(axis=0)
+                    best_mse = mse
+            l2_line,  = plt.plot(curve_epochs, best_curve, linestyle='solid', linewidth=linewidth, color=l2_pallette[ind])
             plt.text(-25, 0.05, "HL-Gauss.", color="tab:orange", fontsize='medium')
             plt.text(400, 0.53, "$\\ell_2$", color="tab:blue", fontsize='large')
             hl_patch = patches.Patch(color=pallette[ind])
@@ -120,8 +121,6 @@ def main(Y_freq=10, Y_offset=0, plot_over='Y_freq'):
     plt.tight_layout()
     plt.savefig(f'results/clean_{plot_over}.png', dpi=200)
 
-    f.close()
-
 
 if __name__ == '__main__':
     fire.Fire(main)
\ No newline at end of file
@@ -6,10 +6,11 @@ import torch.nn.functional as F
 import torch.optim as optim
 import torch.special
 import fire
-import h5py
 import matplotlib.pyplot as plt
 from matplotlib.colors import hsv_to_rgb
 
+from summarize import summarize, select
+
 
 def task_name_str(task_name):
     split = task_name.split('_')
@@ -18,20 +19,19 @@ def task_name_str(task_name):
 
 def main(model_name='l2', Y_freq=1, Y_offset=1, hl_range=[-1.5, 1.5]):
     
-    f = h5py.File('results/sin_functions.hdf5', 'a')
+    table, curve_epochs = summarize('results/sin_functions.hdf5')
+    rows = select(table, model=model_name, depth=2, width=1024, freq=Y_freq, offset=Y_offset, hl_low=hl_range[0], hl_high=hl_range[1], seed=0)
     lrs = [2**x for x in range(-12, 1)]
     found_lrs = []
     for lr in lrs:
-        task_name = f'{model_name}_2_1024_{lr}_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}_{0}'
-        if task_name in f:
+        if str(lr) in rows['lr']:
             found_lrs.append(lr)
 
     plt.clf()
     pallette = [hsv_to_rgb((.3, 1., ind/(len(found_lrs)-1))) for ind in range(len(found_lrs))]
     for ind, lr in enumerate(found_lrs):
-        task_name = f'{model_name}_2_1024_{lr}_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}_{0}'
-        curve = f[f"{task_name}/train_mse"][...]#[:50]
-        plt.plot(curve, linestyle='solid', color=pallette[ind], label=f'lr: {lr}')
+        curve = rows['train_curve'][rows['lr'] == str(lr)][0]
+        plt.plot(curve_epochs, curve, linestyle='solid', color=pallette[ind], label=f'lr: {lr}')
     
     plt.ylim(ymin=0, ymax=1.)
     # plt.xlim(xmin=0, xmax=1000)
@@ -42,8 +42,6 @@ def main(model_name='l2', Y_freq=1, Y_offset=1, hl_range=[-1.5, 1.5]):
     plt.tight_layout()
     plt.savefig(f'results/{model_name}_curves_over_lr_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}.png', dpi=200)
 
-    f.close()
-
 
 if __name__ == '__main__':
     fire.Fire(main)
\ No newline at end of file
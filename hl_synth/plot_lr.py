@@ -6,11 +6,12 @@ import torch.nn.functional as F
 import torch.optim as optim
 import torch.special
 import fire
-import h5py
 import matplotlib.pyplot as plt
 from matplotlib.colors import hsv_to_rgb
 from scipy.stats import sem
 
+from summarize import summarize, seed_values
+
 
 def task_name_str(task_name):
     split = task_name.split('_')
@@ -20,7 +21,7 @@ def task_name_str(task_name):
 def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
     
     for depth in [2, 3, 4]:
-        f = h5py.File('results/sin_functions.hdf5', 'a')
+        table, curve_epochs = summarize('results/sin_functions.hdf5')
         lrs_float = [2**x for x in range(-12, 5)]
         lrs = [str(lr) for lr in lrs_float]
         seeds = range(5)
@@ -38,15 +39,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -56,15 +49,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss-Balanced_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss-Balanced', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -74,15 +59,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"l2_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='l2', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -100,15 +77,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_21.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=21.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -118,15 +87,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"HL-Gauss-Balanced_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_21.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='HL-Gauss-Balanced', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=21.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -136,15 +97,7 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
                 lr_curve = []
                 std_curve = []
                 for lr in lrs:
-                    errs = []
-                    for seed in seeds:
-                        task_name = f"l2_{depth}_1024_{lr}_{Y_freq}_{Y_offset}_-1.5_1.5_{seed}"
-                        if task_name not in f:
-                            print(task_name, 'not found')
-                            err = np.inf
-                        else:
-                            err = f[f"{task_name}/train_mse"][...].min()
-                        errs.append(err)
+                    errs = seed_values(table, 'min_train_mse', seeds, model='l2', depth=depth, width=1024, lr=lr, freq=Y_freq, offset=Y_offset, hl_low=-1.5, hl_high=1.5)
                     lr_curve.append(np.array(errs).mean())
                     std_curve.append(sem(errs))
                 lr_curve = np.array(lr_curve)
@@ -160,8 +113,6 @@ def main(Y_freq=4, Y_offset=0, plot_over='Y_offset'):
         plt.tight_layout()
         plt.savefig(f'results/lr_{plot_over}_{depth}.png', dpi=200)
 
-        f.close()
-
 
 if __name__ == '__main__':
     fire.Fire(main)
\ No newline at end of file
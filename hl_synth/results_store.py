@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+import fire
+import h5py
+from multiprocessing.connection import Listener, Client
+
+
+# Single writer for the HDF5 results files. Tasks started in parallel (e.g. from the
+# lines of script.sh) contend for the file lock when each of them opens the file itself.
+# Instead, one server process owns the file: tasks connect to it on a local port, ask
+# whether their task name is done already, and send their logs when they finish. The
+# server answers skip checks from an in-memory index of the task names in the file,
+# appends the logs in batches and flushes the file periodically.
+#
+# Usage:
+#     python results_store.py --results_file=results/sin_functions.hdf5 --port=6000
+#     python sin_functions.py ... --port=6000
+#
+# The server keeps the file open, so stop it (Ctrl+C) before plotting the results.
+
+AUTHKEY = b'hl_synth'
+
+
+def write_log(f, task_name, log):
+    if task_name in f:
+        del f[task_name]
+    f.create_group(task_name)
+    for key, value in log.items():
+        f.create_dataset(f"{task_name}/{key}", data=value)
+
+
+class ResultsServer:
+    def __init__(self, results_file, port=6000, batch_size=64, flush_interval=30.):
+        self.results_file = results_file
+        self.address = ('localhost', port)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        with h5py.File(results_file, 'a') as f:
+            self.done = set(f.keys())
+
+    def handle(self, conn):
+        # Index updates and queued writes happen under one lock, so the order of the
+        # writes in the queue matches the order of the answers given to the tasks
+        with conn:
+            while True:
+                try:
+                    cmd, task_name, *args = conn.recv()
+                except EOFError:
+                    return
+                with self.lock:
+                    if cmd == 'done':
+                        conn.send(task_name in self.done)
+                    elif cmd == 'write':
+                        self.done.add(task_name)
+                        self.queue.put((cmd, task_name, args[0]))
+                        conn.send(True)
+                    elif cmd == 'delete':
+                        found = task_name in self.done
+                        self.done.discard(task_name)
+                        self.queue.put((cmd, task_name, None))
+                        conn.send(found)
+                    else:
+                        conn.send(None)
+
+    def next_batch(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write_loop(self):
+        with h5py.File(self.results_file, 'a') as f:
+            pending = 0
+            last_flush = time.monotonic()
+            while True:
+                timeout = max(0., self.flush_interval - (time.monotonic() - last_flush))
+                batch = self.next_batch(timeout)
+                for item in batch:
+                    if item is None:
+                        break
+                    cmd, task_name, log = item
+                    if cmd == 'write':
+                        write_log(f, task_name, log)
+                    elif task_name in f:
+                        del f[task_name]
+                    pending += 1
+                stop = None in batch
+                if pending and (stop or pending >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval):
+                    f.flush()
+                    print(f'flushed {pending} results, {len(self.done)} tasks done')
+                    pending = 0
+                    last_flush = time.monotonic()
+                elif not pending:
+                    last_flush = time.monotonic()
+                if stop:
+                    return
+
+    def serve(self):
+        writer = threading.Thread(target=self.write_loop)
+        writer.start()
+        print(f'serving {self.results_file} on port {self.address[1]}, {len(self.done)} tasks done')
+        try:
+            with Listener(self.address, authkey=AUTHKEY) as listener:
+                while True:
+                    conn = listener.accept()
+                    threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.queue.put(None)
+            writer.join()
+
+
+class ResultsClient:
+    def __init__(self, port=6000):
+        self.conn = Client(('localhost', port), authkey=AUTHKEY)
+
+    def request(self, *msg):
+        self.conn.send(msg)
+        return self.conn.recv()
+
+    def done(self, task_name):
+        return self.request('done', task_name)
+
+    def write(self, task_name, log):
+        self.request('write', task_name, log)
+
+    def delete(self, task_name):
+        return self.request('delete', task_name)
+
+    def close(self):
+        self.conn.close()
+
+
+class ResultsFile:
+    # Same interface as ResultsClient, opening the file directly for a single task
+    def __init__(self, results_file):
+        self.results_file = results_file
+
+    def done(self, task_name):
+        with h5py.File(self.results_file, 'a') as f:
+            return task_name in f
+
+    def write(self, task_name, log):
+        with h5py.File(self.results_file, 'a') as f:
+            write_log(f, task_name, log)
+
+    def delete(self, task_name):
+        with h5py.File(self.results_file, 'a') as f:
+            if task_name in f:
+                del f[task_name]
+                return True
+            return False
+
+    def close(self):
+        pass
+
+
+def get_store(results_file, port=None):
+    if port is None:
+        return ResultsFile(results_file)
+    return ResultsClient(port)
+
+
+def main(results_file='results/sin_functions.hdf5', port=6000, batch_size=64, flush_interval=30.):
+    ResultsServer(results_file, port, batch_size, flush_interval).serve()
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
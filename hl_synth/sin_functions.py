@@ -6,10 +6,11 @@ import torch.nn.functional as F
 import torch.optim as optim
 import torch.special
 import fire
-import h5py
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+from results_store import get_store
+
 
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
@@ -100,7 +101,17 @@ def task_name_str(task_name):
     return f"Loss: {split[0]}, depth: {split[1]}, width: {split[2]}, lr: {split[3]}, Freq: {split[4]}, Offset: {split[5]}"
 
 
-def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offset=0., hl_high=1.5, seed=0, delete=False, task_idx=1):
+def eval_epochs(num_epochs, eval_every=1, eval_points=None):
+    # Epochs at which the model is evaluated: every eval_every epochs, or eval_points
+    # log-spaced epochs if given. The first and the last epoch are always evaluated.
+    if eval_points:
+        epochs = np.geomspace(1, num_epochs, eval_points).round().astype(int) - 1
+    else:
+        epochs = np.arange(0, num_epochs, eval_every)
+    return np.unique(np.concatenate([[0], epochs, [num_epochs - 1]]))
+
+
+def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offset=0., hl_high=1.5, seed=0, delete=False, task_idx=1, port=None, eval_every=1, eval_points=None):
     print('TASK IDX:', task_idx)
     hl_range = [-1.5, hl_high]
     task_name = f'{model_name}_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}_{seed}'
@@ -110,18 +121,20 @@ def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offse
     path = Path('results/ckpt')
     path.mkdir(parents=True, exist_ok=True)
     
-    with h5py.File('results/sin_functions.hdf5', 'a') as f:
-        if delete:
-            if task_name in f:
-                del f[task_name]
-                print('deleted')
-            else:
-                print('not found')
-            return
-
-        if task_name in f:
-            print('done already')
-            return
+    # Results go through the results_store server when a port is given
+    store = get_store('results/sin_functions.hdf5', port)
+    if delete:
+        if store.delete(task_name):
+            print('deleted')
+        else:
+            print('not found')
+        store.close()
+        return
+
+    if store.done(task_name):
+        print('done already')
+        store.close()
+        return
 
     np.random.seed(seed)
     random.seed(seed)
@@ -162,40 +175,47 @@ def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offse
     num_epochs = 1001
 
     log = {}
-    log['train_mse'] = []
-    log['test_mse'] = []
+    # Metrics of the evaluated epochs are kept on the device and transferred at the end
+    epochs = eval_epochs(num_epochs, eval_every, eval_points)
+    is_eval = np.zeros(num_epochs, dtype=bool)
+    is_eval[epochs] = True
+    mses = torch.zeros(2, len(epochs), device=DEVICE)
+    n_evals = 0
+    next_check = 0
 
     for epoch in range(num_epochs):
-        model.eval()
+        if is_eval[epoch]:
+            model.eval()
+            with torch.inference_mode():
+                Yhat = model(X)
+                if model_name == 'HL-Gauss' or model_name == 'HL-Gauss-Balanced':
+                    Yhat = criterion.transform_from_probs(F.softmax(Yhat, dim=-1))
+                    mse = ((Y.squeeze() - Yhat)**2).mean()
+                elif model_name == 'l2':
+                    mse = ((Y.squeeze() - Yhat.squeeze())**2).mean()
+                else:
+                    raise NotImplementedError
+
+                Yhat_test = model(X_test)
+                if model_name == 'HL-Gauss' or model_name == 'HL-Gauss-Balanced':
+                    Yhat_test = criterion.transform_from_probs(F.softmax(Yhat_test, dim=-1))
+                    mse_test = ((Y_test.squeeze() - Yhat_test)**2).mean()
+                elif model_name == 'l2':
+                    mse_test = ((Y_test.squeeze() - Yhat_test.squeeze())**2).mean()
+                else:
+                    raise NotImplementedError
+                mses[0, n_evals] = mse
+                mses[1, n_evals] = mse_test
+            n_evals += 1
+
+            # Only sync with the device every 100 epochs; the log is cut at the first nan below
+            if epoch >= next_check:
+                next_check = epoch + 100
+                print(f"Epoch {epoch}, MSE: {mse:.4f}, Test MSE: {mse_test:.4f}, ")
+                if torch.isnan(mse):
+                    print('nan occured')
+                    break
 
-        Yhat = model(X)
-        if model_name == 'HL-Gauss' or model_name == 'HL-Gauss-Balanced':
-            Yhat = criterion.transform_from_probs(F.softmax(Yhat, dim=-1))
-            mse = ((Y.squeeze() - Yhat)**2).mean()
-        elif model_name == 'l2':
-            mse = ((Y.squeeze() - Yhat.squeeze())**2).mean()
-        else:
-            raise NotImplementedError
-        log['train_mse'].append(mse.item())
-
-        Yhat_test = model(X_test)
-        if model_name == 'HL-Gauss' or model_name == 'HL-Gauss-Balanced':
-            Yhat_test = criterion.transform_from_probs(F.softmax(Yhat_test, dim=-1))
-            mse_test = ((Y_test.squeeze() - Yhat_test)**2).mean()
-        elif model_name == 'l2':
-            mse_test = ((Y_test.squeeze() - Yhat_test.squeeze())**2).mean()
-        else:
-            raise NotImplementedError
-        log['test_mse'].append(mse_test.item())
-        # mse_test = 0.
-
-        if epoch % 100 == 0:
-            print(f"Epoch {epoch}, MSE: {mse:.4f}, Test MSE: {mse_test:.4f}, ")
-
-        if torch.isnan(mse):
-            print('nan occured')
-            break
-        
         model.train()
 
         outputs = model(X)
@@ -210,11 +230,19 @@ def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offse
         loss.backward()
         optimizer.step()
 
+    mses = mses[:, :n_evals].cpu().numpy()
+    nans = np.flatnonzero(np.isnan(mses[0]))
+    n_evals = nans[0] + 1 if len(nans) else n_evals
+    log['epochs'] = epochs[:n_evals]
+    log['train_mse'] = mses[0, :n_evals]
+    log['test_mse'] = mses[1, :n_evals]
+
     model.eval()
     X_vis = torch.linspace(-np.pi, np.pi, 2001).unsqueeze(1).to(DEVICE)
-    Yhat_vis = model(X_vis)
-    if model_name == 'HL-Gauss':
-        Yhat_vis = criterion.transform_from_probs(F.softmax(Yhat_vis, dim=-1)).unsqueeze(1)
+    with torch.inference_mode():
+        Yhat_vis = model(X_vis)
+        if model_name == 'HL-Gauss':
+            Yhat_vis = criterion.transform_from_probs(F.softmax(Yhat_vis, dim=-1)).unsqueeze(1)
 
     if seed == 0:
         plt.clf()
@@ -224,12 +252,8 @@ def main(model_name='HL-Gauss', depth=2, width=1024, lr=1e-1, Y_freq=1., Y_offse
         # plt.ylim(-1.1, 1.1)
         plt.savefig(f'results/vis_{task_name}.png', dpi=200)
 
-    with h5py.File('results/sin_functions.hdf5', 'a') as f:
-        if task_name in f:
-            del f[task_name]
-        f.create_group(task_name)
-        for key, value in log.items():
-            f.create_dataset(f"{task_name}/{key}", data=value)
+    store.write(task_name, log)
+    store.close()
 
     if seed == 0:
         torch.save(model.state_dict(), f'results/ckpt/{task_name}.pt')
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import fire
+import h5py
+
+
+# Summary table of an HDF5 results file for the plot scripts. Each row is one task,
+# indexed by the fields of its task name, with the aggregates the plots use and a
+# downsampled training curve. The table is stored column by column next to the results
+# file and updated incrementally: tasks that appeared in the results file since the last
+# call are summarized and appended, and tasks that were deleted are dropped. Tasks that
+# were rerun are found by their fingerprint (the number of evaluations and the last
+# train and test MSE, which are cheap to read) and summarized again. Use --rebuild to
+# start over.
+#
+# Usage:
+#     python summarize.py --results_file=results/sin_functions.hdf5
+
+KEYS = ['model', 'depth', 'width', 'lr', 'freq', 'offset', 'hl_low', 'hl_high', 'seed']
+AGGREGATES = ['final_train_mse', 'min_train_mse', 'mean_train_mse', 'final_test_mse', 'min_test_mse', 'n_evals']
+
+
+def summary_file(results_file):
+    return os.path.splitext(results_file)[0] + '_summary.npz'
+
+
+def parse_task_name(task_name):
+    # Task names are f'{model_name}_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_{hl_low}_{hl_high}_{seed}'
+    split = task_name.split('_')
+    if len(split) != len(KEYS):
+        return None
+    return dict(zip(KEYS, split))
+
+
+def fingerprint(group):
+    # Only reads the length and last value of each curve
+    train_mse, test_mse = group['train_mse'], group['test_mse']
+    return len(train_mse), train_mse[-1], test_mse[-1]
+
+
+def same_fingerprint(table, i, group):
+    cached = [table[key][i] for key in ['n_evals', 'final_train_mse', 'final_test_mse']]
+    return all(a == b or (np.isnan(a) and np.isnan(b)) for a, b in zip(cached, fingerprint(group)))
+
+
+def summarize_task(group, curve_epochs):
+    train_mse = group['train_mse'][...]
+    test_mse = group['test_mse'][...]
+    epochs = group['epochs'][...] if 'epochs' in group else np.arange(len(train_mse))
+    # Aggregates keep nans like the plot scripts did when reading the full curves
+    row = {
+        'final_train_mse': train_mse[-1],
+        'min_train_mse': train_mse.min(),
+        'mean_train_mse': train_mse.mean(),
+        'final_test_mse': test_mse[-1],
+        'min_test_mse': test_mse.min(),
+        'n_evals': len(train_mse),
+    }
+    row['train_curve'] = np.interp(curve_epochs, epochs, train_mse, right=np.nan)
+    row['test_curve'] = np.interp(curve_epochs, epochs, test_mse, right=np.nan)
+    return row
+
+
+def to_columns(rows, curve_epochs):
+    table = {'task_name': np.array([row['task_name'] for row in rows], dtype=str)}
+    for key in KEYS:
+        table[key] = np.array([row[key] for row in rows], dtype=str)
+    for key in AGGREGATES:
+        table[key] = np.array([row[key] for row in rows], dtype=np.float64)
+    for key in ['train_curve', 'test_curve']:
+        table[key] = np.array([row[key] for row in rows], dtype=np.float64).reshape(len(rows), len(curve_epochs))
+    return table
+
+
+def summarize(results_file='results/sin_functions.hdf5', rebuild=False, curve_every=10, max_epoch=1000):
+    path = summary_file(results_file)
+    curve_epochs = np.arange(0, max_epoch + 1, curve_every)
+
+    table = None
+    if not rebuild and os.path.exists(path):
+        with np.load(path) as cached:
+            table = {key: cached[key] for key in cached.files}
+        # The curves are only reused if they were downsampled to the same epochs
+        if not np.array_equal(table.pop('curve_epochs'), curve_epochs):
+            table = None
+
+    with h5py.File(results_file, 'r') as f:
+        names = [name for name in f.keys() if parse_task_name(name) is not None]
+        known = {name: i for i, name in enumerate(table['task_name'])} if table is not None else {}
+        changed = [name for name in names if name in known and not same_fingerprint(table, known[name], f[name])]
+        new = [name for name in names if name not in known] + changed
+        keep = np.isin(table['task_name'], names) & ~np.isin(table['task_name'], changed) if table is not None else None
+        if table is not None and not new and keep.all():
+            return table, curve_epochs
+
+        rows = []
+        for name in new:
+            row = summarize_task(f[name], curve_epochs)
+            row.update(parse_task_name(name), task_name=name)
+            rows.append(row)
+
+    new_table = to_columns(rows, curve_epochs)
+    if table is not None:
+        table = {key: np.concatenate([table[key][keep], column]) for key, column in new_table.items()}
+    else:
+        table = new_table
+    print(f'summarized {len(rows)} new or changed tasks, {len(table["task_name"])} in total')
+
+    # Written to a temporary file first so that an interrupted update keeps the old table
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, curve_epochs=curve_epochs, **table)
+    os.replace(tmp_path, path)
+    return table, curve_epochs
+
+
+def select(table, **conditions):
+    # Rows whose fields match the conditions; lists match any of their values
+    mask = np.ones(len(table['task_name']), dtype=bool)
+    for key, value in conditions.items():
+        if isinstance(value, (list, tuple, range)):
+            mask &= np.isin(table[key], [str(v) for v in value])
+        else:
+            mask &= table[key] == str(value)
+    return {key: column[mask] for key, column in table.items()}
+
+
+def seed_values(table, column, seeds, **conditions):
+    # Values of a column for each seed, np.inf for missing tasks as in the plot scripts
+    rows = select(table, **conditions)
+    values = dict(zip(rows['seed'], rows[column]))
+    errs = []
+    for seed in seeds:
+        if str(seed) not in values:
+            print(conditions, f'seed {seed}', 'not found')
+        errs.append(values.get(str(seed), np.inf))
+    return np.array(errs)
+
+
+def main(results_file='results/sin_functions.hdf5', rebuild=False, curve_every=10, max_epoch=1000):
+    summarize(results_file, rebuild, curve_every, max_epoch)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
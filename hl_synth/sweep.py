@@ -0,0 +1,211 @@
+import copy
+import numpy as np
+import torch
+import torch.nn.functional as F
+import fire
+import h5py
+import matplotlib.pyplot as plt
+from itertools import product
+from pathlib import Path
+from torch.func import stack_module_state, functional_call, vmap, grad
+
+from sin_functions import RegressionVarDepth, HLVarDepth, HLGaussLoss, task_name_str, eval_epochs, DEVICE
+
+
+# Trains every (lr, seed) config of one (model, depth, width, freq, offset) group at the
+# same time in one process. The parameters of the models are stacked along a leading
+# config dimension, the forward and backward passes are vmapped over it, and Adam is
+# applied to the stacked parameters with a learning rate per config. Each model is
+# initialized and trained as in sin_functions.py, and the results are written to the
+# same HDF5 file under the same task names.
+
+
+def make_model(model_name, depth, width, seed):
+    torch.manual_seed(seed)
+    if model_name == 'l2':
+        return RegressionVarDepth(hidden_size=width, depth=depth).to(DEVICE)
+    elif model_name == 'HL-Gauss' or model_name == 'HL-Gauss-Balanced':
+        return HLVarDepth(hidden_size=width, depth=depth).to(DEVICE)
+    else:
+        raise NotImplementedError
+
+
+def make_criterion(model_name, Y, hl_range):
+    sigma = (hl_range[1] - hl_range[0])/100 * 2
+    if model_name == 'HL-Gauss':
+        return HLGaussLoss(hl_range[0], hl_range[1], 100, sigma)
+    elif model_name == 'HL-Gauss-Balanced':
+        class_weights = 1./(torch.histc(Y[:, 0], bins=100, min=hl_range[0], max=hl_range[1]))
+        class_weights[class_weights == torch.inf] = 0.
+        class_weights /= class_weights[class_weights.nonzero()].mean()
+        return HLGaussLoss(hl_range[0], hl_range[1], 100, sigma, weights=class_weights)
+    return None
+
+
+def adam_step(params, grads, state, lrs, step, betas=(0.9, 0.999), eps=1e-8, active=None):
+    # Same update as torch.optim.Adam, with one learning rate per stacked config
+    b1, b2 = betas
+    bias_correction1 = 1 - b1 ** step
+    bias_correction2 = 1 - b2 ** step
+    for key, p in params.items():
+        shape = (-1,) + (1,) * (p.dim() - 1)
+        g = grads[key]
+        if active is not None:
+            # Stopped configs (nan loss) keep their parameters and optimizer state
+            mask = active.view(shape) > 0
+            g = torch.where(mask, g, torch.zeros_like(g))
+        m, v = state[key]
+        m.mul_(b1).add_(g, alpha=1 - b1)
+        v.mul_(b2).addcmul_(g, g, value=1 - b2)
+        denom = v.sqrt() / (bias_correction2 ** 0.5) + eps
+        update = lrs.view(shape) / bias_correction1 * m / denom
+        if active is not None:
+            update = torch.where(mask, update, torch.zeros_like(update))
+        p.sub_(update)
+
+
+def train_group(model_name, depth, width, Y_freq, Y_offset, hl_high, lrs, seeds, num_epochs=1001, eval_every=1, eval_points=None):
+    hl_range = [-1.5, hl_high]
+    configs = list(product(lrs, seeds))
+
+    # Generate some data
+    X = torch.linspace(-np.pi, np.pi, 501)[:-1].unsqueeze(1).to(DEVICE)
+    Y = torch.sin(Y_freq*X) + Y_offset
+
+    X_test = X + (X[1] - X[0])/2
+    Y_test = torch.sin(Y_freq*X_test) + Y_offset
+
+    criterion = make_criterion(model_name, Y, hl_range)
+    if criterion is not None:
+        Y_probs = criterion.transform_to_probs(Y.squeeze())
+
+    models = [make_model(model_name, depth, width, seed) for lr, seed in configs]
+    params, buffers = stack_module_state(models)
+    params = {key: p.detach() for key, p in params.items()}
+    base = copy.deepcopy(models[0]).to('meta')
+    del models
+
+    def forward(p, b, x):
+        return functional_call(base, (p, b), (x,))
+
+    def predict(p, b, x):
+        outputs = forward(p, b, x)
+        if criterion is not None:
+            return criterion.transform_from_probs(F.softmax(outputs, dim=-1))
+        return outputs.squeeze(-1)
+
+    def loss_fn(p, b):
+        outputs = forward(p, b, X)
+        if criterion is not None:
+            return criterion(outputs, Y_probs)
+        return F.mse_loss(outputs, Y)
+
+    batched_predict = vmap(predict, in_dims=(0, 0, None))
+    batched_grad = vmap(grad(loss_fn))
+
+    n = len(configs)
+    lr_tensor = torch.tensor([lr for lr, seed in configs], dtype=torch.float32, device=DEVICE)
+    state = {key: (torch.zeros_like(p), torch.zeros_like(p)) for key, p in params.items()}
+    epochs = eval_epochs(num_epochs, eval_every, eval_points)
+    is_eval = np.zeros(num_epochs, dtype=bool)
+    is_eval[epochs] = True
+    train_mse = torch.zeros(n, len(epochs), device=DEVICE)
+    test_mse = torch.zeros(n, len(epochs), device=DEVICE)
+    # Number of logged evaluations per config; a config stops after its train MSE becomes nan
+    lengths = torch.full((n,), len(epochs), dtype=torch.long, device=DEVICE)
+    active = torch.ones(n, device=DEVICE)
+    n_evals = 0
+
+    for epoch in range(num_epochs):
+        if is_eval[epoch]:
+            with torch.inference_mode():
+                mse = ((batched_predict(params, buffers, X) - Y.squeeze())**2).mean(dim=-1)
+                mse_test = ((batched_predict(params, buffers, X_test) - Y_test.squeeze())**2).mean(dim=-1)
+            train_mse[:, n_evals] = mse
+            test_mse[:, n_evals] = mse_test
+            n_evals += 1
+
+            stopped = torch.isnan(mse) & (active > 0)
+            lengths[stopped] = n_evals
+            active[stopped] = 0.
+            if epoch % 100 == 0:
+                print(f"Epoch {epoch}, active configs: {int(active.sum())}/{n}")
+            if not active.any():
+                break
+
+        grads = batched_grad(params, buffers)
+        adam_step(params, grads, state, lr_tensor, epoch + 1, active=active)
+
+    train_mse = train_mse.cpu().numpy()
+    test_mse = test_mse.cpu().numpy()
+    lengths = lengths.cpu().numpy()
+
+    results = {}
+    for i, (lr, seed) in enumerate(configs):
+        task_name = f'{model_name}_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}_{seed}'
+        results[task_name] = {
+            'log': {
+                'epochs': epochs[:lengths[i]],
+                'train_mse': train_mse[i, :lengths[i]],
+                'test_mse': test_mse[i, :lengths[i]],
+            },
+            'params': {key: p[i].clone() for key, p in params.items()},
+        }
+
+    # Plot and save the first seed of each learning rate, as in sin_functions.py
+    X_vis = torch.linspace(-np.pi, np.pi, 2001).unsqueeze(1).to(DEVICE)
+    with torch.inference_mode():
+        Yhat_vis = batched_predict(params, buffers, X_vis).cpu()
+    for i, (lr, seed) in enumerate(configs):
+        if seed == 0:
+            task_name = f'{model_name}_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_{hl_range[0]}_{hl_range[1]}_{seed}'
+            plt.clf()
+            plt.plot(X[:, 0].cpu(), Y[:, 0].cpu(), 'o')
+            plt.plot(X_vis[:, 0].cpu(), Yhat_vis[i], '-')
+            plt.title(task_name_str(task_name))
+            plt.savefig(f'results/vis_{task_name}.png', dpi=200)
+            torch.save(results[task_name]['params'], f'results/ckpt/{task_name}.pt')
+
+    return {task_name: result['log'] for task_name, result in results.items()}
+
+
+def get_groups():
+    # Same experiments as make_script.py
+    groups = []
+    lrs = [1e-1, 1e-2, 1e-3, 1e-4, 1e-5]
+    for model_name, depth, width, Y_freq, Y_offset in product(['l2', 'HL-Gauss'], [3], [1024], [1, 10, 20], [0]):
+        groups.append((model_name, depth, width, Y_freq, Y_offset, 1.5, lrs))
+    for model_name, depth, width, Y_freq, Y_offset in product(['l2', 'HL-Gauss'], [3], [1024], [10], [0, 1, 10]):
+        hl_high = 11.5 if model_name == 'HL-Gauss' else 1.5
+        groups.append((model_name, depth, width, Y_freq, Y_offset, hl_high, lrs))
+    return groups
+
+
+def main(results_file='results/sin_functions.hdf5', num_seeds=5, num_epochs=1001, eval_every=1, eval_points=None):
+    path = Path('results/ckpt')
+    path.mkdir(parents=True, exist_ok=True)
+    seeds = list(range(num_seeds))
+
+    with h5py.File(results_file, 'a') as f:
+        done = set(f.keys())
+
+    for model_name, depth, width, Y_freq, Y_offset, hl_high, lrs in get_groups():
+        names = [f'{model_name}_{depth}_{width}_{lr}_{Y_freq}_{Y_offset}_-1.5_{hl_high}_{seed}' for lr, seed in product(lrs, seeds)]
+        if all(name in done for name in names):
+            print('done already:', model_name, depth, width, Y_freq, Y_offset)
+            continue
+        print('training:', model_name, depth, width, Y_freq, Y_offset, f'({len(names)} configs)')
+        logs = train_group(model_name, depth, width, Y_freq, Y_offset, hl_high, lrs, seeds, num_epochs, eval_every, eval_points)
+
+        with h5py.File(results_file, 'a') as f:
+            for task_name, log in logs.items():
+                if task_name in f:
+                    del f[task_name]
+                f.create_group(task_name)
+                for key, value in log.items():
+                    f.create_dataset(f"{task_name}/{key}", data=value)
+        done.update(logs.keys())
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -3,7 +3,8 @@ import pandas as pd
 import pickle
 import json
 import os
-import gc
+import math
+import resource
 
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_absolute_error as mae
@@ -16,6 +17,7 @@ from keras.models import Sequential
 from keras.layers.core import Dense
 from keras.optimizers import Adam
 from keras.layers import Dropout, GaussianNoise
+from keras.utils import Sequence
 
 import tensorflow as tf
 
@@ -75,31 +77,76 @@ def create_main_model(h_l, lr, n_bins, input_dim, dropout_rate=0.05, loss='categ
 def adjust_and_erf(a, mu, sig):
     return erf((a - mu)/(np.sqrt(2.0)*sig))
 
-def transform_normal(y_tv, y_test, y_min, y_max, n_bins=100, ker_par_ratio=1.0):
+def get_bins(y_min, y_max, n_bins=100, ker_par_ratio=1.0):
     '''
+    Returns the bin borders, bin centers, and sigma of the Gaussian target distribution.
     n_bins: Number of centers
     ker_par_ratio: The ratio between sig and bin size
     '''
-    # Creating new labels
     eps = 1e-7
     bin_size = (y_max + eps - y_min)*1.0/n_bins
     ker_par = bin_size * ker_par_ratio # Sigma for Gaussian
 
     borders = np.linspace(y_min, y_max+eps, n_bins+1)
     centers = borders[:-1] + bin_size/2.0
+    return borders, centers, ker_par
+
+def hl_targets(y, borders, ker_par):
+    '''
+    Returns the (len(y), n_bins) float32 target distributions for a batch of labels.
+    '''
+    border_targets = adjust_and_erf(borders[np.newaxis,:], y[:,np.newaxis], ker_par)
+    two_z = border_targets[:,-1] - border_targets[:,0]
+    return ((border_targets[:,1:] - border_targets[:,:-1])/two_z[:,np.newaxis]).astype(np.float32)
+
+def transform_normal(y_tv, y_test, y_min, y_max, n_bins=100, ker_par_ratio=1.0):
+    '''
+    Returns the full target matrices for the train and test labels.
+    Use HLTargetSequence to avoid holding the matrices in memory.
+    n_bins: Number of centers
+    ker_par_ratio: The ratio between sig and bin size
+    '''
+    borders, centers, ker_par = get_bins(y_min, y_max, n_bins, ker_par_ratio)
+    y_tv_dist = hl_targets(y_tv, borders, ker_par)
+    y_test_dist = hl_targets(y_test, borders, ker_par)
+    return y_tv_dist, y_test_dist, centers
 
-    # Distribution
-    border_targets_tv = adjust_and_erf(borders[np.newaxis,:], y_tv[:,np.newaxis], ker_par)
-    two_z_tv = border_targets_tv[:,-1] - border_targets_tv[:,0]
-    y_tv_dist = (border_targets_tv[:,1:] - border_targets_tv[:,:-1])/two_z_tv[:,np.newaxis]
 
-    border_targets_test = adjust_and_erf(borders[np.newaxis,:], y_test[:,np.newaxis], ker_par)
-    two_z_test = border_targets_test[:,-1] - border_targets_test[:,0]
-    y_test_dist = (border_targets_test[:,1:] - border_targets_test[:,:-1])/two_z_test[:,np.newaxis]
+class HLTargetSequence(Sequence):
+    '''
+    Produces (x, target distribution) batches for model.fit, computing the float32
+    targets of each batch when it is requested instead of the full (N, n_bins) matrix.
+    x, y: The inputs and labels
+    borders, ker_par: The bin borders and sigma returned by get_bins
+    shuffle: Reshuffle the samples at the end of each epoch
+    '''
+    def __init__(self, x, y, borders, ker_par, batch_size=256, shuffle=True):
+        self.x = x
+        self.y = y
+        self.borders = borders
+        self.ker_par = ker_par
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(len(y))
+        self.on_epoch_end()
 
-    gc.collect()
+    def __len__(self):
+        return math.ceil(len(self.y) / self.batch_size)
 
-    return y_tv_dist, y_test_dist, centers
+    def __getitem__(self, i):
+        idx = self.order[i*self.batch_size:(i+1)*self.batch_size]
+        return self.x[idx].astype(np.float32), hl_targets(self.y[idx], self.borders, self.ker_par)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+
+# Memory
+
+def peak_memory_mb():
+    # Peak resident memory of the process so far (ru_maxrss is in KB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
 
 # Data
 def get_data(dataset):
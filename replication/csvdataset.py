@@ -1,34 +1,118 @@
 from experiment.dataset import Dataset
 import tensorflow as tf
 import pandas as pd
+import numpy as np
+import json
+import os
 
 
 class CSVDataset(Dataset):
     """A dataset from a CSV file.
+
+    If mmap_dir is given, the CSV file is converted once (in chunks) to binary float32
+    feature and target files in mmap_dir. The files are memory-mapped, and the samples
+    of each split are read in batches of indices with parallel reads, so the data does
+    not need to fit in memory and is not embedded in the graph.
     
     Params:
         path - the path to the file
         targets - the column name(s) containing the targets to predict
         drop - the column name(s) to exclude from the data
             Note: Any non-numeric columns must be dropped!
+        mmap_dir - the directory for the memory-mapped binary files; None to load the CSV into memory
+        chunk_size - the number of CSV rows converted at a time
         **kwargs - arguments for the dataset class; includes buffer_size, batch_size, prefetch
     """
 
-    def __init__(self, path, targets, drop=[], **kwargs) -> None:
+    def __init__(self, path, targets, drop=[], mmap_dir=None, chunk_size=100000, **kwargs) -> None:
         self.path = path
         self.targets = targets
         self.drop = drop
+        self.mmap_dir = mmap_dir
+        self.chunk_size = chunk_size
         super().__init__(**kwargs)
 
     def load(self):
-        """Read the input data from the file."""
+        """Read the input data from the file, or memory-map the converted binary files."""
+        if self.mmap_dir is not None:
+            self.load_mmap()
+            return
         df = pd.read_csv(self.path)
         df = df.drop(self.drop, axis=1)
         x = df.drop(self.targets, axis=1)
         y = df[self.targets]
         ds = tf.data.Dataset.from_tensor_slices((tf.convert_to_tensor(x, dtype=tf.float32),tf.convert_to_tensor(y, dtype=tf.float32)))
-        self.ds = ds
+        self.length = len(df)
+        self.ds = ds.apply(tf.data.experimental.assert_cardinality(self.length))
+
+    def is_converted(self):
+        """Return True if the CSV file has been converted to binary files in mmap_dir."""
+        return os.path.exists(os.path.join(self.mmap_dir, "meta.json"))
+
+    def convert(self):
+        """Convert the CSV file to float32 binary files of the features and targets.
+        The rows of each file are stored contiguously, since samples are read by row index.
+        """
+        os.makedirs(self.mmap_dir, exist_ok=True)
+        n = 0
+        with open(os.path.join(self.mmap_dir, "x.bin"), "wb") as x_file, open(os.path.join(self.mmap_dir, "y.bin"), "wb") as y_file:
+            for chunk in pd.read_csv(self.path, chunksize=self.chunk_size):
+                chunk = chunk.drop(self.drop, axis=1)
+                x = chunk.drop(self.targets, axis=1).to_numpy(np.float32)
+                y = chunk[self.targets].to_numpy(np.float32)
+                x_file.write(np.ascontiguousarray(x).tobytes())
+                y_file.write(np.ascontiguousarray(y).tobytes())
+                n += len(chunk)
+
+        meta = {"path": self.path, "targets": self.targets, "drop": self.drop, "count": n, "x_shape": list(x.shape[1:]), "y_shape": list(y.shape[1:])}
+        with open(os.path.join(self.mmap_dir, "meta.json"), "w") as out_file:
+            json.dump(meta, out_file, indent=4)
+
+    def load_mmap(self):
+        """Memory-map the binary files, converting the CSV file first if needed."""
+        if not self.is_converted():
+            self.convert()
+        with open(os.path.join(self.mmap_dir, "meta.json"), "r") as in_file:
+            meta = json.load(in_file)
+        if meta["targets"] != self.targets or meta["drop"] != self.drop:
+            raise ValueError(f"Files in {self.mmap_dir} were converted with targets {meta['targets']} and drop {meta['drop']}")
+
+        self.length = meta["count"]
+        self.x = np.memmap(os.path.join(self.mmap_dir, "x.bin"), dtype=np.float32, mode="r", shape=(self.length, *meta["x_shape"]))
+        self.y = np.memmap(os.path.join(self.mmap_dir, "y.bin"), dtype=np.float32, mode="r", shape=(self.length, *meta["y_shape"]))
+
+    def read_rows(self, indices):
+        """Return the features and targets of a batch of row indices from the memory-mapped files."""
+        def read(i):
+            i = np.sort(i)
+            return self.x[i], self.y[i]
+
+        x, y = tf.numpy_function(read, [indices], (tf.float32, tf.float32))
+        x.set_shape((None,) + self.x.shape[1:])
+        y.set_shape((None,) + self.y.shape[1:])
+        return x, y
+
+    def read(self, indices, n):
+        """Return a dataset of the samples at a dataset of n row indices.
+        The indices are read in batches and the batches are read in parallel.
+        """
+        ds = indices.batch(self.batch_size).map(self.read_rows, num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.unbatch().apply(tf.data.experimental.assert_cardinality(n))
+
+    def select(self, data, indices):
+        """Return a dataset with the elements of data at the given indices.
+        Memory-mapped samples are read by index instead of being gathered into memory.
+        
+        Params:
+            data - the tf.data.Dataset to select from
+            indices - an array of sample indices
+        """
+        if self.mmap_dir is None:
+            return super().select(data, indices)
+        return self.read(self.index_dataset(indices), len(indices))
 
     def get_data(self):
         """Return the loaded dataset"""
+        if self.mmap_dir is not None:
+            return self.read(tf.data.Dataset.range(self.length), self.length)
         return self.ds
@@ -106,15 +106,18 @@ for run in range(num_runs):
     key = 'Histogram-Gaussian'
 
     if key in keys:
-        y_tv_dist, y_test_dist, centers = transform_normal(y_tv, y_test, y_min, y_max, n_bins=best_params['n_bins'], ker_par_ratio=best_params['ker_par'])
+        borders, centers, ker_par = get_bins(y_min, y_max, n_bins=best_params['n_bins'], ker_par_ratio=best_params['ker_par'])
 
         np.random.seed(seeds[run])
         tf.random.set_seed(seeds[run])
 
-        # Training the new model
+        # Training the new model on targets computed for each batch
         print(key)
+        train_seq = HLTargetSequence(X_tv, y_tv, borders, ker_par, batch_size=best_params['batch_size'])
+        test_seq = HLTargetSequence(X_test, y_test, borders, ker_par, batch_size=best_params['batch_size'], shuffle=False)
         cat_model = create_main_model(best_params['h_l'], best_params['lr'], best_params['n_bins'], input_dim=X_tv.shape[1], dropout_rate=best_params['dropout_rate'])
-        history[key].append(cat_model.fit(X_tv, y_tv_dist, validation_data=(X_test, y_test_dist), epochs=epochs, batch_size=best_params['batch_size'],verbose=verbose).history)
+        history[key].append(cat_model.fit(train_seq, validation_data=test_seq, epochs=epochs, verbose=verbose).history)
+        print('peak memory (MB):', peak_memory_mb())
 
         y_pred_tr = (centers[np.newaxis,:] * cat_model.predict(X_tv)).sum(axis=1)
         train_error = error(y_tv, y_pred_tr)
@@ -2,10 +2,11 @@
 
 Based on previous papers and code by Ehsan Imani.
 
-Usage: python replication.py data_dir
+Usage: python replication.py data_dir [--ensemble]
 
 Params:
     data_dir - the directory containing the CSV files for the datasets
+    --ensemble - train the models of all seeds together as ensembles
 """
 
 import sys
@@ -15,8 +16,11 @@ from tensorflow import keras
 from experiment.models import *
 from experiment.hypermodels import *
 from experiment.preprocessing import *
+from experiment.multidense import MultiDense
 import keras_tuner as kt
+import tensorflow as tf
 import json
+import hashlib
 
 
 def mlp_base(input_width, hidden=4, dropout=0.05, int_dim=0.5):
@@ -65,28 +69,118 @@ def get_datasets(base_dir):
     Returns: a list of dataset objects
     """
     data_dir = os.path.join(base_dir, "data")
-    ctscan = CSVDataset(os.path.join(data_dir, "slice_localization_data.csv"), "reference", batch_size=256)
+    mmap_dir = os.path.join(base_dir, "mmap")
+    ctscan = CSVDataset(os.path.join(data_dir, "slice_localization_data.csv"), "reference", mmap_dir=os.path.join(mmap_dir, "ctscan"), batch_size=256)
     ctscan.bounds = (0., 100.)
     ctscan.name = "ctscan"
     ctscan.epochs = 1000
 
-    bikeshare = CSVDataset(os.path.join(data_dir, "hour.csv"), "cnt", drop_cols="dteday", batch_size=256)
+    bikeshare = CSVDataset(os.path.join(data_dir, "hour.csv"), "cnt", drop_cols="dteday", mmap_dir=os.path.join(mmap_dir, "bike"), batch_size=256)
     bikeshare.bounds = (0., 1000.)
     bikeshare.name = "bike"
     bikeshare.epochs = 500
 
-    songyear = CSVDataset(os.path.join(data_dir, "YearPredictionMSD.txt"), 0, header=None, batch_size=256)
+    songyear = CSVDataset(os.path.join(data_dir, "YearPredictionMSD.txt"), 0, header=None, mmap_dir=os.path.join(mmap_dir, "songyear"), batch_size=256)
     songyear.bounds = (1922., 2011.)
     songyear.name = "songyear"
     songyear.epochs = 150
 
-    pole = CSVDataset(os.path.join(data_dir, "pole.csv"), "target", batch_size=256)
+    pole = CSVDataset(os.path.join(data_dir, "pole.csv"), "target", mmap_dir=os.path.join(mmap_dir, "pole"), batch_size=256)
     pole.bounds = (0., 100.)
     pole.name = "pole"
     pole.epochs = 500
 
     return [ctscan, bikeshare, songyear, pole]
 
+def ensemble_mlp_base(input_width, n_members, hidden=4, dropout=0.05, int_dim=0.5, repeat=True):
+    """Return n_members independent copies of the MLP base model stacked into one model.
+    The weights of the copies are stacked along a member dimension and applied with
+    batched matrix multiplications, so all of the members are trained in one step.
+    
+    Params:
+        input_width - the number of input features
+        n_members - the number of copies of the MLP
+        hidden - the number of hidden layers
+        dropout - the dropout rate to use on the input
+        int_dim - the ratio of the size of the hidden layers relative to the input size
+        repeat - True if every member receives the same (batchsize, input_width) inputs;
+            False for inputs with shape (batchsize, n_members, input_width)
+    
+    Returns: a Keras model with outputs of shape (batchsize, n_members, features)
+    """
+    model = keras.models.Sequential()
+    if repeat:
+        model.add(keras.layers.RepeatVector(n_members))
+    model.add(keras.layers.Dropout(dropout))
+    width = int(int_dim * input_width)
+    for i in range(hidden):
+        model.add(MultiDense((width,), individual=True))
+        model.add(keras.layers.ReLU())
+    return model
+
+
+def ensemble_base_models(dataset, n_members, repeat=True):
+    """Return the ensemble base model for a given dataset.
+    
+    Params:
+        dataset - the Dataset object with the name of the dataset
+        n_members - the number of members of the ensemble
+        repeat - True if the members share the input batches
+    """
+    if dataset.name == "ctscan":
+        return ensemble_mlp_base(385, n_members, repeat=repeat)
+    elif dataset.name == "bike":
+        return ensemble_mlp_base(16, n_members, int_dim=4, dropout=0, repeat=repeat)
+    elif dataset.name == "pole":
+        return ensemble_mlp_base(49, n_members, dropout=0, repeat=repeat)
+    elif dataset.name == "songyear":
+        return ensemble_mlp_base(90, n_members, repeat=repeat)
+
+
+def get_ensemble_models(dataset, n_members, repeat=True, scale=True):
+    """Get the ensemble models for a given dataset.
+    Uses the fixed hyperparameters of get_models.
+    
+    Params:
+        dataset - a Dataset object with the data and info
+        n_members - the number of members of each ensemble
+        repeat - True if the members share the input batches
+        scale - True if the y data will be scaled to [0, 1]
+    
+    Returns: a list of (name, model) tuples
+    """
+    if scale:
+        y_min, y_max = 0., 1.
+    else:
+        y_min, y_max = dataset.bounds
+    metrics = ["mse", "mae"]
+    base = lambda : ensemble_base_models(dataset, n_members, repeat)
+    opt = lambda : keras.optimizers.Adam(learning_rate=1e-3)
+
+    padding = 0.125
+    n_bins = 100
+    y_range = y_max - y_min
+    bins = tf.linspace(y_min - padding * y_range, y_max + padding * y_range, n_bins + 1)
+    sigma = bins[1] - bins[0]
+    hlg = HLGaussian(base(), tf.expand_dims(bins, -1), sigma)
+    hlg.compile(optimizer=opt(), metrics=metrics)
+
+    l2 = Regression(base(), individual=True)
+    l2.compile(optimizer=opt(), loss="mse", metrics=metrics)
+
+    l1 = Regression(base(), individual=True)
+    l1.compile(optimizer=opt(), loss="mae", metrics=metrics)
+
+    if repeat:
+        lin_base = keras.layers.RepeatVector(n_members)
+    else:
+        lin_base = keras.layers.Identity()
+    lin = Regression(lin_base, individual=True)
+    lin.compile(optimizer=opt(), loss="mse", metrics=metrics)
+
+    return [("L1", l1), ("L2", l2), ("HL-Gaussian", hlg), ("LinReg", lin)]
+
+
 def get_models(dataset, scale=True):
     """Get the models for a given dataset.
     
@@ -152,31 +246,121 @@ def run_model(model, epochs, train, test):
     return results
 
 
-def preprocess(train, test, bounds, scale, norm):
+def get_scaler(train, bounds):
+    """Return the target scaler for a dataset.
+    Fits the scaler on the training split if no bounds are given.
+    
+    Params:
+        train - the tf Dataset with the train split
+        bounds - a tuple with the minimum and maximum y values; None to fit them
+
+    Returns: a Scaler object
+    """
+    if bounds is not None:
+        return Scaler(*bounds)
+    sc = Scaler()
+    sc.fit(train)
+    return sc
+
+
+def get_normalizer(train, stats_file=None):
+    """Return the input normalizer for a dataset.
+    Fits the normalizer on the training split, reusing the stats saved in
+    stats_file by a previous run when it exists.
+    
+    Params:
+        train - the tf Dataset with the train split
+        stats_file - the JSON file used to save and reuse the fitted stats; None to always fit
+
+    Returns: a Normalizer object
+    """
+    if stats_file is not None and os.path.exists(stats_file):
+        return Normalizer.load(stats_file)
+    norm = Normalizer()
+    norm.fit(train)
+    if stats_file is not None:
+        norm.save(stats_file)
+    return norm
+
+
+def preprocess(train, test, bounds, scale, norm, stats_prefix=None):
     """Preprocess the data by scaling and normalizing.
     
     Params:
         train - the tf Dataset with the train split
         test - the tf Dataset with the test split
-        bounds - a tuple with the minimum and maximum y values
+        bounds - a tuple with the minimum and maximum y values; None to fit them on the train split
         scale - True if the y values will be scaled to [0, 1]; False otherwise
         norm - True if the x values will be normalized based on the training data; False otherwise
+        stats_prefix - the path prefix of the JSON files used to save and reuse the fitted stats
     
     Returns: (train, test) - the transformed train and test splits
     """
     if scale:
-        sc = Scaler(*bounds)
+        sc = get_scaler(train, bounds)
         train = sc.transform(train)
         test = sc.transform(test)
 
     if norm:
-        norm = Normalizer()
-        norm.fit(train)
+        stats_file = None if stats_prefix is None else f"{stats_prefix}-normalizer.json"
+        norm = get_normalizer(train, stats_file)
         train = norm.transform(train)
         test = norm.transform(test)
     return train, test
 
-def run_seed(dataset, seed, test_ratio, scale=True, norm=True):
+def get_stats_prefix(dataset, seed, bounds, scale, norm):
+    """Return the path prefix of the stats files for the current split of a dataset.
+    The prefix contains a hash of the split (its parameters and sample order) and of
+    the preprocessing settings, so stats are only reused for the same split.
+    
+    Params:
+        dataset - the Dataset object after get_split was called
+        seed - the seed used for the experiment
+        bounds - a tuple with the minimum and maximum y values; None if they are fitted
+        scale - True if the y values are scaled to [0, 1]; False otherwise
+        norm - True if the x values are normalized; False otherwise
+    """
+    key = {"split": dataset.snapshot_key(0), "bounds": bounds, "scale": scale, "norm": norm}
+    text = json.dumps(key, sort_keys=True, default=str)
+    digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+    return os.path.join("temp_results", f"{dataset.name}-{seed}-{digest}")
+
+
+def get_seed_split(dataset, seed, test_ratio):
+    """Return the models and the train-test split of a dataset for a given seed.
+    The models are built before splitting so that the random state used for the
+    split is the same in every process running the seed.
+    
+    Params:
+        dataset - the Dataset object to split
+        seed - the seed to use for the experiment
+        test_ratio - the proportion of samples held out for testing
+
+    Returns: models, train, test - the list of models and the train and test splits
+    """
+    keras.utils.set_random_seed(seed)
+    models = get_models(dataset)
+    train, test = dataset.get_split(test_ratio, shuffle=True)
+    return models, train, test
+
+
+def fit_stats(dataset, seed, test_ratio, scale=True, norm=True):
+    """Fit and save the preprocessing stats of a seed so that later runs of the seed reuse them.
+    
+    Params:
+        dataset - the Dataset object to run the experiment on
+        seed - the seed to use for the experiment
+        test_ratio - the proportion of samples held out for testing
+        scale - True if the y values will be scaled to [0, 1]; False otherwise
+        norm - True if the x values will be normalized based on the training data; False otherwise
+    """
+    models, train, test = get_seed_split(dataset, seed, test_ratio)
+    bounds = getattr(dataset, "bounds", None)
+    stats_prefix = get_stats_prefix(dataset, seed, bounds, scale, norm)
+    preprocess(train, test, bounds, scale, norm, stats_prefix)
+
+
+def run_seed(dataset, seed, test_ratio, scale=True, norm=True, model_ids=None):
     """Run the experiment on a dataset for all models with a given seed.
     
     Params:
@@ -185,18 +369,107 @@ def run_seed(dataset, seed, test_ratio, scale=True, norm=True):
         test_ratio - the proportion of samples held out for testing
         scale - True if the y values will be scaled to [0, 1]; False otherwise
         norm - True if the x values will be normalized based on the training data; False otherwise
+        model_ids - the indices of the models from get_models to run; None for all models
+            (all models are still built so that each one is initialized the same way)
 
     Returns: results - a dict with the results for each model
     """
     results = {}
-    keras.utils.set_random_seed(seed)
-    models = get_models(dataset)
-    train, test = dataset.get_split(test_ratio, shuffle=True)
+    models, train, test = get_seed_split(dataset, seed, test_ratio)
 
-    train, test = preprocess(train, test, dataset.bounds, scale, norm)
+    bounds = getattr(dataset, "bounds", None)
+    stats_prefix = get_stats_prefix(dataset, seed, bounds, scale, norm)
+    train, test = preprocess(train, test, bounds, scale, norm, stats_prefix)
 
-    for model in models:
-        results[model.name] = run_model(model, dataset.epochs, train, test)
+    for i, model in enumerate(models):
+        if model_ids is None or i in model_ids:
+            results[model.name] = run_model(model, dataset.epochs, train, test)
+    return results
+
+
+def stack_members(splits):
+    """Return a dataset whose batches stack the batches of each split along a member dimension.
+    
+    Params:
+        splits - a list of batched tf Datasets of (x, y) with the same number of batches
+    
+    Returns: a tf Dataset of (x, y) with shapes (batchsize, n_members, ...) and (batchsize, n_members)
+    """
+    stack = lambda *batches: tuple(tf.stack(t, axis=1) for t in zip(*batches))
+    return tf.data.Dataset.zip(tuple(splits)).map(stack, num_parallel_calls=tf.data.AUTOTUNE)
+
+
+def member_metrics(model, data):
+    """Return the MSE and MAE of each ensemble member on a dataset.
+    
+    Params:
+        model - the trained ensemble model with outputs of shape (batchsize, n_members)
+        data - a tf Dataset of (x, y) with y of shape (batchsize, n_members) or (batchsize,)
+    
+    Returns: mse, mae - arrays with the metric of each member
+    """
+    sq_err, abs_err, n = 0., 0., 0
+    for x, y in data:
+        y_pred = model(x, training=False)
+        if len(y.shape) < len(y_pred.shape):
+            y = tf.expand_dims(y, -1)
+        err = (y_pred - y).numpy()
+        sq_err += (err ** 2).sum(axis=0)
+        abs_err += abs(err).sum(axis=0)
+        n += err.shape[0]
+    return sq_err / n, abs_err / n
+
+
+def run_ensemble(dataset, seeds, test_ratio, shared_batches=False, scale=True, norm=True):
+    """Run the experiment on a dataset with one ensemble member per seed.
+    All of the members are trained together in one model, so the seeds
+    take about as long as a single run.
+    
+    Params:
+        dataset - the Dataset object to run the experiment on
+        seeds - the list of seeds to use
+        test_ratio - the proportion of samples held out for testing
+        shared_batches - True if all members are trained on the batches of the first seed's split;
+            False if each member is trained and tested on the split of its own seed
+        scale - True if the y values will be scaled to [0, 1]; False otherwise
+        norm - True if the x values will be normalized based on the training data; False otherwise
+
+    Returns: results - a dict with the results for each seed
+    """
+    n_members = len(seeds)
+    trains, tests = [], []
+    for seed in seeds:
+        keras.utils.set_random_seed(seed)
+        train, test = dataset.get_split(test_ratio, shuffle=True)
+        bounds = getattr(dataset, "bounds", None)
+        stats_prefix = get_stats_prefix(dataset, seed, bounds, scale, norm)
+        train, test = preprocess(train, test, bounds, scale, norm, stats_prefix)
+        trains.append(train)
+        tests.append(test)
+        if shared_batches:
+            break
+
+    keras.utils.set_random_seed(seeds[0])
+    if shared_batches:
+        repeat_y = lambda x, y: (x, tf.repeat(tf.expand_dims(y, -1), n_members, axis=-1))
+        train = trains[0].map(repeat_y, num_parallel_calls=tf.data.AUTOTUNE)
+        test = tests[0]
+    else:
+        train = stack_members(trains)
+        test = stack_members(tests)
+
+    results = {seed: {} for seed in seeds}
+    for name, model in get_ensemble_models(dataset, n_members, repeat=shared_batches, scale=scale):
+        model.fit(train, epochs=dataset.epochs, verbose=2)
+        train_mse, train_mae = member_metrics(model, train)
+        test_mse, test_mae = member_metrics(model, test)
+        for i, seed in enumerate(seeds):
+            results[seed][name] = {
+                "train_mse": float(train_mse[i]),
+                "train_mae": float(train_mae[i]),
+                "test_mse": float(test_mse[i]),
+                "test_mae": float(test_mae[i])
+            }
     return results
 
 
@@ -235,26 +508,33 @@ def run(seeds, datasets, test_ratio):
 
 
 def save(outfile, results):
-    """Save the results of the experiment to a JSON file.
+    """Atomically save the results of the experiment to a JSON file.
     
     Params:
         outfile - the file to save the results to
         results - the dict with the results to save
     """
-    with open(outfile, "w") as out_file:
-        json.dump(results, out_file, indent=4)
+    save_json(results, outfile, indent=4)
 
 
-def main(base_dir):
-    """Run the replication experiment."""
+def main(base_dir, ensemble=False):
+    """Run the replication experiment.
+    
+    Params:
+        base_dir - the directory containing the CSV files for the datasets
+        ensemble - True to train the models of all seeds together as ensembles
+    """
     test_ratio = 0.2
     seeds = [1, 2, 3, 4, 5]
     outfile = "replication.json"
     datasets = get_datasets(base_dir)
-    results = run(seeds, datasets, test_ratio)
+    if ensemble:
+        results = {ds.name: run_ensemble(ds, seeds, test_ratio) for ds in datasets}
+    else:
+        results = run(seeds, datasets, test_ratio)
     save(outfile, results)
 
 
 if __name__ == "__main__":
     data_file = sys.argv[1]
-    main(data_file)
\ No newline at end of file
+    main(data_file, "--ensemble" in sys.argv[2:])
\ No newline at end of file
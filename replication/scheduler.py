@@ -0,0 +1,138 @@
+"""Module for running the replication experiment concurrently.
+
+Runs every (dataset, seed, model) job of replication.py in a pool of worker
+processes with a fixed number of TensorFlow threads each, so the small MLPs of
+the experiment use all of the cores of a CPU node. Each result is written
+atomically to temp_results as soon as its job finishes, and jobs with a result
+file are skipped, so an interrupted run can be resumed.
+
+Usage: python -m replication.scheduler data_dir n_workers [outfile]
+
+Params:
+    data_dir - the directory containing the CSV files for the datasets
+    n_workers - the number of jobs to run at the same time
+    outfile - the JSON file in which the combined results are stored
+"""
+
+import os
+import sys
+import json
+import itertools
+import multiprocessing as mp
+
+
+N_MODELS = 5
+TEMP_DIR = "temp_results"
+
+
+def init_worker(intra_threads, inter_threads):
+    """Pin the number of TensorFlow threads used by a worker process.
+    Must run before TensorFlow executes any operation in the process.
+
+    Params:
+        intra_threads - the number of threads used within a single operation
+        inter_threads - the number of operations that can run in parallel
+    """
+    os.environ["OMP_NUM_THREADS"] = str(intra_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+
+def result_file(job):
+    """Return the temp_results file in which the result of a job is stored."""
+    dataset, seed, model_id = job
+    return os.path.join(TEMP_DIR, f"{dataset}-{seed}-{model_id}.json")
+
+
+def run_job(args):
+    """Run one (dataset, seed, model) job and save its results.
+
+    Params:
+        args - a tuple of the data directory, the test ratio, and the (dataset, seed, model_id) job
+
+    Returns: job, results - the job and a dict with the results of its model
+    """
+    from replication.replication import get_datasets, run_seed, save
+    base_dir, test_ratio, job = args
+    dataset_name, seed, model_id = job
+    dataset = [ds for ds in get_datasets(base_dir) if ds.name == dataset_name][0]
+    results = run_seed(dataset, seed, test_ratio, model_ids=[model_id])
+    save(result_file(job), results)
+    return job, results
+
+
+def fit_all_stats(base_dir, dataset_seeds, test_ratio):
+    """Fit and save the preprocessing stats of each (dataset, seed) before the jobs start,
+    so the model jobs of a seed only read the stats instead of writing them concurrently.
+
+    Params:
+        base_dir - the directory containing the CSV files for the datasets
+        dataset_seeds - a set of (dataset, seed) tuples
+        test_ratio - the proportion of samples held out for testing
+    """
+    from replication.replication import get_datasets, fit_stats
+    datasets = {ds.name: ds for ds in get_datasets(base_dir)}
+    for dataset_name, seed in sorted(dataset_seeds):
+        fit_stats(datasets[dataset_name], seed, test_ratio)
+
+
+def get_jobs(datasets, seeds, n_models=N_MODELS):
+    """Return every combination of the given dataset names, seeds, and model indices."""
+    return list(itertools.product(datasets, seeds, range(n_models)))
+
+
+def collect(jobs):
+    """Return the saved results of the finished jobs as {dataset: {seed: {model: results}}}."""
+    results = {}
+    for job in jobs:
+        path = result_file(job)
+        if os.path.exists(path):
+            dataset, seed, model_id = job
+            with open(path, "r") as in_file:
+                results.setdefault(dataset, {}).setdefault(str(seed), {}).update(json.load(in_file))
+    return results
+
+
+def run(base_dir, jobs, n_workers, test_ratio=0.2, threads=None, inter_threads=1):
+    """Run the jobs that have no saved result in a process pool.
+
+    Params:
+        base_dir - the directory containing the CSV files for the datasets
+        jobs - a list of (dataset, seed, model_id) tuples
+        n_workers - the number of worker processes
+        test_ratio - the proportion of samples held out for testing
+        threads - the number of intra-op threads per worker; None to split the cores evenly
+        inter_threads - the number of inter-op threads per worker
+
+    Returns: results - a dict with the results of all finished jobs
+    """
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // n_workers)
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    todo = [(base_dir, test_ratio, job) for job in jobs if not os.path.exists(result_file(job))]
+    fit_all_stats(base_dir, {job[:2] for _, _, job in todo}, test_ratio)
+
+    # Spawn fresh interpreters so each worker initializes TensorFlow with its own
+    # thread settings, and replace them after every job to release the models
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(n_workers, initializer=init_worker, initargs=(threads, inter_threads), maxtasksperchild=1) as pool:
+        for job, res in pool.imap_unordered(run_job, todo):
+            print(f"Finished {job}", flush=True)
+    return collect(jobs)
+
+
+def main(base_dir, n_workers, outfile="replication.json"):
+    """Run the replication experiment over all datasets, seeds, and models."""
+    from replication.replication import get_datasets, save
+    seeds = [1, 2, 3, 4, 5]
+    # Load the datasets once before starting the workers so that the CSV files
+    # are converted to memory-mapped files by a single process
+    datasets = [ds.name for ds in get_datasets(base_dir)]
+    jobs = get_jobs(datasets, seeds)
+    results = run(base_dir, jobs, n_workers)
+    save(outfile, results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]), *sys.argv[3:])
@@ -0,0 +1,40 @@
+# Compares the peak memory of building the full HL target matrices (transform_normal)
+# with producing the targets for each batch (HLTargetSequence).
+# Usage: python target_memory.py [n_samples] [n_bins]
+
+import sys
+import tracemalloc
+
+from common import *
+
+
+def peak_dense(y, y_min, y_max, n_bins):
+    tracemalloc.start()
+    y_dist, _, centers = transform_normal(y, y[:1], y_min, y_max, n_bins=n_bins)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def peak_sequence(x, y, y_min, y_max, n_bins, batch_size=256):
+    tracemalloc.start()
+    borders, centers, ker_par = get_bins(y_min, y_max, n_bins=n_bins)
+    seq = HLTargetSequence(x, y, borders, ker_par, batch_size=batch_size)
+    for i in range(len(seq)):
+        x_batch, y_batch = seq[i]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 463715 # YearPredictionMSD train set
+    n_bins = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    y_min, y_max = 1922, 2011
+    y = np.random.uniform(y_min, y_max, n)
+    x = np.zeros((n, 1))
+
+    dense = peak_dense(y, y_min, y_max, n_bins)
+    streaming = peak_sequence(x, y, y_min, y_max, n_bins)
+    print('samples:', n, 'bins:', n_bins)
+    print('transform_normal peak (MB):', dense / 2**20)
+    print('HLTargetSequence peak (MB):', streaming / 2**20)
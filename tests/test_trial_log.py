@@ -0,0 +1,52 @@
+import json
+from experiment.trial_log import open_trial_log, read_trial_log
+
+
+def write_rows(log_file, rows):
+    for row in rows:
+        log_file.write(json.dumps(row) + "\n")
+
+
+def epoch(trial, run, epoch, loss):
+    return {"trial": trial, "run": run, "epoch": epoch, "logs": {"loss": loss}}
+
+
+def test_resume_after_truncated_line(tmp_path):
+    path = tmp_path / "trials.jsonl"
+    with open_trial_log(path, "w") as log_file:
+        write_rows(log_file, [{"trial": "0", "hypers": {"lr": 0.1}}, epoch("0", 0, 0, 1.0), epoch("0", 0, 1, 0.5)])
+        # killed while writing the third epoch
+        log_file.write(json.dumps(epoch("0", 0, 2, 0.25))[:20])
+
+    with open_trial_log(path, "a") as log_file:
+        write_rows(log_file, [{"trial": "0", "hypers": {"lr": 0.1}}, epoch("0", 0, 0, 9.0), epoch("0", 0, 1, 8.0)])
+
+    trials = read_trial_log(path)
+    assert trials == {"0": {"hypers": {"lr": 0.1}, "results": [{"loss": [9.0, 8.0]}]}}
+
+
+def test_resume_after_truncated_hypers_row(tmp_path):
+    path = tmp_path / "trials.jsonl"
+    with open_trial_log(path, "w") as log_file:
+        log_file.write(json.dumps({"trial": "0", "hypers": {"lr": 0.1}})[:10])
+
+    with open_trial_log(path, "a") as log_file:
+        write_rows(log_file, [{"trial": "0", "hypers": {"lr": 0.1}}, epoch("0", 0, 0, 9.0)])
+
+    assert read_trial_log(path) == {"0": {"hypers": {"lr": 0.1}, "results": [{"loss": [9.0]}]}}
+
+
+def test_skips_rows_out_of_order(tmp_path):
+    path = tmp_path / "trials.jsonl"
+    with open(path, "w") as log_file:
+        write_rows(log_file, [
+            epoch("1", 0, 0, 5.0),  # no hypers row
+            {"trial": "0", "hypers": {"lr": 0.1}},
+            epoch("0", 0, 0, 1.0),
+            epoch("0", 0, 0, 9.0),  # restarted run merged into the old one
+            epoch("0", 2, 0, 3.0),  # skips run 1
+            epoch("0", 1, 0, 2.0),
+        ])
+
+    trials = read_trial_log(path)
+    assert trials == {"0": {"hypers": {"lr": 0.1}, "results": [{"loss": [1.0]}, {"loss": [2.0]}]}}
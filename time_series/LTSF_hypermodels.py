@@ -1,343 +1,252 @@
-"""Module containing models and hypermodels from LSTF-Linear."""
+"""Module containing models and hypermodels from LSTF-Linear.
+
+The models take univariate input windows of shape (batchsize, input_length) and
+predict targets of shape (batchsize, output_length). All of the computation is
+expressed with broadcast tensor ops, so the train and test steps can be traced
+by tf.function and compiled with XLA (jit_compile=True).
+"""
 
 import keras_tuner as kt
 from tensorflow import keras
 import tensorflow as tf
 from keras import layers
-import numpy as np
-
+from experiment.transforms import TruncGaussHistTransform, HistMean
 
-class TruncGaussHistTransform(keras.layers.Layer):
-    """Layer that transforms a scalar target into a binned probability vector 
-    that approximates a truncated Gaussian distribution with the target as the mean.
-    
-    Params:
-        borders - the borders of the histogram bins
-        sigma - the sigma parameter of the truncated Gaussian distribution
-    """
 
-    def __init__(self, borders, sigma):
-        super().__init__(trainable=False, name="TruncGaussHistTransform")
-        self.borders = borders
-        self.sigma = sigma
+class Decomposition(layers.Layer):
+    """Layer that splits a series into seasonal and trend components using a moving average.
+    The series is padded by repeating its first and last values so that the trend
+    has the same length as the input (as in DLinear).
 
-    def call(self, inputs):
-        """Transform the input and return it.
-        
-        Params:
-            inputs - the tensor of targets to transform
-
-        Returns:
-            x_transformed - a tensor of shape (len(inputs), len(borders) - 1)
-            consisting of the probability vectors for each target
-        """
-        border_targets = self.adjust_and_erf(self.borders, tf.expand_dims(inputs, 1), self.sigma)
-        two_z = border_targets[:, -1] - border_targets[:, 0]
-        x_transformed = (border_targets[:, 1:] - border_targets[:, :-1]) / tf.expand_dims(two_z, 1)
-        return x_transformed
-
-    def adjust_and_erf(self, a, mu, sig):
-        """Calculate the erf of a after standardizing and dividing by sqrt(2)."""
-        return tf.math.erf((a - mu)/(tf.math.sqrt(2.0)*sig))
-    
-
-class HistMean(keras.layers.Layer):
-    """Layer that transforms a probability vector into its expected value.
-    
     Params:
-        centers - the centers of the histogram bins
+        kernel_size - the length of the moving average window
     """
 
-    def __init__(self, centers):
-        super().__init__(trainable=False, name="HistMean")
-        self.centers = centers
+    def __init__(self, kernel_size=25):
+        super().__init__(trainable=False, name="Decomposition")
+        self.front = (kernel_size - 1) // 2
+        self.end = kernel_size - 1 - self.front
+        self.pool = layers.AveragePooling1D(kernel_size, strides=1, padding="valid")
 
     def call(self, inputs):
-        """Return the weighted average between the centers and probability vectors.
-        
+        """Return the seasonal and trend components of the inputs.
+
         Params:
-            inputs - a tensor of probability vectors to transform
+            inputs - a tensor of shape (batchsize, input_length)
 
-        Returns:
-            a tensor of shape (len(inputs), 1) consisting of the expected values
+        Returns: seasonal, trend - tensors with the same shape as the inputs
         """
-        return tf.linalg.matvec(inputs, self.centers)
+        front = tf.repeat(inputs[:, :1], self.front, axis=1)
+        end = tf.repeat(inputs[:, -1:], self.end, axis=1)
+        padded = tf.concat([front, inputs, end], axis=1)
+        trend = self.pool(tf.expand_dims(padded, -1))[..., 0]
+        return inputs - trend, trend
 
 
+class LTSFModel(keras.Model):
+    """Base class for the Linear, NLinear, and DLinear models.
 
+    Params:
+        units - the number of outputs of the linear layer(s)
+        normalize - True if the last input value is subtracted from the inputs and
+            added back to the predictions (NLinear)
+        kernel_size - the moving average window used to decompose the inputs (DLinear);
+            None to use a single linear layer
+        name - the name of the model
+    """
 
-class HyperLinear_L2(kt.HyperModel):
-    def __init__(self, name="Linear_l2", input_length=256, output_length=256, metrics=None):
-        super().__init__(name, True)
-        self.metrics = metrics
-        self.input_length = input_length
-        self.output_length = output_length
-        
-    def build(self, hp):
-        inputs = keras.Input(shape=(self.input_length,))
-        dense = layers.Dense(self.output_length)
-        outputs = dense(inputs)
-        model = keras.Model(inputs=inputs, outputs=outputs)
-        lr = hp.Float("learning_rate", default=1e-3, min_value=1e-4, max_value=1e-2, step=10, sampling="log")
-        b1 = hp.Fixed("beta_1", 0.9)
-        b2 = hp.Fixed("beta_2", 0.999)
-        eps = hp.Fixed("epsilon", 1e-7)
-        model.compile(
-            loss=keras.losses.MeanSquaredError(),
-            optimizer = keras.optimizer.Adam(learning_rate = lr, beta_1=b1, beta_2=b2, epsilon=eps),
-            metrics=self.metrics
-        )
-        return model
-    
-
-
-class Linear_HL(keras.Model):
-    def __init__(self, y_min, y_max, padding, n_bins, sigma, input_length, output_length, name="Linear_HL"):
-        super().__init__()
-        y_range = y_max-y_min
-        centers = tf.linspace(y_min-(y_range*padding), y_max+(y_range*padding), n_bins)
-        self.dense = layers.Dense(output_length*tf.size(centers))
-        self.transform = TruncGaussHistTransform(centers, sigma)
-        self.reshape = layers.Reshape((output_length, tf.size(centers)))
-        self.softmax = layers.Softmax()
-        self.mean = HistMean(centers)
-        self.hist_loss = keras.metrics.Mean("loss")
-        
-    def call(self, inputs, training=None):
-        x = self.dense(inputs, training=training)
-        x = self.reshape(x, training=training)
-        x = self.softmax(x, training=training)
-        return self.mean(x, training=training)
-    
-    def train_step(self, data):
-        x, y = data
-        y_transformed = self.transform(y)
-        
-        with tf.GradientTape() as tape:
-            features = self.dense(x, training=True)
-            features = self.reshape(features, training=True)
-            hist = self.softmax(features, training=True)
-            loss = keras.losses.categorical_crossentropy(y_transformed, hist)
-        
-        trainable_vars = self.trainable_variables
-        gradients = tape.gradient(loss, trainable_vars)
-        
-        self.optimizer.apply_gradients(zip(gradients, trainable_vars))
-
-        y_pred = self.mean(hist)
-        self.compiled_metrics.update_state(y, y_pred)
-        self.hist_loss.update_state(loss)
-
-        return {m.name: m.result() for m in self.metrics}
-    
-    def test_step(self, data):
-        x, y = data
-        y_transformed = self.transform(y)
-        
-        
-        features = self.dense(x, training=False)
-        features = self.reshape(features, training=False)
-        hist = self.softmax(features, training=False)
-        
-        loss = keras.losses.categorical_crossentropy(y_transformed, hist)
-        self.hist_loss.update_state(loss)
-
-        y_pred = self.mean(hist)
-        self.compiled_metrics.update_state(y, y_pred)
-        
-        return {m.name: m.result() for m in self.metrics}
-        
-    
+    def __init__(self, units, normalize=False, kernel_size=None, name="LTSFModel"):
+        super().__init__(name=name)
+        self.normalize = normalize
+        if kernel_size is None:
+            self.decomp = None
+            self.dense = layers.Dense(units)
+        else:
+            self.decomp = Decomposition(kernel_size)
+            self.seasonal = layers.Dense(units)
+            self.trend = layers.Dense(units)
+
+    def get_last(self, inputs):
+        """Return the offset removed from the inputs; shape (batchsize, 1)."""
+        if self.normalize:
+            return inputs[:, -1:]
+        return tf.zeros_like(inputs[:, -1:])
+
+    def features(self, inputs, training=None):
+        """Apply the linear layer(s) to the (offset) inputs."""
+        if self.decomp is None:
+            return self.dense(inputs, training=training)
+        seasonal, trend = self.decomp(inputs)
+        return self.seasonal(seasonal, training=training) + self.trend(trend, training=training)
+
+
+class LTSF_L2(LTSFModel):
+    """LTSF-Linear model trained with the squared error.
 
-class HyperLinear_HL(kt.HyperModel):
-    def __init__(self, y_min, y_max, name="HyperLinear_HL", input_length=256, output_length=256, metrics=None, ):
-        super().__init__(name, True)
-        self.metrics = metrics
-        self.input_length = input_length
-        self.output_length = output_length
-        self.y_min = y_min
-        self.y_max = y_max
-        
-        
-    def build(self, hp):
-        model = self.get_model(hp)
-        lr = hp.Float("learning_rate", default=1e-3, min_value=1e-4, max_value=1e-2, step=10, sampling="log")
-        b1 = hp.Fixed("beta_1", 0.9)
-        b2 = hp.Fixed("beta_2", 0.999)
-        eps = hp.Fixed("epsilon", 1e-7)
-        model.compile(
-            loss=keras.losses.CategoricalCrossentropy(),
-            optimizer = keras.optimizer.Adam(learning_rate = lr, beta_1=b1, beta_2=b2, epsilon=eps),
-            metrics=self.metrics
-        )
-        return model
-    
-    def get_model(self, hp):
-        sig_ratio = hp.Float("sig_ratio", default=1., min_value=0.5, max_value=2., step=2, sampling="log")
-        padding = hp.Float("padding", default=0.1, min_value=0.025, max_value=0.1, step=2, sampling="log")
-        n_bins = int(hp.Int("n_bins", default=100, min_value=25, max_value=400, step=2, sampling="log"))
-        
-        return Linear_HL(self.y_min, self.y_max, padding, n_bins, sig_ratio, self.input_length, self.output_length)
-        
+    Params:
+        output_length - the number of predicted timesteps
+        **kwargs - arguments for the LTSFModel class
+    """
 
+    def __init__(self, output_length, **kwargs):
+        super().__init__(output_length, **kwargs)
+        self.l2_loss = keras.metrics.Mean("loss")
 
-        
-class NLinear_L2(keras.Model):
-    def __init__(self, input_length, output_length, name="NLinear_L2"):
-        super().__init__()
-        self.dense = layers.Dense(output_length)
-        self.NLinear_loss = keras.metrics.Mean("loss")
-            
     def call(self, inputs, training=None):
-        seq_last = inputs[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(inputs))
-        x = inputs - seq_last
-        x = self.dense(x, training=training)
-        return x + seq_last
-    
+        seq_last = self.get_last(inputs)
+        return self.features(inputs - seq_last, training=training) + seq_last
+
     def train_step(self, data):
         x, y = data
-        seq_last = x[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(x))
-        
-        with tf.GradientTape as tape:
-            features = x - seq_last
-            features = self.dense(x, training=True)
-            predictions = x + seq_last
+
+        with tf.GradientTape() as tape:
+            predictions = self(x, training=True)
             loss = keras.losses.mean_squared_error(y, predictions)
-            
-        
+
         trainable_vars = self.trainable_variables
         gradients = tape.gradient(loss, trainable_vars)
-        
+
         self.optimizer.apply_gradients(zip(gradients, trainable_vars))
 
-        
         self.compiled_metrics.update_state(y, predictions)
-        self.NLinear_loss.update_state(loss)
+        self.l2_loss.update_state(loss)
 
         return {m.name: m.result() for m in self.metrics}
-    
+
     def test_step(self, data):
         x, y = data
-        seq_last = x[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(x))
-        
-        features = x - seq_last
-        features = self.dense(x, training=False)
-        predictions = x + seq_last
-        
+        predictions = self(x, training=False)
+
         loss = keras.losses.mean_squared_error(y, predictions)
-        
-        self.NLinear_loss.update_state(loss)
+        self.l2_loss.update_state(loss)
 
         self.compiled_metrics.update_state(y, predictions)
-        
+
         return {m.name: m.result() for m in self.metrics}
-    
-    
-    
-class HyperNLinear_L2(kt.HyperModel):
-    def __init__(self, name="HyperNLinear_L2", input_length=256, output_length=256, metrics=None):
-        super().__init__(name, True)
-        self.input_length = input_length
-        self.output_length = output_length
-        self.metrics = metrics 
-        
-    def build(self, hp):
-        model = NLinear_L2(self.input_length, self.output_length)
-        lr = hp.Float("learning_rate", default=1e-3, min_value=1e-4, max_value=1e-2, step=10, sampling="log")
-        b1 = hp.Fixed("beta_1", 0.9)
-        b2 = hp.Fixed("beta_2", 0.999)
-        eps = hp.Fixed("epsilon", 1e-7)
-        model.compile(
-            loss=keras.losses.CategoricalCrossentropy(),
-            optimizer = keras.optimizer.Adam(learning_rate = lr, beta_1=b1, beta_2=b2, epsilon=eps),
-            metrics=self.metrics
-        )
-        return model
-    
 
 
-class NLinear_HL(keras.Model):
-    def __init__(self, y_min, y_max, padding, n_bins, sigma, input_length, output_length, name="NLinear_HL"):
-        super().__init__()
-        y_range = y_max-y_min
-        centers = tf.linspace(y_min-(y_range*padding), y_max+(y_range*padding), n_bins)
-        self.dense = layers.Dense(output_length*tf.size(centers))
-        self.transform = TruncGaussHistTransform(centers, sigma)
-        self.reshape = layers.Reshape((output_length, tf.size(centers)))
+class LTSF_HL(LTSFModel):
+    """LTSF-Linear model trained with the HL-Gaussian loss.
+
+    Params:
+        y_min - the minimum target value
+        y_max - the maximum target value
+        padding - the padding added to each side of the histogram as a proportion of the target range
+        n_bins - the number of histogram bins
+        sig_ratio - the ratio of sigma to the bin width
+        output_length - the number of predicted timesteps
+        **kwargs - arguments for the LTSFModel class
+    """
+
+    def __init__(self, y_min, y_max, padding, n_bins, sig_ratio, output_length, **kwargs):
+        super().__init__(output_length * n_bins, **kwargs)
+        y_range = y_max - y_min
+        borders = tf.linspace(y_min - (y_range * padding), y_max + (y_range * padding), n_bins + 1)
+        borders = tf.cast(tf.expand_dims(borders, -1), tf.float32)
+        centers = (borders[:-1] + borders[1:]) / 2
+        sigma = sig_ratio * (borders[1] - borders[0])
+
+        self.transform = TruncGaussHistTransform(borders, sigma)
+        self.reshape = layers.Reshape((output_length, n_bins))
         self.softmax = layers.Softmax()
         self.mean = HistMean(centers)
         self.hist_loss = keras.metrics.Mean("loss")
-        
-    
+
+    def get_hist(self, inputs, training=None):
+        """Return the binned probability vectors of the (offset) inputs."""
+        features = self.features(inputs, training=training)
+        features = self.reshape(features)
+        return self.softmax(features)
+
     def call(self, inputs, training=None):
-        seq_last = inputs[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(inputs))
-        x = inputs - seq_last
-        x = self.dense(x, training=training)
-        x = self.reshape(x, training=training)
-        x = self.softmax(x, training=training)
-        return self.mean(x, training=training) + seq_last
-    
+        seq_last = self.get_last(inputs)
+        hist = self.get_hist(inputs - seq_last, training=training)
+        return self.mean(hist) + seq_last
+
     def train_step(self, data):
-        inputs, outputs = data
-        
-        seq_last = inputs[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(inputs))
-        x = inputs - seq_last
-        
-        y = outputs - seq_last
-        y_transformed = self.transform(y)
-        
+        x, y = data
+        seq_last = self.get_last(x)
+        y_transformed = self.transform(y - seq_last)
+
         with tf.GradientTape() as tape:
-            features = self.dense(x, training=True)
-            features = self.reshape(features, training=True)
-            hist = self.softmax(features, training=True)
+            hist = self.get_hist(x - seq_last, training=True)
             loss = keras.losses.categorical_crossentropy(y_transformed, hist)
-        
+
         trainable_vars = self.trainable_variables
         gradients = tape.gradient(loss, trainable_vars)
-        
+
         self.optimizer.apply_gradients(zip(gradients, trainable_vars))
 
-        y_pred = self.mean(hist)
+        y_pred = self.mean(hist) + seq_last
         self.compiled_metrics.update_state(y, y_pred)
         self.hist_loss.update_state(loss)
 
         return {m.name: m.result() for m in self.metrics}
-    
+
     def test_step(self, data):
-        inputs, outputs = data
-        
-        seq_last = inputs[:,-1].numpy()[:,np.newaxis]*np.ones(tf.size(inputs))
-        x = inputs - seq_last
-        
-        y = outputs - seq_last
-        y_transformed = self.transform(y)
-        
-        
-        features = self.dense(x, training=False)
-        features = self.reshape(features, training=False)
-        hist = self.softmax(features, training=False)
-        
+        x, y = data
+        seq_last = self.get_last(x)
+        y_transformed = self.transform(y - seq_last)
+
+        hist = self.get_hist(x - seq_last, training=False)
+
         loss = keras.losses.categorical_crossentropy(y_transformed, hist)
         self.hist_loss.update_state(loss)
 
-        y_pred = self.mean(hist)
+        y_pred = self.mean(hist) + seq_last
         self.compiled_metrics.update_state(y, y_pred)
-        
+
         return {m.name: m.result() for m in self.metrics}
-    
-    
-    
 
-class HyperNLinear_HL(kt.HyperModel):
-    def __init__(self, y_min, y_max, name="Hyper_NLinear_HL", input_length=256, output_length=256, metrics=None, ):
+
+class Linear_L2(LTSF_L2):
+    def __init__(self, input_length, output_length, name="Linear_L2"):
+        super().__init__(output_length, name=name)
+
+
+class NLinear_L2(LTSF_L2):
+    def __init__(self, input_length, output_length, name="NLinear_L2"):
+        super().__init__(output_length, normalize=True, name=name)
+
+
+class DLinear_L2(LTSF_L2):
+    def __init__(self, input_length, output_length, kernel_size=25, name="DLinear_L2"):
+        super().__init__(output_length, kernel_size=kernel_size, name=name)
+
+
+class Linear_HL(LTSF_HL):
+    def __init__(self, y_min, y_max, padding, n_bins, sig_ratio, input_length, output_length, name="Linear_HL"):
+        super().__init__(y_min, y_max, padding, n_bins, sig_ratio, output_length, name=name)
+
+
+class NLinear_HL(LTSF_HL):
+    def __init__(self, y_min, y_max, padding, n_bins, sig_ratio, input_length, output_length, name="NLinear_HL"):
+        super().__init__(y_min, y_max, padding, n_bins, sig_ratio, output_length, normalize=True, name=name)
+
+
+class DLinear_HL(LTSF_HL):
+    def __init__(self, y_min, y_max, padding, n_bins, sig_ratio, input_length, output_length, kernel_size=25, name="DLinear_HL"):
+        super().__init__(y_min, y_max, padding, n_bins, sig_ratio, output_length, kernel_size=kernel_size, name=name)
+
+
+class HyperLTSF(kt.HyperModel):
+    """Hypermodel that builds and compiles the LTSF-Linear models.
+
+    Params:
+        name - the name of the hypermodel
+        input_length - the number of input timesteps
+        output_length - the number of predicted timesteps
+        metrics - the metrics to compile the model with
+        jit_compile - True if the train and test steps are compiled with XLA
+    """
+
+    def __init__(self, name="HyperLTSF", input_length=256, output_length=256, metrics=None, jit_compile=True):
         super().__init__(name, True)
         self.metrics = metrics
         self.input_length = input_length
         self.output_length = output_length
-        self.y_min = y_min
-        self.y_max = y_max
-        
-        
+        self.jit_compile = jit_compile
+
     def build(self, hp):
         model = self.get_model(hp)
         lr = hp.Float("learning_rate", default=1e-3, min_value=1e-4, max_value=1e-2, step=10, sampling="log")
@@ -345,21 +254,82 @@ class HyperNLinear_HL(kt.HyperModel):
         b2 = hp.Fixed("beta_2", 0.999)
         eps = hp.Fixed("epsilon", 1e-7)
         model.compile(
-            loss=keras.losses.CategoricalCrossentropy(),
-            optimizer = keras.optimizer.Adam(learning_rate = lr, beta_1=b1, beta_2=b2, epsilon=eps),
-            metrics=self.metrics
+            optimizer = keras.optimizers.Adam(learning_rate = lr, beta_1=b1, beta_2=b2, epsilon=eps),
+            metrics=self.metrics,
+            jit_compile=self.jit_compile
         )
         return model
-    
+
     def get_model(self, hp):
+        """Return the Keras model"""
+        pass
+
+
+class HyperLTSF_HL(HyperLTSF):
+    """Hypermodel for the LTSF-Linear models with the HL-Gaussian loss.
+
+    Params:
+        y_min - the minimum target value
+        y_max - the maximum target value
+        **kwargs - arguments for the HyperLTSF class
+    """
+
+    def __init__(self, y_min, y_max, **kwargs):
+        super().__init__(**kwargs)
+        self.y_min = y_min
+        self.y_max = y_max
+
+    def get_hl_args(self, hp):
+        """Return the histogram arguments according to the hyperparameters."""
         sig_ratio = hp.Float("sig_ratio", default=1., min_value=0.5, max_value=2., step=2, sampling="log")
         padding = hp.Float("padding", default=0.1, min_value=0.025, max_value=0.1, step=2, sampling="log")
         n_bins = int(hp.Int("n_bins", default=100, min_value=25, max_value=400, step=2, sampling="log"))
-        
-        return NLinear_HL(self.y_min, self.y_max, padding, n_bins, sig_ratio, self.input_length, self.output_length)
-        
-    
-
-        
-        
-    
\ No newline at end of file
+        return self.y_min, self.y_max, padding, n_bins, sig_ratio, self.input_length, self.output_length
+
+
+class HyperLinear_L2(HyperLTSF):
+    def __init__(self, name="Linear_l2", **kwargs):
+        super().__init__(name, **kwargs)
+
+    def get_model(self, hp):
+        return Linear_L2(self.input_length, self.output_length)
+
+
+class HyperNLinear_L2(HyperLTSF):
+    def __init__(self, name="HyperNLinear_L2", **kwargs):
+        super().__init__(name, **kwargs)
+
+    def get_model(self, hp):
+        return NLinear_L2(self.input_length, self.output_length)
+
+
+class HyperDLinear_L2(HyperLTSF):
+    def __init__(self, name="HyperDLinear_L2", **kwargs):
+        super().__init__(name, **kwargs)
+
+    def get_model(self, hp):
+        return DLinear_L2(self.input_length, self.output_length)
+
+
+class HyperLinear_HL(HyperLTSF_HL):
+    def __init__(self, y_min, y_max, name="HyperLinear_HL", **kwargs):
+        super().__init__(y_min, y_max, name=name, **kwargs)
+
+    def get_model(self, hp):
+        return Linear_HL(*self.get_hl_args(hp))
+
+
+class HyperNLinear_HL(HyperLTSF_HL):
+    def __init__(self, y_min, y_max, name="Hyper_NLinear_HL", **kwargs):
+        super().__init__(y_min, y_max, name=name, **kwargs)
+
+    def get_model(self, hp):
+        return NLinear_HL(*self.get_hl_args(hp))
+
+
+class HyperDLinear_HL(HyperLTSF_HL):
+    def __init__(self, y_min, y_max, name="HyperDLinear_HL", **kwargs):
+        super().__init__(y_min, y_max, name=name, **kwargs)
+
+    def get_model(self, hp):
+        return DLinear_HL(*self.get_hl_args(hp))
@@ -47,6 +47,24 @@ def get_ETT_split(data, filename, seq_len):
     return train, val, test
 
 
+def get_normalization_stats(df, eps=1e-08):
+    """Return the per-channel statistics used to normalize a time series.
+    Matches the normalization applied by get_time_series_dataset, so the stats
+    can be frozen and reused for online inference.
+
+    Params:
+        df - a Tensor of shape (timesteps, channels) with the raw data
+        eps - a small constant added to the standard deviation
+
+    Returns: mu, scale
+        mu - a Tensor with the mean of each channel
+        scale - a Tensor with the standard deviation (plus eps) of each channel
+    """
+    mu = tf.reduce_mean(df, axis=0)
+    sig = tf.math.reduce_std(df, axis=0)
+    return mu, sig + eps
+
+
 def get_time_series_dataset(filename, drop=[], seq_len=720, batch_size=64, chans=7, input_target_offset=0,eps=1e-08,univariate=True):
     """Return the train/test split for a CSV time series dataset.
     Uses 12-4 month split to be comparable to standard 12-4-4 train-val-test for ETTh datasets.
@@ -76,9 +94,7 @@ def get_time_series_dataset(filename, drop=[], seq_len=720, batch_size=64, chans
     df = df.drop(drop, axis = 1)
     df = tf.convert_to_tensor(df, dtype=tf.float32)
 
-    mu = tf.reduce_mean(df, axis=0)
-    sig = tf.math.reduce_std(df, axis=0)
-    scale = sig + eps
+    mu, scale = get_normalization_stats(df, eps)
     df = (df - mu) / scale
     df_inputs = df[:-(seq_len+input_target_offset)]
     df_targets = df[(seq_len+input_target_offset):]
@@ -135,11 +151,13 @@ class TSDataset(Dataset):
         df = df.drop(self.drop, axis=1)
 
         self.n = len(df) - (self.seq_len + self.pred_len - self.overlap) + 1
+        self.length = self.n
 
         if self.mode == 'S':
             df = df[self.targets]
 
         tensor = tf.convert_to_tensor(df, dtype=tf.float32)
+        self.x_series = tensor
         base = tf.data.Dataset.from_tensor_slices(tensor)
         x = base.window(self.seq_len, shift=1).flat_map(lambda x: x.batch(self.seq_len, drop_remainder=True)).take(self.n)
         
@@ -147,14 +165,32 @@ class TSDataset(Dataset):
             df = df[self.targets]
             tensor = tf.convert_to_tensor(df, dtype=tf.float32)
             base = tf.data.Dataset.from_tensor_slices(tensor)
+        self.y_series = tensor
 
         y = base.skip(self.seq_len - self.overlap).window(self.pred_len, shift=1).flat_map(lambda x: x.batch(self.pred_len, drop_remainder=True))
-        self.ds = tf.data.Dataset.zip((x, y))
+        self.ds = tf.data.Dataset.zip((x, y)).apply(tf.data.experimental.assert_cardinality(self.n))
+
+    def get_window(self, i):
+        """Return the input and target windows of the sample starting at timestep i."""
+        x = self.x_series[i:i + self.seq_len]
+        start = i + self.seq_len - self.overlap
+        y = self.y_series[start:start + self.pred_len]
+        # Slicing with a tensor index loses the window lengths
+        x = tf.ensure_shape(x, (self.seq_len,) + tuple(self.x_series.shape[1:]))
+        y = tf.ensure_shape(y, (self.pred_len,) + tuple(self.y_series.shape[1:]))
+        return x, y
+
+    def select(self, data, indices):
+        """Return a dataset with the windows starting at the given indices.
+        The windows are sliced directly from the series instead of materializing
+        every (overlapping) window.
+        
+        Params:
+            data - the tf.data.Dataset of windows (unused)
+            indices - an array of sample indices
+        """
+        return self.index_dataset(indices).map(self.get_window, num_parallel_calls=tf.data.AUTOTUNE)
 
     def get_data(self):
         """Return the loaded data"""
         return self.ds
-    
-    def __len__(self):
-        """Return the length of the dataset"""
-        return self.n
@@ -0,0 +1,83 @@
+"""Benchmark comparing the HL heads for multivariate forecasting.
+
+Compares the per-channel MultiDense head with the LowRankDense head that shares
+its projection across channels and horizons. Reports the number of parameters,
+the memory used by the parameters, the FLOPs per sample, and the measured time of
+a training step on random features.
+
+Usage:
+    python head_benchmark.py [rank]
+
+Params:
+    rank - the rank of the shared projection (default 32)
+"""
+
+import sys
+import time
+import tensorflow as tf
+from experiment.multidense import MultiDense, LowRankDense
+
+
+def dense_cost(chans, features, pred_len, n_bins):
+    """Return the number of parameters and the FLOPs per sample of the MultiDense head."""
+    params = chans * features * pred_len * n_bins + chans * pred_len * n_bins
+    flops = 2 * chans * features * pred_len * n_bins
+    return params, flops
+
+
+def low_rank_cost(chans, features, pred_len, n_bins, rank):
+    """Return the number of parameters and the FLOPs per sample of the LowRankDense head."""
+    params = features * rank + rank * pred_len * n_bins + chans * rank + chans * pred_len * n_bins
+    flops = 2 * chans * features * rank + 2 * chans * rank * pred_len * n_bins
+    return params, flops
+
+
+def time_head(layer, chans, features, batch_size=32, steps=20):
+    """Return the mean time in seconds of a forward and backward pass through a head.
+
+    Params:
+        layer - the head layer to time
+        chans - the number of channels
+        features - the number of features per channel produced by the base model
+        batch_size - the number of samples per batch
+        steps - the number of timed steps
+    """
+    x = tf.random.normal((batch_size, chans, features))
+
+    @tf.function
+    def step(x):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_sum(tf.nn.softmax(layer(x)))
+        return tape.gradient(loss, layer.trainable_variables)
+
+    step(x)
+    start = time.perf_counter()
+    for i in range(steps):
+        step(x)
+    return (time.perf_counter() - start) / steps
+
+
+def main(rank=32):
+    """Print the cost of both heads for typical channel counts and horizons."""
+    n_bins = 100
+    features = 512
+    max_params = 2e8
+    # (chans, pred_len) for ETT, Weather, Electricity, and Traffic sized problems
+    configs = [(7, 96), (7, 720), (21, 720), (321, 720), (862, 720)]
+
+    print(f"{'chans':>6} {'pred_len':>8} {'head':>9} {'params':>14} {'MB':>10} {'MFLOPs':>10} {'ms/step':>9}")
+    for chans, pred_len in configs:
+        heads = [
+            ("dense", dense_cost(chans, features, pred_len, n_bins), lambda: MultiDense((pred_len, n_bins))),
+            ("low-rank", low_rank_cost(chans, features, pred_len, n_bins, rank), lambda: LowRankDense((pred_len, n_bins), rank))
+        ]
+        for name, (params, flops), get_layer in heads:
+            if params <= max_params:
+                ms = f"{1000 * time_head(get_layer(), chans, features):9.2f}"
+            else:
+                ms = f"{'-':>9}"
+            print(f"{chans:>6} {pred_len:>8} {name:>9} {params:>14,} {4 * params / 2**20:>10.1f} {flops / 1e6:>10.1f} {ms}")
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
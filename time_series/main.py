@@ -10,7 +10,7 @@ Params:
 import tensorflow as tf
 from tensorflow import keras
 from experiment.models import HLGaussian, Regression
-from time_series.base_models import transformer, linear, lstm_encdec
+from time_series.base_models import transformer, linear, lstm_encdec, independent_dense, dependent_dense
 import json
 from experiment.bins import get_bins
 from time_series.datasets import get_time_series_dataset
@@ -45,16 +45,17 @@ def training(model,train,test,epochs,optimizer,pred_len,loss):
         wandb.log(res)
     wandb.run.summary["mse_test_loss"] = test_mse_acc.numpy().item()
     wandb.run.summary["mae_test_loss"] = test_mae_acc.numpy().item()
+    results = {"mse_test_loss": test_mse_acc.numpy().item(), "mae_test_loss": test_mae_acc.numpy().item()}
     ### Log the predictions on one batch of the test data
     for test_step,(x_batch_val, y_batch_val) in enumerate(test):
             test_pred = model(x_batch_val, training=False)
             for i in range(len(test_pred)):
                 wandb.log({"test_prediction":test_pred[i].numpy().item(),"test_target":y_batch_val[i].numpy().item()})
             break
-    return
+    return results
     
-def main(base_model, loss):
-    """Run the time series experiment.
+def get_configs(base_model, loss):
+    """Return the configuration of the time series experiment.
     
     Params:
         base_model(str):  Name of the base model
@@ -68,6 +69,7 @@ def main(base_model, loss):
         sig_ratio: Sigma ratio of the discretized histogram transform
         pad_ratio: Padding ratio of the discretized histogram transform
         n_bins: Number of bins in the discretized histogram
+        head_rank: Rank of the HL head projection shared across channels (None for a separate kernel per channel)
         chans: Number of variables in the dataset
         test_ratio: Ratio of test data to train data
         batch_size: Batch Size for the training
@@ -96,6 +98,7 @@ def main(base_model, loss):
     "sig_ratio" : 2.,
     "pad_ratio" : 3.,
     "n_bins" : 100,
+    "head_rank" : None,
     "chans" : 1, # the number of target prediction variables
     "input_channels":7,
     "head_size" : 256,
@@ -112,41 +115,68 @@ def main(base_model, loss):
     "loss":loss,
     "univariate":True, ## code is only doing univariate for now
     }
-    for dataset in configs["datasets"]:
-        configs["dataset"] = dataset
-        keras.utils.set_random_seed(1)
-        data_path = f"{dataset}.csv"
-        train, test, dmin, dmax = get_time_series_dataset(data_path, configs["drop"], configs["seq_len"], configs["batch_size"], configs["chans"], configs["input_target_offset"],configs["univariate"])
+    return configs
 
-        borders, sigma = get_bins(configs["n_bins"], configs["pad_ratio"], configs["sig_ratio"], dmin, dmax)
-        borders = tf.expand_dims(borders, -1)
-        sigma = tf.expand_dims(sigma, -1)
 
-        shape = train.element_spec[0].shape[1:]
+def run_dataset(dataset, configs):
+    """Train and evaluate one model on one dataset.
+    
+    Params:
+        dataset(str): Name of the dataset; the data is read from {dataset}.csv
+        configs(dict): The experiment configuration from get_configs
+    
+    Returns: a dict with the final test metrics
+    """
+    base_model = configs["base_model"]
+    loss = configs["loss"]
+    configs = dict(configs, dataset=dataset)
+    keras.utils.set_random_seed(1)
+    data_path = f"{dataset}.csv"
+    train, test, dmin, dmax = get_time_series_dataset(data_path, configs["drop"], configs["seq_len"], configs["batch_size"], configs["chans"], configs["input_target_offset"],configs["univariate"])
+
+    borders, sigma = get_bins(configs["n_bins"], configs["pad_ratio"], configs["sig_ratio"], dmin, dmax)
+    borders = tf.expand_dims(borders, -1)
+    sigma = tf.expand_dims(sigma, -1)
+
+    shape = train.element_spec[0].shape[1:]
+
+    out_shape = (configs["pred_len"],)
+    if base_model == "transformer":
+        base = transformer(shape, configs["chans"],configs["head_size"], configs["n_heads"], configs["features"])
+    elif base_model == "LSTM":
+        #out_shape = (configs["chans"], configs["pred_len"])
+        base = lstm_encdec(configs["width"],configs["chans"],configs["layers"], 0.5, shape)
+    elif base_model == "linear":
+        base = linear(configs["input_channels"], configs["seq_len"],n_variates=configs["chans"])
+    elif base_model == "independent_dense":
+        base = independent_dense(configs["chans"], configs["seq_len"])
+    else:
+        base = dependent_dense(configs["chans"], configs["seq_len"])
+    
+    mse = tf.keras.losses.MeanSquaredError()
+    optimizer = keras.optimizers.Adam(configs["lr"])
+    
+    loss_model = None  
+    if loss == "HL":
+        loss_model = HLGaussian(base, borders, sigma, out_shape=out_shape, rank=configs["head_rank"])    
+    else:
+        loss_model = Regression(base, out_shape=out_shape)    
+    wandb.init(config=configs, project="hl_loss_results")
+    results = training(loss_model,train,test,configs["epochs"],optimizer,configs["pred_len"],mse) 
+    wandb.finish()
+    return results
+
+
+def main(base_model, loss):
+    """Run the time series experiment on every dataset in sequence.
+    
+    Params:
+        base_model(str):  Name of the base model
+        loss(str): Name of loss, either HL or L2
+    """
+    configs = get_configs(base_model, loss)
+    for dataset in configs["datasets"]:
+        run_dataset(dataset, configs)
 
-        out_shape = (configs["pred_len"],)
-        if base_model == "transformer":
-            base = transformer(shape, configs["chans"],configs["head_size"], configs["n_heads"], configs["features"])
-        elif base_model == "LSTM":
-            #out_shape = (configs["chans"], configs["pred_len"])
-            base = lstm_encdec(configs["width"],configs["chans"],configs["layers"], 0.5, shape)
-        elif base_model == "linear":
-            base = linear(configs["input_channels"], configs["seq_len"],n_variates=configs["chans"])
-        elif base_model == "independent_dense":
-            base = independent_dense(configs["chans"], configs["seq_len"])
-        else:
-            base = dependent_dense(configs["chans"], configs["seq_len"])
-        
-        mse = tf.keras.losses.MeanSquaredError()
-        optimizer = keras.optimizers.Adam(configs["lr"])
-        
-        loss_model = None  
-        if loss == "HL":
-            loss_model = HLGaussian(base, borders, sigma, out_shape=out_shape)    
-        else:
-            loss_model = Regression(base, out_shape=out_shape)    
-        wandb.init(config=configs, project="hl_loss_results")
-        training(loss_model,train,test,configs["epochs"],optimizer,configs["pred_len"],mse) 
-        wandb.finish()
 if __name__ == "__main__":
     main(sys.argv[1], sys.argv[2])
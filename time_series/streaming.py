@@ -0,0 +1,132 @@
+"""Module for running trained time series models on live feeds.
+
+Keeps a ring buffer with the last seq_len normalized observations of each series
+so that a new prediction only requires writing the newest observation instead of
+rebuilding the full input window.
+"""
+
+import numpy as np
+import tensorflow as tf
+from experiment.models import HistModel
+
+
+class StreamingForecaster:
+    """Incremental inference for many concurrent time series.
+
+    Observations are normalized with frozen statistics (see
+    time_series.datasets.get_normalization_stats) and written into a
+    (n_series, seq_len, channels) ring buffer. Predictions for any subset of
+    the series are computed in batches with a single traced model call.
+
+    Params:
+        model - the trained Regression or HistModel (e.g. HLGaussian) model
+        mu - the per-channel means used to normalize the training data
+        scale - the per-channel scales used to normalize the training data
+        seq_len - the number of input timesteps the model expects
+        n_series - the number of concurrent series to track
+        target - the index of the predicted channel; used to denormalize the outputs
+        batch_size - the maximum number of series passed to the model at once
+    """
+
+    def __init__(self, model, mu, scale, seq_len, n_series=1, target=-1, batch_size=1024) -> None:
+        self.model = model
+        self.mu = np.asarray(mu, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.seq_len = seq_len
+        self.n_series = n_series
+        self.target = target
+        self.batch_size = batch_size
+        self.chans = self.mu.shape[-1]
+
+        self.buffer = np.zeros((n_series, seq_len, self.chans), dtype=np.float32)
+        self.pos = np.zeros(n_series, dtype=np.int64)
+        self.count = np.zeros(n_series, dtype=np.int64)
+        self.offsets = np.arange(seq_len)
+
+        spec = tf.TensorSpec((None, seq_len, self.chans), tf.float32)
+        self.hist = isinstance(model, HistModel)
+        if self.hist:
+            self.forward = tf.function(self.hist_forward, input_signature=[spec])
+        else:
+            self.forward = tf.function(self.reg_forward, input_signature=[spec])
+
+    def hist_forward(self, x):
+        """Return the expected values and histograms for a batch of windows."""
+        hist = self.model.get_hist(x, training=False)
+        return self.model.mean(hist), hist
+
+    def reg_forward(self, x):
+        """Return the predictions for a batch of windows."""
+        return self.model(x, training=False), tf.zeros((0,))
+
+    def get_series(self, series):
+        """Return the series indices as an array; None selects every series."""
+        if series is None:
+            return np.arange(self.n_series)
+        return np.atleast_1d(np.asarray(series, dtype=np.int64))
+
+    def update(self, obs, series=None):
+        """Append one raw observation to each of the given series.
+
+        Params:
+            obs - an array of shape (len(series), channels) with the newest observations
+            series - the indices of the series being updated; None for all series
+        """
+        series = self.get_series(series)
+        obs = np.asarray(obs, dtype=np.float32).reshape(len(series), self.chans)
+        self.buffer[series, self.pos[series]] = (obs - self.mu) / self.scale
+        self.pos[series] = (self.pos[series] + 1) % self.seq_len
+        self.count[series] += 1
+
+    def warm_up(self, history, series=None):
+        """Fill the buffers of the given series with the end of their raw history.
+
+        Params:
+            history - an array of shape (len(series), timesteps, channels)
+            series - the indices of the series to fill; None for all series
+        """
+        series = self.get_series(series)
+        history = np.asarray(history, dtype=np.float32)[:, -self.seq_len:]
+        n = history.shape[1]
+        self.buffer[series, :n] = (history - self.mu) / self.scale
+        self.pos[series] = n % self.seq_len
+        self.count[series] = n
+
+    def ready(self, series=None):
+        """Return a boolean array that is True for series with a full window."""
+        return self.count[self.get_series(series)] >= self.seq_len
+
+    def windows(self, series=None):
+        """Return the normalized input windows of the given series in time order.
+
+        Returns: an array of shape (len(series), seq_len, channels)
+        """
+        series = self.get_series(series)
+        idx = (self.pos[series, np.newaxis] + self.offsets) % self.seq_len
+        return self.buffer[series[:, np.newaxis], idx]
+
+    def predict(self, series=None):
+        """Predict the next target for the given series.
+
+        Params:
+            series - the indices of the series to predict; None for all series
+
+        Returns: mean, hist
+            mean - the denormalized predictions for each series
+            hist - the predicted bin probabilities (normalized scale) for each series;
+                None if the model does not use a histogram loss
+        """
+        x = self.windows(series)
+        means, hists = [], []
+        for i in range(0, len(x), self.batch_size):
+            mean, hist = self.forward(tf.convert_to_tensor(x[i:i + self.batch_size]))
+            means.append(mean.numpy())
+            hists.append(hist.numpy())
+        mean = np.concatenate(means) * self.scale[self.target] + self.mu[self.target]
+        hist = np.concatenate(hists) if self.hist else None
+        return mean, hist
+
+    def step(self, obs, series=None):
+        """Append the newest observations and return the predictions for those series."""
+        self.update(obs, series)
+        return self.predict(series)
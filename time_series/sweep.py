@@ -0,0 +1,124 @@
+"""Module for running time series sweeps concurrently.
+
+Runs every (dataset, base model, loss) job from main.py in its own worker process
+with a fixed number of TensorFlow threads, so that a full sweep uses all of the
+cores of a CPU node instead of running one job at a time.
+
+Usage:
+    python sweep.py n_workers [outfile]
+
+Params:
+    n_workers - the number of jobs to run at the same time
+    outfile - the JSON file in which the results of all jobs are stored
+"""
+
+import os
+import sys
+import json
+import itertools
+import multiprocessing as mp
+
+
+MODELS = ["transformer", "LSTM", "linear", "independent_dense", "dependent_dense"]
+LOSSES = ["HL", "L2"]
+
+
+def init_worker(intra_threads, inter_threads):
+    """Pin the number of TensorFlow threads used by a worker process.
+    Must run before TensorFlow executes any operation in the process.
+
+    Params:
+        intra_threads - the number of threads used within a single operation
+        inter_threads - the number of operations that can run in parallel
+    """
+    os.environ["OMP_NUM_THREADS"] = str(intra_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+
+def run_job(job):
+    """Run one (dataset, base_model, loss) job and return its results.
+
+    Params:
+        job - a (dataset, base_model, loss) tuple
+
+    Returns: job, results - the job and a dict with its final test metrics
+    """
+    from time_series.main import get_configs, run_dataset
+    dataset, base_model, loss = job
+    configs = get_configs(base_model, loss)
+    return job, run_dataset(dataset, configs)
+
+
+def job_key(job):
+    """Return the key under which the results of a job are stored."""
+    dataset, base_model, loss = job
+    return f"{loss}_{dataset}_{base_model}"
+
+
+def get_jobs(datasets, models=MODELS, losses=LOSSES):
+    """Return every combination of the given datasets, base models, and losses."""
+    return list(itertools.product(datasets, models, losses))
+
+
+def load(outfile):
+    """Return the results stored in outfile; empty if it does not exist yet."""
+    if not os.path.exists(outfile):
+        return {}
+    with open(outfile, "r") as in_file:
+        return json.load(in_file)
+
+
+def save(outfile, results):
+    """Atomically write the results to outfile.
+
+    Params:
+        outfile - the file to save the results to
+        results - the dict with the results to save
+    """
+    temp_file = outfile + ".tmp"
+    with open(temp_file, "w") as out_file:
+        json.dump(results, out_file, indent=4)
+    os.replace(temp_file, outfile)
+
+
+def run(jobs, n_workers, outfile, threads=None, inter_threads=1):
+    """Run the jobs in a process pool and store their results in one file.
+    Jobs that already have results in outfile are skipped. Only the parent
+    process writes to outfile.
+
+    Params:
+        jobs - a list of (dataset, base_model, loss) tuples
+        n_workers - the number of worker processes
+        outfile - the JSON file in which the results are stored
+        threads - the number of intra-op threads per worker; None to split the cores evenly
+        inter_threads - the number of inter-op threads per worker
+
+    Returns: results - a dict with the results for each job
+    """
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // n_workers)
+    results = load(outfile)
+    todo = [job for job in jobs if job_key(job) not in results]
+
+    # Spawn fresh interpreters so each worker initializes TensorFlow with its own
+    # thread settings, and replace them after every job to release the model
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(n_workers, initializer=init_worker, initargs=(threads, inter_threads), maxtasksperchild=1) as pool:
+        for job, res in pool.imap_unordered(run_job, todo):
+            results[job_key(job)] = res
+            save(outfile, results)
+    return results
+
+
+def main(n_workers, outfile="time_series_sweep.json"):
+    """Run the sweep over all datasets, base models, and losses."""
+    from time_series.main import get_configs
+    datasets = get_configs(MODELS[0], LOSSES[0])["datasets"]
+    jobs = get_jobs(datasets)
+    run(jobs, n_workers, outfile)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), *sys.argv[2:])